@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Compares pyposterous.codec with cPickle and with parsing the original
+XML, for the responses in benchmarks/fixtures.
+
+For every fixture the size of the XML, the pickle (protocol 2) and the
+codec encoding is reported, along with the time it takes to get the
+objects back from each and to encode them. Unpickled objects don't have an
+API instance; the "+ api" column includes giving them one, which
+codec.loads does while it decodes.
+
+Usage: python benchmarks/codec.py [seconds per measurement]
+
+"""
+import cPickle
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+sys.path.insert(0, ROOT)
+
+from pyposterous import codec
+from pyposterous.models import PosterousData, field_names
+from pyposterous.parser import Parser
+
+def per_call(function, duration):
+    function()
+    calls = 0
+    started = time.time()
+    elapsed = 0
+    while elapsed < duration:
+        for i in range(10):
+            function()
+        calls += 10
+        elapsed = time.time() - started
+    return elapsed / calls * 1000
+
+def set_api(values, api):
+    """Gives the objects in values, and the objects in their attributes,
+    the API instance api."""
+    names = {}
+    stack = list(values)
+    while stack:
+        value = stack.pop()
+        if type(value) is list:
+            stack.extend(value)
+            continue
+        if not isinstance(value, PosterousData):
+            continue
+        object.__setattr__(value, '_PosterousData__api', api)
+        if type(value) not in names:
+            names[type(value)] = field_names(type(value))
+        for name in names[type(value)]:
+            try:
+                item = object.__getattribute__(value, name)
+            except AttributeError:
+                continue
+            if type(item) is list or isinstance(item, PosterousData):
+                stack.append(item)
+
+def main():
+    duration = 0.5
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+
+    print "%-16s %8s %8s %8s | %9s %9s %9s %9s %9s | %9s %9s" % ('fixture', 'xml', 'pickle', 'codec',
+        'parse', 'unpickle', '+ api', 'decode', 'buffers', 'pickle', 'encode')
+    for name in ('readposts_1.xml', 'readposts_10.xml', 'readposts_50.xml', 'getpost.xml', 'getsites.xml', 'gettags.xml'):
+        xml = open(os.path.join(FIXTURES, name)).read()
+        parse = lambda: Parser(None, StringIO(xml), ['force_list'], True).parse()
+        value = parse()
+        pickled = cPickle.dumps(value, 2)
+        encoded = codec.dumps(value)
+
+        print "%-16s %8d %8d %8d | %7.3fms %7.3fms %7.3fms %7.3fms %7.3fms | %7.3fms %7.3fms" % (name, len(xml), len(pickled), len(encoded),
+            per_call(parse, duration), per_call(lambda: cPickle.loads(pickled), duration),
+            per_call(lambda: set_api([cPickle.loads(pickled)], None), duration), per_call(lambda: codec.loads(encoded), duration), per_call(lambda: codec.loads(encoded, buffers=True), duration),
+            per_call(lambda: cPickle.dumps(value, 2), duration), per_call(lambda: codec.dumps(value), duration))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Compares utils.parse_date, the generic strptime based parser, with the
+parsers the models use for post dates and v2 timestamps.
+
+The dates are taken from the read_posts fixtures, so the mix of repeated and
+unique strings is what a page of posts and comments looks like.
+
+Usage: python benchmarks/dates.py [runs]
+
+"""
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pyposterous import utils
+
+def fixture_dates():
+    xml = open(os.path.join(ROOT, 'benchmarks', 'fixtures', 'readposts_50.xml')).read()
+    return re.findall(r'<date>(.*?)</date>', xml)
+
+def per_date(function, dates, runs):
+    """Returns the average time function takes per date."""
+    def parse_all():
+        for date in dates:
+            function(date)
+    return timeit.Timer(parse_all).timeit(runs) / (runs * len(dates))
+
+def uncached(function):
+    """Wraps function so that every call misses the date cache."""
+    def parse(date):
+        utils.DATE_CACHE.clear()
+        return function(date)
+    return parse
+
+def main():
+    runs = 200
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    dates = fixture_dates()
+    timestamps = ['Wed Jan 06 20:49:51 +0000 2010', 'Thu Feb 18 07:02:13 -0500 2010']
+
+    for date in dates:
+        assert utils.parse_post_date(date) == utils.parse_date(date), date
+    for timestamp in timestamps:
+        assert utils.parse_timestamp(timestamp) == utils.parse_date(timestamp, '%a %b %d %H:%M:%S %Y'), timestamp
+
+    print "%s dates from readposts_50.xml, %s unique" % (len(dates), len(set(dates)))
+    results = [
+        ('parse_date', per_date(utils.parse_date, dates, runs)),
+        ('parse_post_date (no cache)', per_date(uncached(utils.parse_post_date), dates, runs)),
+        ('parse_post_date (cached)', per_date(utils.parse_post_date, dates, runs)),
+        ('parse_date (timestamps)', per_date(lambda x: utils.parse_date(x, '%a %b %d %H:%M:%S %Y'), timestamps, runs)),
+        ('parse_timestamp (no cache)', per_date(uncached(utils.parse_timestamp), timestamps, runs)),
+    ]
+    for name, elapsed in results:
+        print "%-28s %7.2fus per date" % (name, elapsed * 1000000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""Writes the XML fixtures the benchmarks replay to benchmarks/fixtures.
+
+The fixtures follow the structure of real Posterous responses: v1 responses
+for getsites, gettags, readposts and getpost, and a v2 upload.xml response.
+The output is deterministic, so the files only change when this script does.
+
+Usage: python benchmarks/make_fixtures.py
+
+"""
+import os
+import random
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# read_posts page sizes with a fixture. 50 is the most Posterous returns.
+READ_POSTS_SIZES = (1, 10, 20, 50)
+
+WORDS = ('posterous python media upload photo album travel code weekend '
+    'coffee music video review notes release tip draft morning city').split()
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def words(rnd, count):
+    return ' '.join(rnd.choice(WORDS) for i in range(count))
+
+def date(rnd):
+    return "%s, %02d %s 2010 %02d:%02d:%02d %s" % (rnd.choice(DAYS), rnd.randint(1, 28), rnd.choice(MONTHS),
+        rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59), rnd.choice(('-0800', '+0000', '-0500', '+0100')))
+
+def image(tag, rnd, name):
+    return """<%(tag)s>
+        <url>http://posterous.com/getfile/files.posterous.com/pyposttest/%(name)s.jpg</url>
+        <filesize>%(size)s</filesize>
+        <width>%(width)s</width>
+        <height>%(height)s</height>
+      </%(tag)s>""" % {'tag':tag, 'name':name, 'size':rnd.randint(10, 900), 'width':rnd.randint(100, 500), 'height':rnd.randint(100, 500)}
+
+def media(rnd, post_id, index):
+    name = "%s-%s" % (post_id, index)
+    kind = rnd.choice(('image', 'image', 'audio', 'video'))
+    if kind == 'image':
+        return """
+    <media>
+      <type>image</type>
+      %s
+      %s
+    </media>""" % (image('medium', rnd, name + '-medium'), image('thumb', rnd, name + '-thumb'))
+    if kind == 'audio':
+        return """
+    <media>
+      <type>audio</type>
+      <url>http://posterous.com/getfile/files.posterous.com/pyposttest/%s.mp3</url>
+      <filesize>%s</filesize>
+    </media>""" % (name, rnd.randint(1000, 9000))
+    return """
+    <media>
+      <type>video</type>
+      <url>http://posterous.com/getfile/files.posterous.com/pyposttest/%(name)s.3gp</url>
+      <filesize>%(size)s</filesize>
+      <thumb>http://posterous.com/getfile/files.posterous.com/pyposttest/%(name)s-thumb.png</thumb>
+      <flv>http://posterous.com/getfile/files.posterous.com/pyposttest/%(name)s.flv</flv>
+      <mp4>http://posterous.com/getfile/files.posterous.com/pyposttest/%(name)s.mp4</mp4>
+    </media>""" % {'name':name, 'size':rnd.randint(1000, 90000)}
+
+def comment(rnd, comment_id):
+    return """
+    <comment>
+      <id>%s</id>
+      <body>%s</body>
+      <date>%s</date>
+      <author>%s</author>
+      <authorpic>http://posterous.com/images/profile/missing-user-75.png</authorpic>
+    </comment>""" % (comment_id, words(rnd, rnd.randint(3, 30)), date(rnd), words(rnd, 2).title())
+
+def post(rnd, post_id, num_comments=None, num_media=None):
+    if num_comments is None:
+        num_comments = rnd.choice((0, 0, 1, 2, 5))
+    if num_media is None:
+        num_media = rnd.choice((0, 1, 1, 3))
+    comments = [comment(rnd, post_id * 100 + i) for i in range(num_comments)]
+    attachments = [media(rnd, post_id, i) for i in range(num_media)]
+    return """
+  <post>
+    <url>http://post.ly/%(short)s</url>
+    <link>http://pyposttest.posterous.com/%(slug)s</link>
+    <title>%(title)s</title>
+    <id>%(id)s</id>
+    <body>
+      &lt;p&gt;%(body)s&lt;/p&gt;
+    </body>
+    <date>%(date)s</date>
+    <views>%(views)s</views>
+    <private>false</private>
+    <author>pyposttest</author>
+    <authorpic>http://posterous.com/images/profile/missing-user-75.png</authorpic>
+    <commentsenabled>true</commentsenabled>
+    <commentscount>%(commentscount)s</commentscount>%(media)s%(comments)s
+  </post>""" % {'short':"%x" % (post_id * 7919), 'slug':'-'.join(words(rnd, 3).split()), 'title':words(rnd, 4).capitalize(), 'id':post_id,
+        'body':words(rnd, rnd.randint(20, 200)), 'date':date(rnd), 'views':rnd.randint(0, 5000), 'commentscount':len(comments),
+        'media':''.join(attachments), 'comments':''.join(comments)}
+
+def rsp(content):
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<rsp stat="ok">%s\n</rsp>\n' % content
+
+def read_posts(size):
+    rnd = random.Random(size)
+    return rsp(''.join(post(rnd, 1000 + i) for i in range(size)))
+
+def get_post():
+    return rsp(post(random.Random('getpost'), 4242, 3, 2))
+
+def get_sites():
+    rnd = random.Random('getsites')
+    sites = []
+    for site_id in range(1, 6):
+        sites.append("""
+  <site>
+    <id>%(id)s</id>
+    <name>%(name)s</name>
+    <url>http://%(host)s.posterous.com</url>
+    <hostname>%(host)s</hostname>
+    <private>false</private>
+    <primary>%(primary)s</primary>
+    <commentsenabled>true</commentsenabled>
+    <num_posts>%(posts)s</num_posts>
+  </site>""" % {'id':site_id, 'name':words(rnd, 2).title(), 'host':'pyposttest%s' % site_id, 'primary':str(site_id == 1).lower(), 'posts':rnd.randint(0, 900)})
+    return rsp(''.join(sites))
+
+def get_tags():
+    rnd = random.Random('gettags')
+    tags = []
+    for tag_id, word in enumerate(sorted(set(WORDS))):
+        tags.append("""
+  <tag>
+    <id>%s</id>
+    <tag_string>%s</tag_string>
+    <count>%s</count>
+  </tag>""" % (tag_id + 1, word, rnd.randint(1, 60)))
+    return rsp(''.join(tags))
+
+def upload():
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<image>
+  <id>4a2b7</id>
+  <text>Check out this awesome media</text>
+  <url>http://post.ly/4a2b7</url>
+  <width>640</width>
+  <height>480</height>
+  <size>88211</size>
+  <type>jpg</type>
+  <timestamp>Wed Jan 06 20:49:51 +0000 2010</timestamp>
+  <user>
+    <id>14920174</id>
+    <screen_name>pyposttest</screen_name>
+  </user>
+</image>
+"""
+
+def main():
+    if not os.path.isdir(FIXTURES):
+        os.makedirs(FIXTURES)
+
+    files = {
+        'getsites.xml':get_sites(),
+        'gettags.xml':get_tags(),
+        'getpost.xml':get_post(),
+        'upload.xml':upload(),
+    }
+    for size in READ_POSTS_SIZES:
+        files['readposts_%s.xml' % size] = read_posts(size)
+
+    for name, content in sorted(files.items()):
+        open(os.path.join(FIXTURES, name), 'w').write(content)
+        print "%s: %s bytes" % (name, len(content))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Compares answering questions about a blog by scanning a list of Post
+objects with pyposterous.mirror.Query over the same posts in a Mirror.
+
+The posts of benchmarks/fixtures/readposts_50.xml are copied with new ids
+until there are as many as asked for. Loading the list is reported
+separately, since a Query doesn't have to do it. Queries that return many
+posts spend most of their time building them; the ids only lines show the
+cost of the lookup itself.
+
+Usage: python benchmarks/mirror.py [number of posts]
+
+"""
+import os
+import sys
+import time
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pyposterous.mirror import Mirror
+from pyposterous.parser import Parser
+
+def timed(name, function, repeat=5):
+    started = time.time()
+    for i in range(repeat):
+        result = function()
+    per_call = (time.time() - started) / repeat
+    print "%-40s %9.2fms" % (name, per_call * 1000)
+    return result
+
+def main():
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    xml = open(os.path.join(ROOT, 'benchmarks', 'fixtures', 'readposts_50.xml')).read()
+    mirror = Mirror(None)
+    for start in range(0, count, 50):
+        for index, post in enumerate(Parser(None, StringIO(xml), ['force_list']).parse()):
+            post.id = start + index
+            post.date += timedelta(days=start / 50)
+            post.tag = ['tag%s' % (post.id % 10), 'tag%s' % (post.id % 7 + 10)]
+            mirror.store_post('hostname:pyposttest', post)
+    mirror.analyze()
+    mirror.db.commit()
+
+    posts = timed("load every post", lambda: mirror.posts('pyposttest'), 1)
+    query = mirror.query().site('pyposttest')
+    start, end = datetime(2010, 6, 1), datetime(2010, 6, 8)
+
+    print
+    timed("list: top 10 by views", lambda: sorted(posts, key=lambda post: post.views, reverse=True)[:10])
+    timed("query: top 10 by views", lambda: query.top(10, 'views'))
+    timed("list: one week", lambda: [post for post in posts if start <= post.date < end])
+    timed("query: one week", lambda: query.range('date', start, end).all())
+    timed("query: one week, ids only", lambda: query.range('date', start, end).ids())
+    timed("list: tagged tag3 and tag12", lambda: [post for post in posts if 'tag3' in post.tag and 'tag12' in post.tag])
+    timed("query: tagged tag3 and tag12", lambda: query.tagged('tag3').tagged('tag12').all())
+    timed("query: tagged tag3 and tag12, ids only", lambda: query.tagged('tag3').tagged('tag12').ids())
+    timed("list: 5+ comments, count", lambda: len([post for post in posts if post.commentscount >= 5]))
+    timed("query: 5+ comments, count", lambda: query.range('commentscount', 5).count())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Replays the recorded Posterous responses in benchmarks/fixtures without
+touching the network and reports how fast they are turned into objects.
+
+Six layers are measured:
+
+* parser -- Parser alone, reading a fixture from memory
+* method -- API methods end to end (argument validation, request building, parsing) through a fake transport
+* cursor -- Cursor iterating over several pages of read_posts
+* list view -- read_posts pages where only id, title, url and date are looked at, with eager and lazy parsing and with those fields projected
+* crawl -- reading a 20 page site with Cursor and with SiteCrawl, with 20ms of simulated latency per request
+* processes -- a batch of 20 read_posts pages parsed on threads (AsyncAPI) and in pools of 1, 2, 4 and one per CPU processes (ProcessAPI); parsing only scales with processes, and only up to the number of cores
+
+For every benchmark the throughput is reported along with the number of
+objects built per call and the number of objects the garbage collector
+tracks that are still alive afterwards (the memory cost of the result).
+
+Usage: python benchmarks/responses.py [seconds per benchmark]
+
+Run benchmarks/make_fixtures.py to regenerate the fixtures.
+
+"""
+import gc
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+sys.path.insert(0, ROOT)
+
+from pyposterous import API, AsyncAPI, ProcessAPI, Cursor
+from pyposterous.crawl import crawl_site
+from pyposterous.auth import TwitterAuth
+from pyposterous.methods import get_signature
+from pyposterous.parser import Parser, LazyParser
+from pyposterous.transport import Transport
+
+READ_POSTS_SIZES = (1, 10, 20, 50)
+
+def fixture(name):
+    return open(os.path.join(FIXTURES, name)).read()
+
+class FixtureResponse(object):
+    def __init__(self, xml):
+        self.body = StringIO(xml)
+
+    def read(self, *args):
+        return self.body.read(*args)
+
+    def getcode(self):
+        return 200
+
+    def info(self):
+        import mimetools
+        return mimetools.Message(StringIO(''))
+
+    def close(self):
+        pass
+
+class FixtureTransport(Transport):
+    """Answers every request with the fixture for its path. read_posts
+    requests get the fixture with as many posts as num_posts asked for, or
+    no posts for pages past the last one. When pages is set, the ids on every
+    page are different. Every request takes latency seconds."""
+    def __init__(self, latency=0, pages=None):
+        self.fixtures = {
+            '/api/getsites':fixture('getsites.xml'),
+            '/api/gettags':fixture('gettags.xml'),
+            '/api/getpost':fixture('getpost.xml'),
+            '/api2/upload.xml':fixture('upload.xml'),
+        }
+        for size in READ_POSTS_SIZES:
+            self.fixtures[('/api/readposts', size)] = fixture('readposts_%s.xml' % size)
+        self.requests = 0
+        self.latency = latency
+        self.pages = pages
+
+    def open(self, request, data=None, timeout=None):
+        import cgi
+
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        path = request.get_selector().split('?')[0]
+        if path == '/api/readposts':
+            query = cgi.parse_qs(data or request.get_selector().partition('?')[2])
+            xml = self.fixtures[(path, int(query.get('num_posts', ['10'])[0]))]
+            if self.pages is not None:
+                page = int(query.get('page', ['1'])[0])
+                if page > self.pages:
+                    return FixtureResponse('<rsp stat="ok"></rsp>')
+                xml = xml.replace('<id>', '<id>%s' % page)
+            return FixtureResponse(xml)
+        return FixtureResponse(self.fixtures[path])
+
+class FixtureTwitterAuth(TwitterAuth):
+    """TwitterAuth without the OAuth signature, which needs oauth2 and
+    doesn't matter for replayed responses."""
+    def __init__(self):
+        self.username = None
+
+    def gen_request(self, url):
+        import urllib2
+        return urllib2.Request(url)
+
+def count_objects(value):
+    """Returns the number of pyposterous objects in value, nested ones
+    included."""
+    from pyposterous.models import PosterousData
+
+    if isinstance(value, list):
+        return sum([count_objects(item) for item in value])
+    if not isinstance(value, PosterousData):
+        return 0
+    return 1 + sum([count_objects(value_) for name, value_ in value.as_dict().items()])
+
+def retained(function):
+    """Returns the result of function and the number of GC tracked objects
+    it keeps alive."""
+    gc.collect()
+    before = len(gc.get_objects())
+    result = function()
+    gc.collect()
+    return result, max(0, len(gc.get_objects()) - before - 1)
+
+def measure(name, function, duration, size=0):
+    """Calls function repeatedly for about duration seconds and prints the
+    results."""
+    # The first call pays for imports and caches.
+    function()
+    result, alive = retained(function)
+    objects = count_objects(result)
+
+    calls = 0
+    started = time.time()
+    elapsed = 0
+    while elapsed < duration:
+        for i in range(10):
+            function()
+        calls += 10
+        elapsed = time.time() - started
+
+    per_call = elapsed / calls
+    line = "%-30s %9.1f calls/s %10.0f objects/s %8.3fms/call %6d objects %7d retained" % (name, 1 / per_call, objects / per_call, per_call * 1000, objects, alive)
+    if size:
+        line += " %7.2fMB/s" % (size / per_call / 1024 / 1024)
+    print line
+
+def parser_benchmarks(api, duration):
+    def parse(name, method_name, subsection='application'):
+        xml = fixture(name)
+        returns = get_signature(subsection, method_name).returns
+        measure("parser %s" % name, lambda: Parser(api, StringIO(xml), returns, True).parse(), duration, len(xml))
+
+    for size in READ_POSTS_SIZES:
+        parse('readposts_%s.xml' % size, 'read_posts')
+    parse('getsites.xml', 'get_sites')
+    parse('gettags.xml', 'get_tags')
+    parse('getpost.xml', 'get_post', 'post.ly')
+    parse('upload.xml', 'upload', 'twitter')
+
+def method_benchmarks(api, duration):
+    for size in READ_POSTS_SIZES:
+        measure("read_posts(num_posts=%s)" % size, lambda: api.read_posts(hostname='pyposttest', num_posts=size), duration)
+    measure("get_sites()", api.get_sites, duration)
+    measure("get_tags()", lambda: api.get_tags(hostname='pyposttest'), duration)
+    measure("get_post()", lambda: api.get_post('4a2b7'), duration)
+
+    twitter = API(auth=FixtureTwitterAuth(), transport=api.transport)
+    measure("upload()", lambda: twitter.upload(message='Check out this awesome media', body='AWESOME.'), duration)
+
+def cursor_benchmarks(api, duration):
+    def crawl(limit, prefetch):
+        return list(Cursor(method=api.read_posts, num_posts=50, limit=limit, prefetch=prefetch, parameters={'hostname':'pyposttest'}))
+
+    measure("cursor 250 posts", lambda: crawl(250, 0), duration)
+    measure("cursor 250 posts prefetch", lambda: crawl(250, 2), duration)
+
+def list_view_benchmarks(api, duration):
+    lazy = API('user', 'password', transport=api.transport, lazy=True)
+
+    def list_view(api, size, **kwargs):
+        return [(post.id, post.title, post.url, post.date) for post in api.read_posts(hostname='pyposttest', num_posts=size, **kwargs)]
+
+    xml = fixture('readposts_50.xml')
+    returns = get_signature('application', 'read_posts').returns
+    measure("lazy parser readposts_50", lambda: LazyParser(lazy, StringIO(xml), returns, True).parse(), duration, len(xml))
+    for size in (20, 50):
+        measure("list view %s posts" % size, lambda: list_view(api, size), duration)
+        measure("lazy list view %s posts" % size, lambda: list_view(lazy, size), duration)
+        measure("projected list view %s posts" % size, lambda: list_view(api, size, fields=['id', 'title', 'url', 'date']), duration)
+
+def crawl_benchmarks(duration):
+    api = API('user', 'password', transport=FixtureTransport(latency=0.02, pages=20))
+
+    measure("cursor 20 pages", lambda: list(Cursor(method=api.read_posts, num_posts=50, parameters={'hostname':'pyposttest'})), duration)
+    for workers in (1, 4, 8):
+        measure("crawl 20 pages, %s workers" % workers, lambda: crawl_site(api, 'pyposttest', workers=workers), duration)
+
+def process_benchmarks(duration):
+    from multiprocessing import cpu_count
+
+    transport = FixtureTransport(pages=20)
+    items = [{'hostname':'pyposttest', 'num_posts':50, 'page':page} for page in range(1, 21)]
+    api = AsyncAPI('user', 'password', transport=transport, workers=8)
+    measure("threads 20 pages", lambda: api.batch('read_posts', items), duration)
+    api.close()
+
+    for processes in sorted(set((1, 2, 4, cpu_count()))):
+        api = ProcessAPI('user', 'password', transport=transport, workers=8, processes=processes)
+        measure("%s processes 20 pages" % processes, lambda: api.batch('read_posts', items), duration)
+        api.close()
+
+def main():
+    duration = 1.0
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+
+    api = API('user', 'password', transport=FixtureTransport())
+    parser_benchmarks(api, duration)
+    method_benchmarks(api, duration)
+    cursor_benchmarks(api, duration)
+    list_view_benchmarks(api, duration)
+    crawl_benchmarks(duration)
+    process_benchmarks(duration)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Measures how long it takes to import pyposterous and to construct API
+objects.
+
+Usage: python benchmarks/startup.py [runs]
+
+"""
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import pyposterous
+elapsed = time.time() - start
+heavy = [name for name in ('urllib2', 'httplib', 'xml.etree.ElementTree', 'oauth2') if name in sys.modules]
+print elapsed, ','.join(heavy)
+"""
+
+def time_import(runs):
+    """Imports pyposterous in a fresh interpreter runs times. Returns the
+    sorted timings and the heavy modules the import pulled in."""
+    timings = []
+    heavy = ''
+    for i in range(runs):
+        output = subprocess.Popen([sys.executable, '-c', IMPORT_SCRIPT], cwd=ROOT, stdout=subprocess.PIPE).communicate()[0]
+        elapsed, heavy = output.split(' ', 1)
+        timings.append(float(elapsed))
+    timings.sort()
+    return timings, heavy.strip()
+
+def time_construction(runs):
+    """Returns the average time it takes to construct an API object and to
+    make its first method lookup."""
+    sys.path.insert(0, ROOT)
+    from pyposterous import API
+
+    construct = timeit.Timer(lambda: API('user', 'password')).timeit(runs) / runs
+    lookup = timeit.Timer(lambda: API('user', 'password').read_posts).timeit(runs) / runs
+    return construct, lookup
+
+def main():
+    runs = 20
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    timings, heavy = time_import(runs)
+    print "import pyposterous: min %.2fms, median %.2fms (%s runs)" % (timings[0] * 1000, timings[len(timings) / 2] * 1000, runs)
+    print "heavy modules imported: %s" % (heavy or 'none')
+
+    construct, lookup = time_construction(runs * 500)
+    print "API(): %.2fus" % (construct * 1000000)
+    print "API() and first method lookup: %.2fus" % (lookup * 1000000)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,17 @@
-import types
-
 from pyposterous.error import PyposterousError
-from pyposterous.methods import build_method
+from pyposterous.methods import build_method, build_async_method, LazyMethod, MethodCall, find_signature
 from pyposterous.idl import METHODS
 from pyposterous.auth import Auth, BasicAuth
+from pyposterous.transport import Transport, UrllibTransport, PooledTransport
+from pyposterous.workers import WorkerPool, host_limit, wait_all
 class API(object):
     """Posterous API"""    
-    def __init__(self, username=None, password=None, auth=BasicAuth(), host='posterous.com'):
+    _method_builder = staticmethod(build_method)
+    
+    # The sections of METHODS that are available as methods of this class.
+    method_subsections = ('application', 'post.ly', 'twitter')
+    
+    def __init__(self, username=None, password=None, auth=BasicAuth(), host='posterous.com', transport=None, cache=None, validators=None, scheduler=None, timeout=None, stats=None, lazy=False):
         self.auth = auth
         
         if username and password:
@@ -17,18 +22,169 @@ class API(object):
         
         self.host = host
         
-        # Add API methods based on the IDL.
-        self.__build_methods('application')
-        self.__build_methods('post.ly')
-        self.__build_methods('twitter')
-        self.__build_methods('test')
-    
-    def __build_methods(self, method_subsection):
-        """Add a bound method to this object for each method defined in the 
-        specified method_subsection of METHODS. """
-        for method_name in METHODS.get(method_subsection, {}):
-            config = METHODS.get(method_subsection, {}).get(method_name)
-            method = build_method(**config)
-            self.__setattr__(method_name, types.MethodType(method, self, API))
+        self.transport = transport or UrllibTransport()
+        if not isinstance(self.transport, Transport):
+            raise TypeError("transport must be an instance of a class that is a subclass of pyposterous.transport.Transport")
+        
+        # An optional pyposterous.cache.ResponseCache for read-only methods
+        self.cache = cache
+        
+        # An optional pyposterous.cache.ValidatorCache. Enables conditional
+        # requests for idempotent methods.
+        self.validators = validators
+        
+        # An optional pyposterous.scheduler.Scheduler that retries failed
+        # requests and limits the request rate.
+        self.scheduler = scheduler
+        
+        # Seconds to wait for each request: a number, a (connect, read) 
+        # tuple, or None to wait indefinitely. Calls accept timeout and 
+        # deadline keyword arguments too.
+        self.timeout = timeout
+        
+        # An optional pyposterous.stats.Stats that records where the time
+        # goes in every call.
+        self.stats = stats
+        
+        # If True, responses are parsed by pyposterous.parser.LazyParser:
+        # attributes are decoded and nested objects built on first access.
+        self.lazy = lazy
+    
+    def batch(self, method_name, items, workers=8, per_host=None):
+        """Calls the specified API method once for every item in items using
+        a pool of threads. Returns the results in the same order as items.
+        
+        Every item is checked against the method's parameters before 
+        anything is sent, and a TypeError is raised if one of them is 
+        invalid. Errors that happen while an item is sent 
+        (PyposterousErrors and connection errors) don't stop the batch; the
+        exception instance is returned in place of that item's result.
+        
+        Keyword arguments:
+        
+        * method_name -- The name of the API method to call (e.g. 'new_post')
+        * items -- An iterable of dicts of keyword arguments or of tuples of positional arguments
+        * workers -- (Optional) The number of threads to use
+        * per_host -- (Optional) The maximum number of concurrent requests to self.host, shared by every batch with the same limit
+        
+        """
+        import httplib
+        
+        signature = find_signature(self.method_subsections, method_name)
+        
+        calls = []
+        for index, item in enumerate(items):
+            args, kwargs = (), {}
+            if isinstance(item, dict):
+                kwargs = dict(item)
+            else:
+                args = tuple(item)
+            
+            try:
+                calls.append(MethodCall(self, signature, args, kwargs))
+            except TypeError, e:
+                raise TypeError("Item %s: %s" % (index, e))
+        
+        if not calls:
+            return []
+        
+        limit = None
+        if per_host:
+            limit = host_limit(self.host, per_host)
+        
+        def execute(call):
+            if limit:
+                limit.acquire()
+            try:
+                try:
+                    return call.execute()
+                except (PyposterousError, EnvironmentError, httplib.HTTPException), e:
+                    # httplib raises HTTPExceptions such as BadStatusLine 
+                    # when a connection is dropped.
+                    return e
+            finally:
+                if limit:
+                    limit.release()
+        
+        pool = WorkerPool(min(workers, len(calls)))
+        try:
+            return wait_all(pool.map(execute, calls))
+        finally:
+            pool.shutdown()
+    
+    def new_posts(self, items, workers=8, per_host=None):
+        """Creates many posts at once. Each item is a dict of new_post 
+        keyword arguments. Returns a list of post objects (or, for items that
+        failed, the PyposterousError that was raised) in the same order as
+        items.
+        
+        See API.batch for the remaining arguments.
+        
+        """
+        return self.batch('new_post', items, workers, per_host)
+
+# API methods based on the IDL. They're built the first time they are looked
+# up.
+for method_subsection in METHODS:
+    for method_name in METHODS[method_subsection]:
+        setattr(API, method_name, LazyMethod(method_subsection, method_name))
+
+class AsyncAPI(API):
+    """Posterous API whose methods return pyposterous.workers.Future objects
+    instead of blocking, so many requests can be in flight at once. Call 
+    result() on a future to get the same objects the API class returns.
+    
+    Keyword arguments (in addition to those accepted by API):
+    
+    * workers -- (Optional) The number of requests that may be in flight at once.
+    * pool -- (Optional) A pyposterous.workers.WorkerPool to share between several AsyncAPI instances.
+    
+    """
+    _method_builder = staticmethod(build_async_method)
+    
+    def __init__(self, username=None, password=None, auth=BasicAuth(), host='posterous.com', transport=None, cache=None, validators=None, scheduler=None, timeout=None, stats=None, lazy=False, workers=16, pool=None):
+        if transport is None:
+            transport = PooledTransport(max_connections=workers)
+        
+        self.owns_pool = pool is None
+        self.pool = pool or WorkerPool(workers)
+        super(AsyncAPI, self).__init__(username, password, auth, host, transport, cache, validators, scheduler, timeout, stats, lazy)
+    
+    def close(self):
+        """Stops the worker threads (unless the pool was passed in) and closes
+        idle connections."""
+        if self.owns_pool:
+            self.pool.shutdown()
+        self.transport.close()
 
+class ProcessAPI(AsyncAPI):
+    """An AsyncAPI that parses responses in a pool of processes. Requests 
+    are sent and responses read on worker threads as usual, but the XML is
+    parsed, and the objects built, in another process and sent back encoded
+    by pyposterous.codec, so parsing many responses uses every core instead
+    of one. The objects returned are the same as those of the API class.
+    
+    Like those of AsyncAPI, its methods return futures, so they can't be 
+    used with Cursor; use batch to read many pages. Lazy parsing isn't
+    available.
+    
+    Keyword arguments (in addition to those accepted by AsyncAPI):
+    
+    * processes -- (Optional) The number of processes. Defaults to the number of CPUs.
+    * parse_pool -- (Optional) A multiprocessing.Pool to share between several ProcessAPI instances.
+    
+    """
+    def __init__(self, username=None, password=None, auth=BasicAuth(), host='posterous.com', transport=None, cache=None, validators=None, scheduler=None, timeout=None, stats=None, workers=16, pool=None, processes=None, parse_pool=None):
+        import multiprocessing
+        
+        super(ProcessAPI, self).__init__(username, password, auth, host, transport, cache, validators, scheduler, timeout, stats, False, workers, pool)
+        self.owns_parse_pool = parse_pool is None
+        self.parse_pool = parse_pool or multiprocessing.Pool(processes)
     
+    def close(self):
+        """Stops the worker threads and processes (unless their pools were
+        passed in) and closes idle connections."""
+        super(ProcessAPI, self).close()
+        if self.owns_parse_pool:
+            self.parse_pool.close()
+            self.parse_pool.join()
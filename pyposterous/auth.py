@@ -1,5 +1,3 @@
-import urllib2
-
 class Auth(object):
     def gen_request(url):
         raise NotImplementedError
@@ -12,6 +10,7 @@ class BasicAuth(Auth):
         
     def gen_request(self, url):
         import base64
+        import urllib2
         
         req = urllib2.Request(url)
         
@@ -54,6 +53,8 @@ class TwitterAuth(Auth):
         self.version = '1.0'
         
     def gen_request(self, url):
+        import urllib2
+        
         req = urllib2.Request(url)
         
         req.add_header("X-Auth-Service-Provider", self.xauth_sp)
@@ -0,0 +1,151 @@
+import threading
+import time
+
+class LRUCache(object):
+    """A thread safe mapping that holds at most max_entries items and
+    discards the least recently used item to make room for new ones."""
+    def __init__(self, max_entries=1000):
+        from collections import OrderedDict
+
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return default
+            # Move it to the most recently used end.
+            self.entries[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def items(self):
+        self.lock.acquire()
+        try:
+            return self.entries.items()
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+class ResponseCache(object):
+    """Caches the objects returned by read-only API methods. Pass an
+    instance to the API class to enable it.
+
+    Only methods with a cache_ttl in the IDL are cached. Entries expire
+    after cache_ttl seconds and the least recently used entries are evicted
+    once max_entries is reached. Methods marked with invalidates_cache
+    discard the entries that might be affected by them when they succeed.
+
+    Cached objects are shared between callers, so treat them as read-only.
+
+    Keyword arguments:
+
+    * max_entries -- (Optional) The maximum number of responses to keep.
+
+    """
+    def __init__(self, max_entries=1000):
+        self.entries = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns a (hit, value) tuple for key."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        value, expires, scope = entry
+        if expires < time.time():
+            self.entries.remove(key)
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, value
+
+    def set(self, key, value, ttl, scope=None):
+        """Stores value for ttl seconds. scope is a ('site_id', value) or a
+        ('hostname', value) tuple identifying the site the value belongs to,
+        if there is one."""
+        self.entries.set(key, (value, time.time() + ttl, scope))
+
+    def invalidate(self, scope=None):
+        """Discards the entries that may belong to the site identified by
+        scope. Entries that were requested by the id of another site are
+        kept; everything else is discarded, because a hostname can't be
+        matched to a site id. If scope is None, everything is discarded."""
+        if scope is None:
+            self.entries.clear()
+            return
+
+        for key, (value, expires, entry_scope) in self.entries.items():
+            if entry_scope and entry_scope[0] == scope[0] == 'site_id' and entry_scope != scope:
+                continue
+            self.entries.remove(key)
+
+    def clear(self):
+        self.entries.clear()
+
+class ValidatorCache(object):
+    """Remembers the ETag and Last-Modified headers sent with responses to
+    idempotent API methods along with the objects parsed from them. Pass an
+    instance to the API class to enable conditional requests: later
+    identical calls send If-None-Match/If-Modified-Since, and when Posterous
+    answers 304 Not Modified the stored objects are returned without
+    parsing anything.
+
+    Stored objects are shared between callers, so treat them as read-only.
+They're stored as the list of objects in the response, whether the call
+returns the list or a single object, so plain and streamed calls can use
+each other's entries.
+
+    Keyword arguments:
+
+    * max_entries -- (Optional) The maximum number of responses to remember.
+
+    """
+    def __init__(self, max_entries=1000):
+        self.entries = LRUCache(max_entries)
+        self.not_modified = 0
+
+    def get(self, key):
+        """Returns an (etag, last_modified, value) tuple or None."""
+        return self.entries.get(key)
+
+    def set(self, key, etag, last_modified, value):
+        self.entries.set(key, (etag, last_modified, value))
+
+    def clear(self):
+        self.entries.clear()
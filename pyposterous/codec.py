@@ -0,0 +1,339 @@
+"""A compact binary format for pyposterous objects.
+
+dumps(value) encodes Posterous objects (and lists, dictionaries, strings,
+numbers, booleans, None and datetimes containing them) and loads(data)
+decodes them. Unlike pickle, the format knows the attributes of every model:
+an object is written as its type, a bit mask of the slots that are set and
+their values, without attribute or class names. The API handle isn't
+written; loads gives the objects the API instance it is passed.
+
+Encoded data starts with a header holding the format version and a checksum
+of the model definitions, and loads refuses data written for different
+ones, so changing a model's __slots__ can't make old data decode into the
+wrong attributes.
+
+"""
+import struct
+import zlib
+from datetime import datetime
+
+from pyposterous.error import PyposterousError
+from pyposterous.models import PosterousData, Site, Tag, Post, Comment, Media, Image, User, field_names
+
+MAGIC = 'PPB'
+VERSION = 1
+
+# Type codes. Don't renumber them; add new ones at the end and bump VERSION.
+(NONE, TRUE, FALSE, INT, NEGATIVE, BYTES, TEXT, DATE, DATE_MICRO, FLOAT,
+    LIST, TUPLE, DICT, OBJECT) = range(14)
+
+# Encoded models, by position. Append new models at the end.
+MODELS = (Site, Tag, Post, Comment, Media, Image, User)
+
+# Model -> (code, slot names)
+MODEL_CODES = dict([(model, (code, tuple(field_names(model)))) for code, model in enumerate(MODELS)])
+
+# Identifies the model definitions data was written with
+SCHEMA = zlib.crc32(';'.join(["%s:%s" % (model.__name__, ','.join(field_names(model))) for model in MODELS])) & 0xffffffff
+
+HEADER = MAGIC + chr(VERSION) + struct.pack('>I', SCHEMA)
+
+# Byte strings at least this long are returned as buffers by
+# loads(data, buffers=True). Must be below 0x80, the longest string with a 
+# one byte length.
+BUFFER_MIN = 64
+
+DATE_STRUCT = struct.Struct('>HBBBBB')
+MICRO_STRUCT = struct.Struct('>I')
+FLOAT_STRUCT = struct.Struct('>d')
+
+def dumps(value):
+    """Returns value encoded as a string."""
+    out = [HEADER]
+    encode(value, out)
+    return ''.join(out)
+
+def loads(data, api=None, buffers=False):
+    """Decodes a value encoded by dumps. data may be a string, a buffer, or
+    an mmap.
+
+    Keyword arguments:
+
+    * api -- (Optional) The API instance the decoded objects use
+    * buffers -- (Optional) Return byte strings of BUFFER_MIN bytes or more (post bodies, usually) as read-only buffers into data instead of copying them. data has to stay unchanged while they are used. Text that isn't ASCII is always decoded.
+
+    """
+    if len(data) < len(HEADER) or data[:len(MAGIC)] != MAGIC:
+        raise PyposterousError("The data wasn't encoded by pyposterous.codec.")
+    if ord(data[3]) != VERSION or struct.unpack_from('>I', data, 4)[0] != SCHEMA:
+        raise PyposterousError("The data was encoded by another version of pyposterous.")
+
+    try:
+        value, position = Decoder(data, api, buffers).decode(len(HEADER))
+    except (IndexError, struct.error):
+        raise PyposterousError("The encoded data is truncated.")
+    if position != len(data):
+        raise PyposterousError("There is unexpected data after the encoded value.")
+    return value
+
+def encode_varint(number, out):
+    # 7 bits per byte, least significant first. The high bit says that
+    # another byte follows.
+    while number > 0x7f:
+        out.append(chr(0x80 | (number & 0x7f)))
+        number >>= 7
+    out.append(chr(number))
+
+def encode_int(value, out):
+    if value >= 0:
+        if value < 0x80:
+            out.append(SMALL_INTS[value])
+            return
+        out.append(chr(INT))
+        encode_varint(value, out)
+    else:
+        out.append(chr(NEGATIVE))
+        encode_varint(-value, out)
+
+def encode_bytes(value, out):
+    out.append(chr(BYTES))
+    encode_varint(len(value), out)
+    out.append(value)
+
+def encode_text(value, out):
+    value = value.encode('utf-8')
+    out.append(chr(TEXT))
+    encode_varint(len(value), out)
+    out.append(value)
+
+def encode_date(value, out):
+    if value.tzinfo is not None:
+        raise TypeError("Only naive datetimes can be encoded.")
+    if value.microsecond:
+        out.append(chr(DATE_MICRO))
+        out.append(DATE_STRUCT.pack(value.year, value.month, value.day, value.hour, value.minute, value.second))
+        out.append(MICRO_STRUCT.pack(value.microsecond))
+    else:
+        out.append(chr(DATE))
+        out.append(DATE_STRUCT.pack(value.year, value.month, value.day, value.hour, value.minute, value.second))
+
+def encode_float(value, out):
+    out.append(chr(FLOAT))
+    out.append(FLOAT_STRUCT.pack(value))
+
+def encode_sequence(code):
+    def encode_sequence(value, out):
+        out.append(chr(code))
+        encode_varint(len(value), out)
+        for item in value:
+            encode(item, out)
+    return encode_sequence
+
+def encode_dict(value, out):
+    out.append(chr(DICT))
+    encode_varint(len(value), out)
+    for key, item in value.items():
+        encode(key, out)
+        encode(item, out)
+
+def encode_object(obj, out):
+    try:
+        code, names = MODEL_CODES[type(obj)]
+    except KeyError:
+        raise TypeError("%s objects can't be encoded." % type(obj).__name__)
+
+    # Attributes a LazyParser left undecoded are decoded first.
+    obj.decode_all()
+
+    mask = 0
+    values = []
+    for bit, name in enumerate(names):
+        try:
+            value = object.__getattribute__(obj, name)
+        except AttributeError:
+            continue
+        mask |= 1 << bit
+        values.append(value)
+
+    out.append(chr(OBJECT))
+    out.append(chr(code))
+    encode_varint(mask, out)
+    for value in values:
+        encode(value, out)
+
+    extra = obj.extra or {}
+    encode_varint(len(extra), out)
+    for name, value in extra.items():
+        encode(name, out)
+        encode(value, out)
+
+# Ints from 0 to 127 are written as a single byte with the high bit set.
+# Type codes are all below 0x80, so they can't be confused.
+SMALL_INTS = [chr(0x80 | number) for number in range(0x80)]
+
+ENCODERS = {
+    type(None):lambda value, out: out.append(chr(NONE)),
+    bool:lambda value, out: out.append(chr(value and TRUE or FALSE)),
+    int:encode_int,
+    long:encode_int,
+    str:encode_bytes,
+    unicode:encode_text,
+    datetime:encode_date,
+    float:encode_float,
+    list:encode_sequence(LIST),
+    tuple:encode_sequence(TUPLE),
+    dict:encode_dict,
+}
+
+def encode(value, out):
+    encoder = ENCODERS.get(type(value))
+    if encoder is None:
+        if isinstance(value, PosterousData):
+            encoder = encode_object
+        else:
+            raise TypeError("%s values can't be encoded." % type(value).__name__)
+    encoder(value, out)
+
+class Decoder(object):
+    def __init__(self, data, api, buffers):
+        self.data = data
+        self.api = api
+        self.buffers = buffers
+
+        # Decoding methods, indexed by type code
+        self.decoders = [self.decode_none, self.decode_true, self.decode_false, self.decode_int, self.decode_negative,
+            self.decode_bytes, self.decode_text, self.decode_date, self.decode_date_micro, self.decode_float,
+            self.decode_list, self.decode_tuple, self.decode_dict, self.decode_object]
+
+    def decode(self, position):
+        """Returns the value at position and the position after it."""
+        data = self.data
+        code = ord(data[position])
+        if code & 0x80:
+            return code & 0x7f, position + 1
+
+        # Short byte strings are the most common value by far.
+        if code == BYTES:
+            length = ord(data[position + 1])
+            if length < BUFFER_MIN:
+                end = position + 2 + length
+                value = data[position + 2:end]
+                if len(value) != length:
+                    raise IndexError(end)
+                return value, end
+
+        try:
+            decoder = self.decoders[code]
+        except IndexError:
+            raise PyposterousError("Unknown type code %s in the encoded data." % code)
+        return decoder(position + 1)
+
+    def varint(self, position):
+        data = self.data
+        byte = ord(data[position])
+        number = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            position += 1
+            byte = ord(data[position])
+            number |= (byte & 0x7f) << shift
+            shift += 7
+        return number, position + 1
+
+    def decode_none(self, position):
+        return None, position
+
+    def decode_true(self, position):
+        return True, position
+
+    def decode_false(self, position):
+        return False, position
+
+    def decode_int(self, position):
+        return self.varint(position)
+
+    def decode_negative(self, position):
+        number, position = self.varint(position)
+        return -number, position
+
+    def decode_bytes(self, position):
+        length, position = self.varint(position)
+        end = position + length
+        if end > len(self.data):
+            raise IndexError(end)
+        if self.buffers and length >= BUFFER_MIN:
+            return buffer(self.data, position, length), end
+        return self.data[position:end], end
+
+    def decode_text(self, position):
+        length, position = self.varint(position)
+        end = position + length
+        if end > len(self.data):
+            raise IndexError(end)
+        return self.data[position:end].decode('utf-8'), end
+
+    def decode_date(self, position):
+        return datetime(*DATE_STRUCT.unpack_from(self.data, position)), position + DATE_STRUCT.size
+
+    def decode_date_micro(self, position):
+        fields = DATE_STRUCT.unpack_from(self.data, position) + MICRO_STRUCT.unpack_from(self.data, position + DATE_STRUCT.size)
+        return datetime(*fields), position + DATE_STRUCT.size + MICRO_STRUCT.size
+
+    def decode_float(self, position):
+        return FLOAT_STRUCT.unpack_from(self.data, position)[0], position + FLOAT_STRUCT.size
+
+    def decode_list(self, position):
+        count, position = self.varint(position)
+        items = []
+        decode = self.decode
+        for i in xrange(count):
+            item, position = decode(position)
+            items.append(item)
+        return items, position
+
+    def decode_tuple(self, position):
+        items, position = self.decode_list(position)
+        return tuple(items), position
+
+    def decode_dict(self, position):
+        count, position = self.varint(position)
+        items = {}
+        decode = self.decode
+        for i in xrange(count):
+            key, position = decode(position)
+            items[key], position = decode(position)
+        return items, position
+
+    def decode_object(self, position):
+        try:
+            model = MODELS[ord(self.data[position])]
+        except IndexError:
+            raise PyposterousError("Unknown model in the encoded data.")
+        names = MODEL_CODES[model][1]
+        mask, position = self.varint(position + 1)
+
+        # The same as model(self.api), without going through 
+        # PosterousData.__setattr__.
+        obj = model.__new__(model)
+        set_slot = object.__setattr__
+        set_slot(obj, '_PosterousData__api', self.api)
+        set_slot(obj, '_PosterousData__pending', None)
+        set_slot(obj, 'extra', None)
+
+        decode = self.decode
+        for name in names:
+            if not mask:
+                break
+            if mask & 1:
+                value, position = decode(position)
+                set_slot(obj, name, value)
+            mask >>= 1
+        if mask:
+            raise PyposterousError("The encoded %s has more attributes than the model." % model.__name__)
+
+        count, position = self.varint(position)
+        for i in xrange(count):
+            name, position = decode(position)
+            value, position = decode(position)
+            setattr(obj, name, value)
+        return obj, position
@@ -0,0 +1,122 @@
+import time
+
+from pyposterous.error import PyposterousError, PyposterousTimeout
+from pyposterous.fanout import site_arguments
+from pyposterous.models import Site
+from pyposterous.workers import WorkerPool
+
+class SiteCrawl(object):
+    """Iterates over all of the posts of one site, reading its pages
+    concurrently. Posts come out in the order Posterous returns them (newest
+    first), as soon as the pages before theirs have been read, so memory use
+    stays bounded by the pages in flight.
+
+    Pages are handed to the workers in order, up to workers pages ahead of
+    the one being iterated over. If the number of pages is known (pages, or
+    the num_posts attribute of a Site from get_sites), no pages past the end
+    are requested unless the last one is full; otherwise up to workers - 1
+    requests may go past it. The crawl ends at the first page that isn't
+    full.
+
+    Posts published during a crawl push older posts onto later pages, so a
+    post may be returned by two pages; it is only handed out once. Posts
+    deleted during a crawl pull later posts back, so one may be missed;
+    compare with a mirror (pyposterous.mirror) if that matters.
+
+    Keyword arguments:
+
+    * api -- The API instance to use
+    * site -- A Site, a hostname, or a site id
+    * num_posts -- (Optional) The number of posts per page
+    * pages -- (Optional) The number of pages the site is expected to have
+    * workers -- (Optional) The number of pages read at once
+    * parameters -- (Optional) Additional keyword arguments for read_posts (e.g. {'tag':'python'})
+    * timeout -- (Optional) Seconds the whole crawl may take. Running out raises PyposterousTimeout.
+
+    Once a crawl has been iterated over, requests holds the number of pages
+    read and duplicates the number of posts that were skipped because an
+    earlier page returned them.
+
+    """
+    def __init__(self, api, site, num_posts=50, pages=None, workers=8, parameters={}, timeout=None):
+        self.api = api
+        self.num_posts = num_posts
+        self.workers = workers
+        self.timeout = timeout
+        self.arguments = dict(parameters)
+        self.arguments.update(site_arguments(site))
+        if self.arguments.pop('page', None) or self.arguments.pop('num_posts', None):
+            raise PyposterousError("SiteCrawl requests the pages itself; don't pass page or num_posts in parameters.")
+
+        self.pages = pages
+        if pages is None and isinstance(site, Site):
+            try:
+                self.pages = max(1, (site.num_posts + num_posts - 1) / num_posts)
+            except AttributeError:
+                pass
+
+        self.requests = 0
+        self.duplicates = 0
+
+    def __iter__(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+
+        kwargs = dict(self.arguments, num_posts=self.num_posts)
+        if deadline is not None:
+            kwargs['deadline'] = deadline
+
+        # When the number of pages is known, pages after the last one are
+        # only read if it is full: posts published during the crawl may have
+        # pushed some onto the next page, or the site has grown.
+        last_page = self.pages
+
+        self.requests = 0
+        self.duplicates = 0
+        seen = set()
+        finished = False
+        pool = WorkerPool(self.workers)
+        pending = {}
+        next_page = 1
+        page = 1
+        try:
+            while True:
+                while next_page < page + self.workers and (last_page is None or next_page <= last_page):
+                    pending[next_page] = pool.submit(self.api.read_posts, page=next_page, **kwargs)
+                    next_page += 1
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PyposterousTimeout("Timed out after %s seconds." % self.timeout)
+                posts = pending.pop(page).result(remaining) or []
+                self.requests += 1
+
+                for post in posts:
+                    post_id = getattr(post, 'id', None)
+                    if post_id is not None:
+                        if post_id in seen:
+                            self.duplicates += 1
+                            continue
+                        seen.add(post_id)
+                    yield post
+
+                if len(posts) < self.num_posts:
+                    finished = True
+                    break
+                if page == last_page:
+                    # There are more pages than expected.
+                    last_page += self.workers
+                page += 1
+        finally:
+            # Let requests for pages past the end finish so nothing is left
+            # running behind the caller's back, unless the crawl failed or
+            # was abandoned.
+            pool.shutdown(wait=finished)
+
+def crawl_site(api, site, num_posts=50, pages=None, workers=8, parameters={}, timeout=None):
+    """Returns a list of all of the posts of site, reading its pages
+    concurrently. See SiteCrawl for the keyword arguments."""
+    return list(SiteCrawl(api, site, num_posts, pages, workers, parameters, timeout))
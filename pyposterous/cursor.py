@@ -1,4 +1,7 @@
+import time
+
 from pyposterous.error import PyposterousError
+from pyposterous.workers import WorkerPool
 
 class Cursor(object):
     """Allows for iterating over multiple pages of Posterous results.
@@ -10,9 +13,15 @@ class Cursor(object):
     * start_page -- (Optional) The page to start on.
     * limit -- (Optional) Only return LIMIT results.
     * parameters -- (Optional) parameters you'd like to pass to the specified method
+    * prefetch -- (Optional) Fetch up to this many pages ahead in the background while the current page is consumed.
+    * workers -- (Optional) The number of threads used to prefetch pages. Defaults to prefetch.
+    * timeout -- (Optional) Seconds a complete iteration may take. Every page request is given the remaining time as its deadline, and pyposterous.error.PyposterousTimeout is raised once it runs out.
+    
+    A prefetching cursor runs threads until its iteration ends. Call close()
+    (or use the cursor in a with statement) when you stop iterating early.
     
     """
-    def __init__(self, method, num_posts=20, start_page=1, limit=0, parameters={}):
+    def __init__(self, method, num_posts=20, start_page=1, limit=0, parameters={}, prefetch=0, workers=None, timeout=None):
         # pagination will be equal to true if this method supports it
         if not getattr(method, 'pagination', False):
             raise PyposterousError('This method does not support pagination.')
@@ -22,36 +31,154 @@ class Cursor(object):
         self.method = method
         self.start_page = start_page
         self.current_page = start_page
-        self.iter_items = []
+        self.iter_items = None
+        self.page_count = 0
         self.done = False
         
+        # Items of the current page already returned before its request
+        # failed. They're skipped when the page is requested again.
+        self.skip = 0
+        
         self.returned_count = 0
         self.limit = limit
         
+        self.timeout = timeout
+        self.deadline = None
+        
+        self.prefetch = prefetch
+        self.workers = workers or prefetch
+        # Started by the first prefetching request. A new pool is used 
+        # after one is shut down.
+        self.pool = None
+        self.pending = []
+        self.next_page = start_page
+        
         if self.parameters.pop('page', None) or self.parameters.pop('num_posts', None):
             raise PyposterousError('When using a cursor object, you shouldn\'t specify a page or num_posts for the function. The Cursor object does that for you.')
         
     def __iter__(self):
         return self
     
-    def next(self):
-        # Get more items from posterous
-        if not self.done and not self.iter_items and (not self.limit or self.limit > self.returned_count):
-            self.iter_items = self.method(page=self.current_page, num_posts=self.num_posts, **self.parameters)
-            self.current_page += 1
-        
-            if len(self.iter_items) < self.num_posts:
-                self.done = True
-        
-        # Return one item
-        if self.iter_items and (not self.limit or self.limit > self.returned_count):
-            self.returned_count += 1
-            return self.iter_items.pop()
-            
-        # Reset stuff
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __del__(self):
+        self.__stop_pool()
+    
+    def close(self):
+        """Stops iterating: the current page is abandoned and the prefetch 
+        threads stop once the requests they are sending are done. Iterating
+        again starts over at start_page."""
+        if hasattr(self.iter_items, 'close'):
+            # Stop reading a half consumed page
+            self.iter_items.close()
         self.current_page = self.start_page
         self.done = False
+        self.skip = 0
         self.returned_count = 0
-        self.iter_items = []
+        self.iter_items = None
+        self.deadline = None
+        self.pending = []
+        self.next_page = self.start_page
+        self.__stop_pool()
+    
+    def __stop_pool(self, wait=False):
+        pool, self.pool = getattr(self, 'pool', None), None
+        if pool:
+            pool.shutdown(wait)
+    
+    def next(self):
+        while not self.limit or self.limit > self.returned_count:
+            # Get more items from posterous
+            if self.iter_items is None:
+                if self.done:
+                    break
+                if self.timeout is not None and self.deadline is None:
+                    self.deadline = time.time() + self.timeout
+                self.iter_items = self.__get_page()
+                self.page_count = 0
+                self.current_page += 1
+            
+            # Return one item
+            try:
+                item = self.iter_items.next()
+            except StopIteration:
+                if self.page_count < self.num_posts:
+                    self.done = True
+                self.iter_items = None
+                self.skip = 0
+                continue
+            except:
+                # Reading the page failed. Calling next() again requests 
+                # the same page.
+                self.iter_items = None
+                self.current_page -= 1
+                self.skip = max(self.skip, self.page_count)
+                raise
+            
+            self.page_count += 1
+            if self.page_count <= self.skip:
+                continue
+            self.returned_count += 1
+            return item
         
-        raise StopIteration        
\ No newline at end of file
+        # Let speculative requests for pages past the end finish so nothing
+        # is left running behind the caller's back.
+        self.__stop_pool(wait=True)
+        self.close()
+        raise StopIteration
+    
+    def __get_page(self):
+        """Returns an iterator over the items on self.current_page."""
+        if not self.prefetch:
+            # Items are handed out as they are parsed when the method 
+            # supports it.
+            stream = getattr(self.method, 'stream', None)
+            if stream:
+                return stream(self.method.im_self, page=self.current_page, num_posts=self.num_posts, **self.__parameters())
+            return iter(self.method(page=self.current_page, num_posts=self.num_posts, **self.__parameters()))
+        
+        # Request this page and the next self.prefetch pages, so the rest of
+        # the window downloads while the caller works through this one.
+        self.__schedule()
+        remaining = None
+        if self.deadline is not None:
+            remaining = max(0, self.deadline - time.time())
+        try:
+            items = self.pending[0].result(remaining)
+        except:
+            # Calling next() again requests this page and the window after
+            # it again. Requests that were already sent are left to finish,
+            # but the threads stop after them.
+            self.pending = []
+            self.next_page = self.current_page
+            self.__stop_pool()
+            raise
+        self.pending.pop(0)
+        return iter(items)
+    
+    def __parameters(self):
+        """Returns the keyword arguments for a page request."""
+        if self.deadline is None:
+            return self.parameters
+        return dict(self.parameters, deadline=self.deadline)
+    
+    def __schedule(self):
+        """Submits requests for upcoming pages until self.prefetch pages 
+        beyond the current one are in flight. Pages past the one that 
+        satisfies self.limit are never requested."""
+        last_page = None
+        if self.limit:
+            last_page = self.start_page + (self.limit - 1) / self.num_posts
+        
+        while len(self.pending) <= self.prefetch:
+            if last_page is not None and self.next_page > last_page:
+                break
+            
+            if self.pool is None:
+                self.pool = WorkerPool(self.workers)
+            self.pending.append(self.pool.submit(self.method, page=self.next_page, num_posts=self.num_posts, **self.__parameters()))
+            self.next_page += 1        
\ No newline at end of file
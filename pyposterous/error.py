@@ -1,12 +1,24 @@
 class PyposterousError(Exception):
-    """Pyposterous exception that accepts an optional posterous error code."""
-    def __init__(self, error, error_code=None):
+    """Pyposterous exception that accepts an optional posterous error code
+    and, for failed HTTP requests, the HTTP status code."""
+    def __init__(self, error, error_code=None, http_status=None):
         self.error_message = error
         self.error_code = error_code
+        self.http_status = http_status
 
     def __str__(self):        
         if self.error_code:
             return "%s - %s" % (self.error_code, self.error_message)
         
         return self.error_message
+    
+    def __reduce__(self):
+        # Exceptions are pickled with the positional arguments they were
+        # created with, which would lose http_status.
+        return (self.__class__, (self.error_message, self.error_code, self.http_status))
 
+
+class PyposterousTimeout(PyposterousError):
+    """Raised when a request takes longer than its timeout or deadline
+    allows."""
+    pass
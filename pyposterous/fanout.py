@@ -0,0 +1,155 @@
+import time
+
+from pyposterous.error import PyposterousError, PyposterousTimeout
+from pyposterous.models import Site
+from pyposterous.workers import WorkerPool
+
+class SiteResult(object):
+    """What fetch_sites retrieved for one site.
+
+    * site -- The site as it was passed to fetch_sites
+    * results -- A dictionary of method name -> returned value for the calls that succeeded
+    * errors -- A dictionary of method name -> exception for the calls that failed or timed out
+
+    """
+    def __init__(self, site):
+        self.site = site
+        self.results = {}
+        self.errors = {}
+
+        # When the first call for this site started running
+        self.started = None
+
+    def get(self, method_name, default=None):
+        return self.results.get(method_name, default)
+
+    def call(self, method, kwargs, timeout):
+        if self.started is None:
+            self.started = time.time()
+        if timeout is not None:
+            # Requests that are still running when the site's time is up
+            # are abandoned instead of tying up a worker.
+            kwargs = dict(kwargs, deadline=self.started + timeout)
+        return method(**kwargs)
+
+    def wait(self, future, timeout):
+        """Returns the result of future, giving up timeout seconds after the
+        first call for this site started. Calls still waiting for a worker
+        don't count against the timeout."""
+        if timeout is None:
+            return future.result()
+
+        while not future.done():
+            if self.started is None:
+                # Still waiting for a worker; check again in a little while.
+                wait = min(timeout, 0.05)
+            else:
+                wait = self.started + timeout - time.time()
+                if wait <= 0:
+                    break
+            try:
+                future.exception(wait)
+            except PyposterousTimeout:
+                pass
+
+        if not future.done():
+            raise PyposterousTimeout("Timed out after %s seconds." % timeout)
+        return future.result()
+
+class FanOutResult(object):
+    """The combined results of fetch_sites. sites holds a SiteResult for
+    every site, in the order they were passed in."""
+    def __init__(self, sites):
+        self.sites = sites
+
+    def posts(self):
+        """Returns the posts read from all of the sites, newest first."""
+        posts = []
+        for site in self.sites:
+            posts.extend(site.get('read_posts') or [])
+        posts.sort(key=lambda post: getattr(post, 'date', None), reverse=True)
+        return posts
+
+    def tags(self):
+        """Returns a dictionary of tag string -> the tags with that string
+        from all of the sites."""
+        tags = {}
+        for site in self.sites:
+            for tag in site.get('get_tags') or []:
+                tags.setdefault(str(tag), []).append(tag)
+        return tags
+
+    def errors(self):
+        """Returns a list of (site, method name, exception) tuples for the
+        calls that failed."""
+        errors = []
+        for site in self.sites:
+            for method_name, error in site.errors.items():
+                errors.append((site.site, method_name, error))
+        return errors
+
+    def ok(self):
+        return not self.errors()
+
+def site_arguments(site):
+    """Returns the keyword arguments that identify site to read_posts and
+    get_tags. site may be a Site, a hostname, or a site id."""
+    if isinstance(site, Site):
+        try:
+            return {'site_id':site.id}
+        except AttributeError:
+            try:
+                return {'hostname':site.hostname}
+            except AttributeError:
+                raise PyposterousError('No ID or hostname attributes have been defined for this site instance.')
+
+    if isinstance(site, basestring):
+        return {'hostname':site}
+    return {'site_id':site}
+
+def fetch_sites(api, sites, methods=('read_posts', 'get_tags'), parameters={}, timeout=None, workers=8):
+    """Runs the specified methods for every site concurrently and returns a
+    FanOutResult. A failing site doesn't affect the others; its exceptions
+    are reported in FanOutResult.errors().
+
+    Keyword arguments:
+
+    * api -- The API instance to use
+    * sites -- A list of Site objects, hostnames, or site ids
+    * methods -- (Optional) The site methods to call: read_posts and/or get_tags
+    * parameters -- (Optional) A dictionary of method name -> additional keyword arguments for that method (e.g. {'read_posts':{'num_posts':5}})
+    * timeout -- (Optional) Seconds to wait for each site. Calls that take longer are reported as errors.
+    * workers -- (Optional) The number of threads to use
+
+    """
+    results = [SiteResult(site) for site in sites]
+
+    calls = []
+    for result in results:
+        try:
+            arguments = site_arguments(result.site)
+        except PyposterousError, e:
+            for method_name in methods:
+                result.errors[method_name] = e
+            continue
+
+        for method_name in methods:
+            kwargs = dict(arguments)
+            kwargs.update(parameters.get(method_name, {}))
+            calls.append((result, method_name, getattr(api, method_name), kwargs))
+
+    if not calls:
+        return FanOutResult(results)
+
+    pool = WorkerPool(min(workers, len(calls)))
+    futures = [pool.submit(result.call, method, kwargs, timeout) for result, method_name, method, kwargs in calls]
+
+    for (result, method_name, method, kwargs), future in zip(calls, futures):
+        try:
+            result.results[method_name] = result.wait(future, timeout)
+        except Exception, e:
+            result.errors[method_name] = e
+
+    # Calls that timed out are left to finish on their own.
+    pool.shutdown(wait=False)
+    return FanOutResult(results)
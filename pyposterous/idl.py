@@ -1,16 +1,31 @@
 from datetime import datetime
 
-from pyposterous.models import Tag
+from pyposterous.models import Site, Post, Tag
 
 # Posterous IDL
+#
+# Besides the request definition, each method may declare:
+# cache_ttl -- seconds a response may be served from API.cache
+# invalidates_cache -- discard the affected API.cache entries on success
+# idempotent -- repeating the call has no side effects. Such calls are sent
+#               as conditional GET requests when API.validators is set and
+#               are retried by API.scheduler.
+# retry_safe -- API.scheduler may retry the call even though it isn't
+#               idempotent (sending it twice is harmless)
+# fields -- the model the call returns. Calls accept a fields keyword 
+#           argument, a list of attributes of that model; the other 
+#           attributes aren't built. It isn't sent to Posterous.
 METHODS = {
     # Base read and write Methods
     'application': {
         'get_sites': {
             'path':'/api/getsites',
             'parameters':(),
+            'idempotent':True,
+            'cache_ttl':300,
             'auth_required':True,
             'returns': ['force_list',],
+            'fields':Site,
             '__doc__':"""Returns a list of site objects representing the sites
             owned and authored by this user.
             
@@ -24,8 +39,11 @@ METHODS = {
                 ('num_posts', int, ['optional']),
                 ('page', int, ['optional']),
                 ('tag', (basestring, Tag), ['optional'])],
+            'idempotent':True,
+            'cache_ttl':60,
             'auth_required':False,
             'returns': ['force_list',],
+            'fields':Post,
             '__doc__':"""Returns a list of post objects based on the specified 
             parameters.
             
@@ -44,8 +62,11 @@ METHODS = {
             'parameters':[
                 ('site_id', int, ['optional']),
                 ('hostname', basestring, ['optional'])],
+            'idempotent':True,
+            'cache_ttl':300,
             'auth_required':False,
             'returns': ['force_list',],
+            'fields':Tag,
             '__doc__':"""Returns a list of tags objects on the specified 
             site.
             
@@ -70,6 +91,7 @@ METHODS = {
                 ('source', basestring, ['optional']),
                 ('sourceLink', basestring, ['optional']),
             ],
+            'invalidates_cache':True,
             'auth_required':True,
             '__doc__':"""Creates a new post. Returns a post object representing
             that post.
@@ -86,6 +108,7 @@ METHODS = {
             * tags -- Optional. Comma separate tags
             * source -- Optional. The name of your application or website
             * sourceLink -- Optional. Link to your application or website
+            * progress -- Optional. Called with (bytes_sent, total_bytes) while media is uploaded.
                    
             """
         },
@@ -97,6 +120,7 @@ METHODS = {
                 ('title', basestring, ['optional']),
                 ('body', basestring, ['optional']),
             ],
+            'invalidates_cache':True,
             'auth_required':True,
             '__doc__':"""Updates an existing post. Returns a post object for
             the updated post.
@@ -107,6 +131,7 @@ METHODS = {
             * media -- Optional. File object for single file or a list of file objects. Will append to post.
             * title -- Optional. Title of post. Will update post if present.
             * body -- Optional. Body of post. Will update post if present.
+            * progress -- Optional. Called with (bytes_sent, total_bytes) while media is uploaded.
             
             """
         },
@@ -119,6 +144,7 @@ METHODS = {
                 ('email', basestring, ['optional']),
                 ('date', datetime, ['optional']),
             ],
+            'invalidates_cache':True,
             'auth_required':True,
             '__doc__':"""Adds a comment to the specified post. Returns a comment
             object with the parent post as an attribute.
@@ -141,7 +167,10 @@ METHODS = {
             'parameters':[
                 ('id', basestring, []),
             ],
+            'idempotent':True,
+            'cache_ttl':60,
             'auth_required':False,
+            'fields':Post,
             '__doc__':"""Retrieve a post object based on a http://post.ly shortcode
             
             Keyword arguments:
@@ -177,6 +206,7 @@ METHODS = {
             * body -- Optional. Body of post
             * source -- Optional. The name of your application or website
             * sourceLink -- Optional. Link to your application or website            
+            * progress -- Optional. Called with (bytes_sent, total_bytes) while media is uploaded.
             
             """   
         },
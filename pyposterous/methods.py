@@ -1,172 +1,594 @@
-import urllib2
+import time
+import types
 from datetime import datetime
 
-from pyposterous.error import PyposterousError
+from pyposterous.error import PyposterousError, PyposterousTimeout
 from pyposterous.idl import METHODS
-from pyposterous.parser import Parser
 from pyposterous.utils import docstring_trim
-from pyposterous.models import Tag
+from pyposterous.models import Tag, field_names
 from pyposterous.auth import TwitterAuth, BasicAuth
+from pyposterous.multipart import MultipartEncoder, is_file
+from pyposterous.scheduler import RETRY_STATUSES
+
+def serialize_date(value):
+    return "%s +0000" % value.strftime('%a, %d %b %Y %H:%M:%S').split('.')[0]
+
+# Converts argument values of the specified types into the strings Posterous
+# expects. Values of other types are sent as they are.
+SERIALIZERS = {
+    datetime:serialize_date,
+    bool:lambda x: str(int(x)),
+    int:str,
+    Tag:str,
+}
+
+class Signature(object):
+    """A compiled METHOD configuration. Everything that doesn't depend on the
+    arguments of a particular call is worked out once, here, so binding a
+    call is a single pass over the parameters."""
+    def __init__(self, name, conf):
+        self.name = name
+        self.path = conf.get('path')
+        self.auth_required = conf.get('auth_required', False)
+        self.twitter_auth_required = conf.get('twitter_auth_required', False)
+        self.returns = conf.get('returns', [])
+        self.cache_ttl = conf.get('cache_ttl')
+        self.invalidates_cache = conf.get('invalidates_cache', False)
+        self.idempotent = conf.get('idempotent', False)
+        self.retry_safe = conf.get('retry_safe', False)
+        self.fields = conf.get('fields')
+        self.__doc__ = docstring_trim(conf.get('__doc__'))
+
+        # Anything with TEST in the URL is a test function, not a real API
+        # call
+        self.test = 'TEST' in self.path
+
+        # (name, accepted types, optional, name used for list items)
+        self.params = []
+        for name, p_type, config in conf.get('parameters', []):
+            # Make p_type a tuple if it isn't already.
+            if type(p_type) is not tuple:
+                p_type = (p_type,)
+            self.params.append((name, p_type, 'optional' in config, "%s[]" % name))
+        self.names = [param[0] for param in self.params]
+        self.pagination = 'page' in self.names
+
+        # Keyword arguments that configure the call instead of being sent
+        options = ['timeout', 'deadline']
+        if [param for param in self.params if file in param[1]]:
+            options.append('progress')
+        if self.fields:
+            options.append('fields')
+        self.options = tuple(options)
+
+    def url(self, host):
+        return "http://%s%s" % (host, self.path)
+
+    def check_auth(self, api):
+        """Raise an exception if authentication is required but credentials
+        are not specified"""
+        if self.auth_required and not isinstance(api.auth, BasicAuth):
+            raise PyposterousError("The API object's auth attribute most be an instance of pyposterous.auth.BasicAuth to use this method.")
+
+        if self.auth_required and not (api.auth.username and api.auth.password):
+            raise PyposterousError('A username and password is required to use this method.')
+
+        if self.twitter_auth_required and not isinstance(api.auth, TwitterAuth):
+            raise PyposterousError("The API object's auth attribute most be an instance of pyposterous.auth.TwitterAuth to use this method.")
+
+    def project(self, fields):
+        """Checks fields, a list of attribute names, against the model this
+        method returns. Returns a dictionary of model -> names for the 
+        parser, or None if fields is None. Raises a TypeError for names the
+        model doesn't have."""
+        if fields is None:
+            return None
+        if isinstance(fields, basestring) or not isinstance(fields, (list, tuple, set, frozenset)):
+            raise TypeError("fields must be a list of attribute names.")
+
+        known = field_names(self.fields)
+        for name in fields:
+            if name not in known:
+                raise TypeError("'%s' is not a field of %s objects. It must be one of these: %s" % (name, self.fields.__name__, known))
+
+        names = set(fields)
+        # Comments arrive as comment elements and are renamed by the parser.
+        if 'comments' in names or 'comment' in names:
+            names.update(('comment', 'comments'))
+        return {self.fields:frozenset(names)}
+
+    def bind(self, args, kwargs):
+        """Checks args and kwargs against this method's parameters and returns
+        the (name, value) pairs to send to Posterous. Raises a TypeError if
+        the arguments are not appropriate given this API call's definition.
+        kwargs is consumed."""
+        given = len(args) + len(kwargs)
+        if len(self.params) < given:
+            raise TypeError("function takes at most %s arguments (%s given)" % (len(self.params)+1, given+1))
+
+        data = []
+        positional = len(args)
+        for index, (name, p_type, optional, list_name) in enumerate(self.params):
+            value = None
+            if index < positional:
+                value = args[index]
+
+            # Check for positional and a keyword argument, raise error if
+            # there is an overlapping value
+            if name in kwargs:
+                if value:
+                    raise TypeError("got multiple values for keyword argument '%s'" % name)
+                value = kwargs.pop(name)
+
+            if value is None:
+                if not optional:
+                    raise TypeError("'%s' is required." % name)
+                continue
 
-def build_method(**conf):
-    """
-    Builds python functions based on the specified METHOD configuration
-    """
-    class MethodFactory(object):
-        def __init__(self, api, args, kwargs):
-            self.api = api
-            self.args = []
-            self.path = conf.get('path')
-            self.params = conf.get('parameters', [])
-            self.auth_required = conf.get('auth_required', False)
-            self.twitter_auth_required = conf.get('twitter_auth_required', False)
-            self.returns = conf.get('returns', [])
-            
-            # Raise an exception if authentication is required but credentials
-            # are not specified
-            if self.auth_required and not isinstance(self.api.auth, BasicAuth):
-                raise PyposterousError("The API object's auth attribute most be an instance of pyposterous.auth.BasicAuth to use this method.")
-            
-            if self.auth_required and not (self.api.auth.username and self.api.auth.password):           
-                raise PyposterousError('A username and password is required to use this method.')
-                
-            if self.twitter_auth_required and not isinstance(self.api.auth, TwitterAuth):
-                raise PyposterousError("The API object's auth attribute most be an instance of pyposterous.auth.TwitterAuth to use this method.")
-            
-            self.url = "http://%s%s" % (self.api.host, self.path)
-            self.__verify_args(list(args), kwargs)
-        
-        def __verify_args(self, args, kwargs):
-            """Check to make sure that the specified arguments are appropriate
-            given this API call's definition."""
-            if len(self.params) < len(args)+len(kwargs):
-                raise TypeError("function takes at most %s arguments (%s given)" % (len(self.params)+1, len(args)+len(kwargs)+1))
-            
-            # Reverse args so I can use pop -- reverse happens in place!
-            args.reverse()
-            
-            for name, p_type, config in self.params:
-                # Check for positional and a keyword argument, raise error if
-                # there is an overlapping value
-                value = None
-                if args:
-                    value = args.pop()
-                
-                if name in kwargs:
-                    if not value:
-                        try:
-                            value = kwargs.pop(name)
-                        except:
-                            pass
-                    else:
-                        raise TypeError("got multiple values for keyword argument '%s'" % name)
-                
-                # Make p_type a list if it isn't already.
-                if type(p_type) is not tuple:
-                    p_type = (p_type,)
-                
-                self.__verify_type(value, p_type, name)
-                self.__verify_options(value, config, name)
-                if value is not None:
-                    self.__clean_and_set_value(name, value)
-            
-            if kwargs:
-                raise TypeError("function got an unexpected keyword argument. %s" % kwargs)
-                
-        def __verify_type(self, value, p_type, name):
-            """Check to make sure that the type of the value specified is in 
-            the accepted type list.
-            
-            Keyword arguments:
-            value -- the value that we'll check the type of
-            p_type -- a list of acceptable types
-            name -- the name of the argument we're checking
-            
-            Returns True if succesful, throws a TypeError if not.
-            """
             # Check to make sure that value is the right type.
             if value and not isinstance(value, p_type):
                 raise TypeError("The value passed for '%s' is not valid. '%s' must be one of these: %s" % (name, name, p_type,))
-            
+
             # If the value was something iterable, we need to make sure the
             # elements are of the appropriate type - no nested lists allowed.
             if type(value) is list:
                 for a_value in value:
                     if not isinstance(a_value, p_type) or type(a_value) is list:
                         raise TypeError("One of the values passed for '%s' is not valid. All values in '%s' must be one of these: %s" % (name, name, p_type))
+                    data.append((list_name, a_value,))
+                continue
+
+            serializer = SERIALIZERS.get(type(value))
+            if serializer:
+                value = serializer(value)
+            data.append((name, value,))
+
+        if kwargs:
+            raise TypeError("function got an unexpected keyword argument. %s" % kwargs)
+
+        return data
+
+# Compiled signatures, by method name
+SIGNATURES = {}
+
+def get_signature(method_subsection, method_name):
+    """Returns the Signature for the specified method, compiling it on first
+    use."""
+    signature = SIGNATURES.get(method_name)
+    if signature is None:
+        config = METHODS.get(method_subsection, {}).get(method_name)
+        signature = SIGNATURES[method_name] = Signature(method_name, config)
+    return signature
+
+def find_signature(method_subsections, method_name):
+    """Returns the Signature for method_name if it is defined in one of
+    method_subsections. Raises an AttributeError otherwise."""
+    for method_subsection in method_subsections:
+        if method_name in METHODS.get(method_subsection, {}):
+            return get_signature(method_subsection, method_name)
+    raise AttributeError("There is no API method called '%s'" % method_name)
+
+class LazyMethod(object):
+    """Stands in for an API method on the API class. The method is built by
+    the class's _method_builder the first time it is looked up and cached
+    per class. Methods in sections the class doesn't list in
+    method_subsections don't exist."""
+    def __init__(self, method_subsection, method_name):
+        self.method_subsection = method_subsection
+        self.method_name = method_name
+        self.functions = {}
+
+    def __get__(self, instance, owner):
+        function = self.functions.get(owner)
+        if function is None:
+            if self.method_subsection not in owner.method_subsections:
+                raise AttributeError("'%s' object has no attribute '%s'" % (owner.__name__, self.method_name))
+            signature = get_signature(self.method_subsection, self.method_name)
+            function = self.functions[owner] = owner._method_builder(signature)
+
+        if instance is None:
+            return function
+        return types.MethodType(function, instance, owner)
+
+class MethodCall(object):
+    """A single call to an API method: validates the arguments and sends the
+    request."""
+    def __init__(self, api, signature, args, kwargs):
+        signature.check_auth(api)
+
+        # Only calls made by API objects with a stats collector are timed.
+        self.timing = None
+        if getattr(api, 'stats', None) is not None:
+            from pyposterous.stats import CallTiming
+            self.timing = CallTiming(signature.name)
+
+        self.options = {}
+        for name in signature.options:
+            if name in kwargs:
+                self.options[name] = kwargs.pop(name)
+
+        self.api = api
+        self.signature = signature
+        self.fields = signature.project(self.options.get('fields'))
+        self.args = signature.bind(args, kwargs)
+        self.url = signature.url(api.host)
+        self.validated = None
+        self.body = None
+
+        # When the call has to be finished by, in time.time() seconds
+        self.deadline = self.options.get('deadline')
+
+        if self.timing is not None:
+            self.timing.build += self.timing.lap()
+
+    def open(self):
+        """Sends the request and returns the response."""
+        import urllib
+
+        if self.timing is not None:
+            # Time spent waiting in a queue doesn't count.
+            self.timing.lap()
+
+        url = self.url
+        args = self.args
+        key = self.validator_key()
+        if key:
+            # Validators only mean something to GET requests.
+            if args:
+                url = "%s?%s" % (url, urllib.urlencode(args))
+                args = None
+            self.validated = self.api.validators.get(key)
+
+        # Generate a request object
+        req = self.api.auth.gen_request(url)
+
+        if self.validated:
+            etag, last_modified, data = self.validated
+            if etag:
+                req.add_header('If-None-Match', etag)
+            if last_modified:
+                req.add_header('If-Modified-Since', last_modified)
+
+        body = None
+        if args:
+            if [value for name, value in args if is_file(value)]:
+                # Files are streamed from disk as the request is sent. The
+                # encoder remembers where each file started, so it is reused
+                # if the request is sent again.
+                if self.body is None:
+                    self.body = MultipartEncoder(args, callback=self.options.get('progress'))
+                body = self.body
+                body.reset()
+                req.add_header('Content-Type', body.content_type())
+            else:
+                body = urllib.urlencode(args)
+                req.add_header('Content-Type', 'application/x-www-form-urlencoded')
+            req.add_header('Content-Length', str(len(body)))
+
+        if self.timing is None:
+            return self.api.transport.open(req, body, self.timeout())
+
+        from pyposterous.stats import TimedResponse
+
+        timeout = self.timeout()
+        self.timing.build += self.timing.lap()
+        response = self.api.transport.open(req, body, timeout)
+        self.timing.wait += self.timing.lap()
+        return TimedResponse(response, self.timing)
+
+    def timeout(self):
+        """Returns the (connect, read) timeout for the next request or None.
+        Neither is longer than the time left before the deadline. Raises a
+        PyposterousTimeout if the deadline has passed."""
+        timeout = self.options.get('timeout', getattr(self.api, 'timeout', None))
+        if timeout is None or type(timeout) is not tuple:
+            timeout = (timeout, timeout)
+        connect, read = timeout
+
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise PyposterousTimeout("The deadline for %s passed before the request was sent." % self.signature.name)
+            connect = min(connect or remaining, remaining)
+            read = min(read or remaining, remaining)
+
+        if connect is None and read is None:
+            return None
+        return (connect, read)
+
+    def open_checked(self):
+        """Like open, but raises a PyposterousError for responses whose
+        status says the request should be retried."""
+        resource = self.open()
+        code = resource.getcode()
+        if code in RETRY_STATUSES:
+            resource.close()
+            raise PyposterousError("%s connection error" % code, http_status=code)
+        return resource
+
+    def not_modified(self, resource):
+        """Returns True if resource is a 304 response to a conditional
+        request."""
+        if self.validated and resource.getcode() == 304:
+            self.api.validators.not_modified += 1
+            if self.timing is not None:
+                self.timing.cached = True
             return True
+        return False
+
+    def store_validators(self, key, resource, data):
+        """Remembers the validators sent with resource along with the
+        objects parsed from it."""
+        info = resource.info()
+        etag = info.getheader('ETag')
+        last_modified = info.getheader('Last-Modified')
+        if etag or last_modified:
+            self.api.validators.set(key, etag, last_modified, data)
+
+    def request_key(self):
+        """Returns a key that identifies this call's response."""
+        key = (self.api.host, getattr(self.api.auth, 'username', None), self.signature.name, tuple(self.args or ()))
+        if self.fields:
+            # Projected responses only have some of the attributes.
+            key += (tuple(sorted(self.fields[self.signature.fields])),)
+        return key
+
+    def cache_key(self):
+        """Returns the key this call's response is cached under or None
+        if it shouldn't be cached."""
+        if not self.signature.cache_ttl or getattr(self.api, 'cache', None) is None:
+            return None
+        return self.request_key()
+
+    def validator_key(self):
+        """Returns the key the validators for this call's response are
+        stored under or None if conditional requests aren't used."""
+        if not self.signature.idempotent or getattr(self.api, 'validators', None) is None:
+            return None
+        return self.request_key()
+
+    def site_scope(self):
+        """Returns the ('site_id', value) or ('hostname', value) argument
+        identifying the site this call is about, if there is one."""
+        for name, value in self.args or ():
+            if name in ('site_id', 'hostname'):
+                return (name, value)
+        return None
+
+    def execute(self):
+        """Sends the request (unless the response is cached) and returns the
+        objects it returned."""
+        if self.timing is None:
+            return self.fetch()
+
+        try:
+            try:
+                return self.fetch()
+            except Exception, e:
+                self.timing.error = e
+                raise
+        finally:
+            self.api.stats.add(self.timing)
+
+    def fetch(self):
+        if self.signature.test:
+            return None
+
+        key = self.cache_key()
+        if key:
+            hit, data = self.api.cache.get(key)
+            if hit:
+                if self.timing is not None:
+                    self.timing.cached = True
+                return self.shape(data)
+
+        scope = self.site_scope()
+        data = self.send(self.request)
+
+        if key:
+            self.api.cache.set(key, data, self.signature.cache_ttl, scope)
+        if self.signature.invalidates_cache and getattr(self.api, 'cache', None) is not None:
+            self.api.cache.invalidate(scope)
+
+        return self.shape(data)
+
+    def shape(self, data):
+        """Unwraps data, the list of objects parsed from a response, the
+        way the method returns them."""
+        from pyposterous.parser import shape
+        return shape(data, self.signature.returns)
+
+    def send(self, function):
+        """Calls function, which sends this call's request, through the
+        API's scheduler if it has one."""
+        scheduler = getattr(self.api, 'scheduler', None)
+        if scheduler is None:
+            return function()
+        return scheduler.run(self, function)
+
+    def parser(self, resource, stream):
+        """Returns a Parser for resource. Calls that are timed get a
+        TimedParser, and APIs created with lazy=True get a LazyParser."""
+        from pyposterous.parser import Parser, TimedParser, LazyParser, TimedLazyParser
+
+        lazy = getattr(self.api, 'lazy', False)
+        if self.timing is None:
+            if lazy:
+                return LazyParser(self.api, resource, self.signature.returns, stream, self.fields)
+            return Parser(self.api, resource, self.signature.returns, stream, self.fields)
+        if lazy:
+            return TimedLazyParser(self.api, resource, self.signature.returns, stream, self.timing, self.fields)
+        return TimedParser(self.api, resource, self.signature.returns, stream, self.timing, self.fields)
+
+    def request(self):
+        """Sends the request and returns the list of objects parsed from the
+        response. It's the same list iterate() hands out, so responses are
+        cached in one form whichever way they were requested."""
+        returns = self.signature.returns
+        key = self.validator_key()
+        resource = self.open()
+        try:
+            if self.not_modified(resource):
+                return self.validated[2]
+
+            # The twitter calls need the whole document. Everything else
+            # is parsed as it arrives.
+            stream = 'force_primative' not in returns
+            started = time.time()
+            if getattr(self.api, 'parse_pool', None) is not None:
+                data = self.parse_remote(resource, stream)
+            else:
+                parser = self.parser(resource, stream)
+                parser.parse()
+                data = parser.output
+            if self.timing is not None:
+                self.timing.parsed(time.time() - started)
+
+            if key:
+                self.store_validators(key, resource, data)
+        finally:
+            # Pooled transports only reuse a connection once its
+            # response is closed, so always close it.
+            resource.close()
+
+        return data
+
+    def parse_remote(self, resource, stream):
+        """Reads the whole response and parses it in the API's parse_pool, a
+        multiprocessing pool, so parsing doesn't hold the GIL of this 
+        process. Returns the objects with self.api as their API instance."""
+        import socket
+        from multiprocessing import TimeoutError
+        from pyposterous import codec
+        from pyposterous.parser import parse_response
         
-        def __verify_options(self, value, config, name):
-            """Raise type errors if the options defined by conifg are not
-            satisfied.
-            
-            Keyword arguments:
-            value -- the value to be checked
-            config -- a list of configuration options: 'optional' is the only option implemented right now
-            name -- the name of the parameter we're doing a check for right now.
-            
-            Returns True if succesful, throws a TypeError if not.
-            """
-            if 'optional' not in config and value is None:
-                raise TypeError("'%s' is required." % name)
-            
-            return True
-        
-        def __clean_and_set_value(self, name, value):
-            if type(value) == datetime:
-                value = "%s +0000" % value.strftime('%a, %d %b %Y %H:%M:%S').split('.')[0]
-            
-            if type(value) == bool:
-                value = int(value)
-            
-            if type(value) == int:
-                value = str(value)
-            
-            if type(value) == list:
-                for val in value:
-                    self.args.append(("%s[]" % name, val,))
-                return 
-            
-            if type(value) == Tag:
-                value = str(value)
-            
-            self.args.append((name, value,))
+        try:
+            body = resource.read()
+        except socket.timeout:
+            raise PyposterousTimeout("Timed out reading the response from Posterous")
         
-        def execute(self):
-            import urllib2_file
-            import base64
-            
-            # Anything with TEST in the URL is a test function, not a real API
-            # call
-            if 'TEST' in self.url:
-                return None
-            
-            # urlopen doesn't like an empty list for 'data', so make it None
-            if not self.args:
-                self.args = None
-            
-            # Generate a request object
-            req = self.api.auth.gen_request(self.url)
-            
+        result = self.api.parse_pool.apply_async(parse_response, (resource.getcode(), body, self.signature.returns, stream, self.fields))
+        remaining = None
+        if self.deadline is not None:
+            remaining = max(0, self.deadline - time.time())
+        try:
+            encoded = result.get(remaining)
+        except TimeoutError:
+            raise PyposterousTimeout("Timed out waiting for the response to %s to be parsed." % self.signature.name)
+        return codec.loads(encoded, self.api)
+    
+    def stream(self):
+        """Returns an iterator over the returned objects. They are handed out
+        one at a time as they are parsed."""
+        if self.timing is None:
+            return self.iterate()
+        return self.record(self.iterate())
+
+    def record(self, objects):
+        """Yields objects and adds this call's timing to the API's stats
+        once they run out or the caller stops."""
+        try:
             try:
-                resource = urllib2.urlopen(req, self.args)
-            except (urllib2.HTTPError,), e:
-                resource = e
-            parser = Parser(self.api, resource, self.returns)
-            
-            data = parser.parse()
+                for obj in objects:
+                    yield obj
+            except Exception, e:
+                self.timing.error = e
+                raise
+        finally:
+            objects.close()
+            self.api.stats.add(self.timing)
+
+    def timed(self, objects):
+        """Yields objects, recording the time spent producing them as parse
+        time."""
+        elapsed = 0.0
+        try:
+            started = time.time()
+            for obj in objects:
+                elapsed += time.time() - started
+                yield obj
+                started = time.time()
+            elapsed += time.time() - started
+        finally:
+            objects.close()
+            self.timing.parsed(elapsed)
+
+    def iterate(self):
+        if self.signature.test:
+            return
+
+        ttl = self.signature.cache_ttl
+        key = self.cache_key()
+        if key:
+            hit, data = self.api.cache.get(key)
+            if hit:
+                if self.timing is not None:
+                    self.timing.cached = True
+                for obj in data:
+                    yield obj
+                return
+
+        scope = self.site_scope()
+        validator_key = self.validator_key()
+        # Objects can't be taken back once they're yielded, so only opening
+        # the response is retried.
+        resource = self.send(self.open_checked)
+        if self.not_modified(resource):
             resource.close()
-            
-            return data
-            
+            data = self.validated[2]
+            if key:
+                self.api.cache.set(key, data, ttl, scope)
+            for obj in data:
+                yield obj
+            return
+
+        data = []
+        parser = self.parser(resource, True)
+        objects = parser.iterparse()
+        if self.timing is not None:
+            objects = self.timed(objects)
+        try:
+            for obj in objects:
+                data.append(obj)
+                yield obj
+        finally:
+            objects.close()
+            # Only complete responses are cached. The caller may stop
+            # before the last few objects once the whole document has
+            # been read, so pick up the ones it didn't take.
+            if parser.complete:
+                data.extend(parser.clean_up(parser.output))
+                if key:
+                    self.api.cache.set(key, data, ttl, scope)
+                if validator_key:
+                    self.store_validators(validator_key, resource, data)
+            resource.close()
+
+def build_method(signature):
+    """
+    Builds python functions based on the specified Signature
+    """
     def _method(api, *args, **kwargs):
-        method = MethodFactory(api, args, kwargs)
-        return method.execute()
-    _method.__doc__ = docstring_trim(conf.get('__doc__'))
-    
-    for param, types, config in conf.get('parameters', []):
-        if 'page' == param:
-            _method.pagination = True
-            break
-    
-    return _method
\ No newline at end of file
+        return MethodCall(api, signature, args, kwargs).execute()
+    _method.__doc__ = signature.__doc__
+
+    def _stream(api, *args, **kwargs):
+        return MethodCall(api, signature, args, kwargs).stream()
+    _method.stream = _stream
+
+    if signature.pagination:
+        _method.pagination = True
+
+    return _method
+
+def build_async_method(signature):
+    """
+    Builds python functions based on the specified Signature that return a
+    pyposterous.workers.Future instead of blocking. Arguments are validated
+    immediately; the request is sent from the API's worker pool.
+    """
+    def _method(api, *args, **kwargs):
+        return api.pool.submit(MethodCall(api, signature, args, kwargs).execute)
+    _method.__doc__ = signature.__doc__
+
+    return _method
@@ -0,0 +1,490 @@
+from datetime import datetime
+
+from pyposterous.error import PyposterousError
+from pyposterous.fanout import site_arguments
+from pyposterous.models import Post, Comment, Media, Image, Tag
+
+# Bumped whenever the tables change. Databases written with another version
+# are refused instead of being misread.
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    site TEXT PRIMARY KEY,
+    complete INTEGER NOT NULL DEFAULT 0,
+    synced timestamp
+);
+CREATE TABLE IF NOT EXISTS posts (
+    site TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    url TEXT,
+    link TEXT,
+    title TEXT,
+    body TEXT,
+    date timestamp,
+    views INTEGER,
+    private INTEGER,
+    author TEXT,
+    authorpic TEXT,
+    commentsenabled INTEGER,
+    commentscount INTEGER,
+    PRIMARY KEY (site, id)
+);
+CREATE INDEX IF NOT EXISTS posts_site_date ON posts (site, date, id);
+CREATE INDEX IF NOT EXISTS posts_site_views ON posts (site, views, id);
+CREATE INDEX IF NOT EXISTS posts_site_commentscount ON posts (site, commentscount, id);
+CREATE INDEX IF NOT EXISTS posts_date ON posts (date, id);
+CREATE INDEX IF NOT EXISTS posts_views ON posts (views, id);
+CREATE INDEX IF NOT EXISTS posts_author ON posts (author, date);
+CREATE TABLE IF NOT EXISTS post_tags (
+    site TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (site, post_id, tag)
+);
+CREATE INDEX IF NOT EXISTS post_tags_tag ON post_tags (tag, site, post_id);
+CREATE TABLE IF NOT EXISTS comments (
+    site TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id INTEGER,
+    body TEXT,
+    date timestamp,
+    author TEXT,
+    authorpic TEXT,
+    PRIMARY KEY (site, post_id, position)
+);
+CREATE TABLE IF NOT EXISTS media (
+    site TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT,
+    url TEXT,
+    filesize INTEGER,
+    height INTEGER,
+    width INTEGER,
+    thumb TEXT,
+    flv TEXT,
+    mp4 TEXT,
+    PRIMARY KEY (site, post_id, position)
+);
+CREATE TABLE IF NOT EXISTS images (
+    site TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    media INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT,
+    filesize INTEGER,
+    height INTEGER,
+    width INTEGER,
+    PRIMARY KEY (site, post_id, media, name)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    site TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    tag_string TEXT,
+    count INTEGER,
+    PRIMARY KEY (site, id)
+);
+"""
+
+# The columns stored for each type, in table order after the keys
+POST_COLUMNS = ('id', 'url', 'link', 'title', 'body', 'date', 'views', 'private', 'author', 'authorpic', 'commentsenabled', 'commentscount')
+COMMENT_COLUMNS = ('id', 'body', 'date', 'author', 'authorpic')
+MEDIA_COLUMNS = ('type', 'url', 'filesize', 'height', 'width', 'thumb', 'flv', 'mp4')
+IMAGE_COLUMNS = ('url', 'filesize', 'height', 'width')
+TAG_COLUMNS = ('id', 'tag_string', 'count')
+
+# Columns that hold booleans. SQLite stores them as 0 and 1.
+BOOLEANS = ('private', 'commentsenabled')
+
+# Columns of the posts table that queries can scan ranges of and sort by.
+# Each one is indexed.
+RANGE_COLUMNS = ('date', 'views', 'commentscount', 'id')
+
+def site_key(site):
+    """Returns the key a site's rows are stored under and the keyword
+    arguments that identify it to read_posts and get_tags. A site mirrored
+    by hostname and by id is mirrored twice."""
+    arguments = site_arguments(site)
+    name, value = arguments.items()[0]
+    return "%s:%s" % (name, value), arguments
+
+class Mirror(object):
+    """A local copy of the posts, comments, media, and tags of Posterous
+    sites, kept in a SQLite database.
+
+    The first sync of a site reads every page of its posts. Later syncs
+    read the newest pages until they reach a post that is already stored, so
+    a refresh usually costs a page or two. Posts on the pages that are read
+    are updated; edits to older posts and comments added to them are only
+    picked up by sync(site, full=True). If a sync doesn't finish, the next
+    one reads everything again.
+
+    Attributes Posterous returns that the tables don't have a column for
+    aren't stored.
+
+    Keyword arguments:
+
+    * api -- The API instance used to sync and given to the objects read back
+    * path -- (Optional) The database file. Defaults to an in-memory database.
+    * num_posts -- (Optional) The number of posts to request per page
+
+    """
+    def __init__(self, api, path=':memory:', num_posts=50):
+        import sqlite3
+
+        self.api = api
+        self.num_posts = num_posts
+        self.db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+
+        # Read requests made by the last sync
+        self.requests = 0
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise PyposterousError("%s was written by another version of pyposterous (schema %s, expected %s)." % (path, version, SCHEMA_VERSION))
+        self.db.executescript(SCHEMA)
+        self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def sync(self, site, full=False):
+        """Brings the stored copy of site up to date and returns the posts
+        that weren't stored before, newest first.
+
+        Keyword arguments:
+
+        * site -- A Site, a hostname, or a site id
+        * full -- (Optional) Read every page, even if the site has been synced before.
+
+        """
+        key, arguments = site_key(site)
+        incremental = not full and self.complete(key)
+        self.requests = 0
+
+        # Until this sync finishes, the site counts as never synced.
+        self.db.execute('INSERT OR REPLACE INTO sites (site, complete, synced) VALUES (?, 0, NULL)', (key,))
+        self.db.commit()
+
+        new = []
+        page = 1
+        while True:
+            posts = self.api.read_posts(page=page, num_posts=self.num_posts, **arguments)
+            self.requests += 1
+
+            reached = False
+            for post in posts:
+                if incremental and self.has_post(key, post.id):
+                    # Everything from here on is stored already.
+                    reached = True
+                elif not reached:
+                    new.append(post)
+
+            # Posts past the known one are stored again anyway; they were
+            # free and may have changed.
+            for post in posts:
+                self.store_post(key, post)
+            self.db.commit()
+
+            if reached or len(posts) < self.num_posts:
+                break
+            page += 1
+
+        tags = self.api.get_tags(**arguments)
+        self.requests += 1
+        self.db.execute('DELETE FROM tags WHERE site = ?', (key,))
+        for tag in tags:
+            self.db.execute('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)', (key,) + values(tag, TAG_COLUMNS))
+
+        self.db.execute('UPDATE sites SET complete = 1, synced = ? WHERE site = ?', (datetime.utcnow(), key))
+        self.analyze()
+        self.db.commit()
+        return new
+
+    def analyze(self):
+        """Updates the statistics SQLite uses to pick indexes for queries.
+        sync calls it; call it after storing posts with store_post."""
+        self.db.execute('ANALYZE')
+
+    def synced(self, site):
+        """Returns the time (UTC) the last sync of site finished or None."""
+        row = self.db.execute('SELECT complete, synced FROM sites WHERE site = ?', (site_key(site)[0],)).fetchone()
+        if row and row[0]:
+            return row[1]
+        return None
+
+    def complete(self, key):
+        """Returns True if a sync of the site stored under key has
+        finished."""
+        row = self.db.execute('SELECT complete FROM sites WHERE site = ?', (key,)).fetchone()
+        return bool(row and row[0])
+
+    def has_post(self, key, post_id):
+        return self.db.execute('SELECT 1 FROM posts WHERE site = ? AND id = ?', (key, post_id)).fetchone() is not None
+
+    def store_post(self, key, post):
+        """Stores post, replacing its comments and media."""
+        post_id = post.id
+        self.db.execute('INSERT OR REPLACE INTO posts VALUES (%s)' % ', '.join(['?'] * (len(POST_COLUMNS) + 1)), (key,) + values(post, POST_COLUMNS))
+
+        for table in ('comments', 'media', 'images', 'post_tags'):
+            self.db.execute('DELETE FROM %s WHERE site = ? AND post_id = ?' % table, (key, post_id))
+
+        for tag in tag_strings(post):
+            self.db.execute('INSERT OR IGNORE INTO post_tags VALUES (?, ?, ?)', (key, post_id, tag))
+
+        for position, comment in enumerate(getattr(post, 'comments', None) or []):
+            self.db.execute('INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (key, post_id, position) + values(comment, COMMENT_COLUMNS))
+
+        for position, media in enumerate(getattr(post, 'media', None) or []):
+            row = values(media, MEDIA_COLUMNS)
+            for name in ('thumb', 'medium'):
+                image = getattr(media, name, None)
+                if isinstance(image, Image):
+                    self.db.execute('INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (key, post_id, position, name) + values(image, IMAGE_COLUMNS))
+
+            # Video thumbnails are URLs, image thumbnails have their own row.
+            thumb = MEDIA_COLUMNS.index('thumb')
+            if not isinstance(row[thumb], basestring):
+                row = row[:thumb] + (None,) + row[thumb + 1:]
+            self.db.execute('INSERT INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (key, post_id, position) + row)
+
+    def query(self):
+        """Returns a Query over all of the stored posts."""
+        return Query(self)
+
+    def posts(self, site, where=None, parameters=()):
+        """Returns the stored posts of site, newest first. where is an
+        optional SQL condition on the columns of the posts table."""
+        query = self.query().site(site)
+        if where:
+            query = query.where(where, parameters)
+        return query.all()
+
+    def post(self, site, post_id):
+        """Returns the stored post with the id post_id or None."""
+        posts = self.posts(site, 'id = ?', (post_id,))
+        return posts and posts[0] or None
+
+    def tags(self, site):
+        """Returns the stored tags of site."""
+        key = site_key(site)[0]
+        rows = self.db.execute('SELECT id, tag_string, count FROM tags WHERE site = ? ORDER BY tag_string', (key,)).fetchall()
+        return [build(Tag(self.api), TAG_COLUMNS, row) for row in rows]
+
+    def build_posts(self, rows):
+        """Builds Post objects, with their comments, media, and tags, from
+        rows of the posts table."""
+        posts = []
+        sites = {}
+        for row in rows:
+            post = build(Post(self.api), POST_COLUMNS, row[1:])
+            posts.append(post)
+            sites.setdefault(row[0], {})[post.id] = post
+
+        for key, by_id in sites.items():
+            self.build_children(key, by_id)
+        return posts
+
+    def build_children(self, key, by_id):
+        """Reads the children of the posts in by_id, a dictionary of id -> 
+        Post for posts stored under key."""
+        # Children are read for all of the posts at once. SQLite limits the
+        # number of parameters, so very long lists are read in chunks.
+        ids = by_id.keys()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            condition = 'site = ? AND post_id IN (%s)' % ', '.join(['?'] * len(chunk))
+            parameters = [key] + chunk
+
+            for post_id, tag in self.db.execute('SELECT post_id, tag FROM post_tags WHERE %s ORDER BY post_id, tag' % condition, parameters):
+                post = by_id[post_id]
+                tags = getattr(post, 'tag', None)
+                if tags is None:
+                    post.tag = tag
+                elif type(tags) == list:
+                    tags.append(tag)
+                else:
+                    post.tag = [tags, tag]
+
+            images = {}
+            for row in self.db.execute('SELECT post_id, media, name, %s FROM images WHERE %s' % (', '.join(IMAGE_COLUMNS), condition), parameters):
+                images[row[:3]] = build(Image(self.api), IMAGE_COLUMNS, row[3:])
+
+            for row in self.db.execute('SELECT post_id, %s FROM comments WHERE %s ORDER BY post_id, position' % (', '.join(COMMENT_COLUMNS), condition), parameters):
+                post = by_id[row[0]]
+                if getattr(post, 'comments', None) is None:
+                    post.comments = []
+                post.comments.append(build(Comment(self.api), COMMENT_COLUMNS, row[1:]))
+
+            for row in self.db.execute('SELECT post_id, position, %s FROM media WHERE %s ORDER BY post_id, position' % (', '.join(MEDIA_COLUMNS), condition), parameters):
+                post = by_id[row[0]]
+                media = build(Media(self.api), MEDIA_COLUMNS, row[2:])
+                for name in ('thumb', 'medium'):
+                    image = images.get((row[0], row[1], name))
+                    if image is not None:
+                        setattr(media, name, image)
+                if getattr(post, 'media', None) is None:
+                    post.media = []
+                post.media.append(media)
+
+class Query(object):
+    """A query over the posts stored in a Mirror. Every method adds to the
+    query and returns a new Query; nothing is read until the query is 
+    iterated (or all, count, or ids is called). The conditions are answered 
+    by the indexes on the posts and post_tags tables.
+
+    Posts are read and built a batch at a time as the query is iterated, so 
+    large results don't have to fit in memory. Unless order_by is called,
+    posts come newest first.
+
+        query = mirror.query().site('pyposttest').tagged('python')
+        for post in query.range('date', datetime(2010, 1, 1), datetime(2011, 1, 1)):
+            print post.title
+        popular = query.top(10, 'views')
+
+    """
+    # The number of posts read per batch
+    batch = 100
+
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.key = None
+        self.tags = ()
+        self.conditions = ()
+        self.parameters = ()
+        self.order = ('date', True)
+        self.maximum = None
+
+    def copy(self, **changes):
+        query = Query(self.mirror)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(changes)
+        return query
+
+    def where(self, condition, parameters=()):
+        """Adds an SQL condition on the columns of the posts table."""
+        return self.copy(conditions=self.conditions + ('(%s)' % condition,), parameters=self.parameters + tuple(parameters))
+
+    def site(self, site):
+        """Only posts of site (a Site, a hostname, or a site id)."""
+        key = site_key(site)[0]
+        return self.where('posts.site = ?', (key,)).copy(key=key)
+
+    def author(self, author):
+        return self.where('posts.author = ?', (author,))
+
+    def tagged(self, tag):
+        """Only posts tagged with tag, a tag string or a Tag. Calling it 
+        again requires both tags."""
+        return self.copy(tags=self.tags + (unicode(tag),))
+
+    def range(self, column, low=None, high=None):
+        """Only posts with low <= column < high. column is one of date,
+        views, commentscount, and id. Either bound may be None."""
+        check_column(column)
+        query = self
+        if low is not None:
+            query = query.where('posts.%s >= ?' % column, (low,))
+        if high is not None:
+            query = query.where('posts.%s < ?' % column, (high,))
+        return query
+
+    def order_by(self, column, descending=True):
+        """Orders the posts by column, one of date, views, commentscount,
+        and id."""
+        check_column(column)
+        return self.copy(order=(column, descending))
+
+    def limit(self, maximum):
+        return self.copy(maximum=maximum)
+
+    def top(self, n, column='views'):
+        """Returns the n posts with the highest values of column."""
+        return self.order_by(column).limit(n).all()
+
+    def sql(self, columns='posts.*', ordered=True):
+        """Returns the SQL statement for this query and its parameters."""
+        sql = ['SELECT %s FROM posts' % columns]
+        conditions = list(self.conditions)
+        parameters = list(self.parameters)
+        for index, tag in enumerate(self.tags):
+            if self.key:
+                # Within a site, SQLite can start from the tag index and 
+                # look the posts up by id.
+                conditions.append('posts.id IN (SELECT post_id FROM post_tags WHERE tag = ? AND site = ?)')
+                parameters.extend((tag, self.key))
+            else:
+                alias = 't%s' % index
+                sql.append('JOIN post_tags %(alias)s ON %(alias)s.site = posts.site AND %(alias)s.post_id = posts.id AND %(alias)s.tag = ?' % {'alias':alias})
+                # Join parameters come before those of the conditions.
+                parameters.insert(index, tag)
+        if conditions:
+            sql.append('WHERE %s' % ' AND '.join(conditions))
+        if ordered:
+            column, descending = self.order
+            direction = descending and 'DESC' or 'ASC'
+            sql.append('ORDER BY posts.%s %s, posts.id %s' % (column, direction, direction))
+        if self.maximum is not None:
+            sql.append('LIMIT %d' % self.maximum)
+        return ' '.join(sql), parameters
+
+    def __iter__(self):
+        sql, parameters = self.sql()
+        cursor = self.mirror.db.execute(sql, parameters)
+        while True:
+            rows = cursor.fetchmany(self.batch)
+            if not rows:
+                break
+            for post in self.mirror.build_posts(rows):
+                yield post
+
+    def all(self):
+        return list(self)
+
+    def count(self):
+        sql, parameters = self.sql('COUNT(*)', False)
+        return self.mirror.db.execute(sql, parameters).fetchone()[0]
+
+    def ids(self):
+        """Returns the ids of the posts, without building them."""
+        sql, parameters = self.sql('posts.id')
+        return [row[0] for row in self.mirror.db.execute(sql, parameters)]
+
+    def explain(self):
+        """Returns SQLite's plan for this query, to check which indexes it
+        uses."""
+        sql, parameters = self.sql()
+        return "\n".join([row[-1] for row in self.mirror.db.execute('EXPLAIN QUERY PLAN ' + sql, parameters)])
+
+def check_column(column):
+    if column not in RANGE_COLUMNS:
+        raise PyposterousError("Posts can't be queried by %s. Use one of these: %s" % (column, ', '.join(RANGE_COLUMNS)))
+
+def tag_strings(post):
+    """Returns the tags of post as strings. Posterous returns them as tag 
+    elements, which end up as a string, a Tag, or a list of either."""
+    tags = getattr(post, 'tag', None)
+    if tags is None:
+        return []
+    if type(tags) != list:
+        tags = [tags]
+    return [unicode(tag) for tag in tags if unicode(tag)]
+
+def values(obj, columns):
+    """Returns the values of the attributes of obj named in columns, None
+    for the missing ones."""
+    return tuple([getattr(obj, name, None) for name in columns])
+
+def build(obj, columns, row):
+    """Sets the attributes of obj from row. NULL columns are left unset."""
+    for name, value in zip(columns, row):
+        if value is None:
+            continue
+        if name in BOOLEANS:
+            value = bool(value)
+        setattr(obj, name, value)
+    return obj
@@ -1,14 +1,130 @@
 from pyposterous.error import PyposterousError
-from pyposterous.utils import parse_date, try_parse_int
+from pyposterous.utils import parse_post_date, parse_timestamp, try_parse_int
 
 class PosterousData(object):
+    """Base class for the objects built from Posterous responses.
+    
+    To keep large result sets small in memory, instances don't have a 
+    __dict__. The attributes Posterous is known to return for each type are
+    listed in its __slots__; anything else is kept in the extra dictionary
+    and is still available as a regular attribute.
+    
+    Objects built by pyposterous.parser.LazyParser have attributes that 
+    haven't been decoded yet. They're decoded the first time they are 
+    looked up.
+    
+    """
+    __slots__ = ('_PosterousData__api', '_PosterousData__pending', 'extra')
+    
+    # Element name -> converter for values of this type only. They take 
+    # precedence over attribute_map. Subclasses inherit their parents' 
+    # converters. Call reset_converters() after changing them at runtime.
+    converters = {}
+    
     def __init__(self, api):
         self.__api = api
+        self.__pending = None
+        self.extra = None
     
     def api(self):
         return self.__api
+    
+    def __getattr__(self, name):
+        # Only called when name isn't a class attribute or a filled slot.
+        if name in ('extra', '_PosterousData__pending'):
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+        
+        if self.__pending and name in self.__pending:
+            return self.decode(name)
+        
+        if not self.extra or name not in self.extra:
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+        return self.extra[name]
+    
+    def defer(self, pending):
+        """Sets attributes that are decoded on first access. pending is a
+        dictionary of name -> (function, args); the attribute's value is 
+        function(*args)."""
+        self.__pending = pending or None
+    
+    def decode(self, name):
+        """Decodes the pending attribute name and returns its value."""
+        # The value is set before it's removed from the pending attributes,
+        # so other threads never see it missing. At worst they decode it 
+        # too.
+        function, args = self.__pending[name]
+        value = function(*args)
+        setattr(self, name, value)
+        self.__pending.pop(name, None)
+        return value
+    
+    def decode_all(self):
+        """Decodes all of the pending attributes."""
+        for name in list(self.__pending or ()):
+            try:
+                # Values set since the object was built win.
+                object.__getattribute__(self, name)
+            except AttributeError:
+                if not self.extra or name not in self.extra:
+                    self.decode(name)
+                    continue
+            self.__pending.pop(name, None)
+    
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+    
+    def __delattr__(self, name):
+        try:
+            object.__delattr__(self, name)
+        except AttributeError:
+            if self.__pending and name in self.__pending:
+                del self.__pending[name]
+                return
+            if not self.extra or name not in self.extra:
+                raise
+            del self.extra[name]
+    
+    def fields(self):
+        """Returns the names of the slots declared for this type."""
+        return field_names(self.__class__)
+    
+    def as_dict(self):
+        """Returns a dictionary of the attributes set on this object."""
+        self.decode_all()
+        data = dict(self.extra or {})
+        for name in self.fields():
+            try:
+                data[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return data
+    
+    def __getstate__(self):
+        # The API handle isn't pickled. Unpickled objects have to be given 
+        # a new one before their helper methods can be used.
+        return self.as_dict()
+    
+    def __setstate__(self, state):
+        self.__init__(None)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+def field_names(model):
+    """Returns the names of the slots declared for model."""
+    names = []
+    for cls in model.__mro__:
+        if cls is not PosterousData:
+            names.extend(cls.__dict__.get('__slots__', ()))
+    return names
 
 class Site(PosterousData):    
+    __slots__ = ('id', 'name', 'url', 'hostname', 'private', 'primary', 'commentsenabled', 'num_posts')
+    
     def get_tags(self):
         """Returns the tags for this site using self.id first and self.hostname
         second. If neither is specified, a PosterousError is raised.
@@ -51,6 +167,8 @@ class Site(PosterousData):
             raise PyposterousError('No id attribute defined for this site instance.')
 
 class Tag(PosterousData):
+    __slots__ = ('id', 'tag_string', 'count')
+    
     def __str__(self):
         try:
             return self.tag_string
@@ -58,6 +176,8 @@ class Tag(PosterousData):
             return ''
 
 class Post(PosterousData):
+    __slots__ = ('id', 'url', 'link', 'title', 'body', 'date', 'views', 'private', 'author', 'authorpic', 'commentsenabled', 'commentscount', 'comment', 'comments', 'media', 'tag')
+    
     def update_post(self, media=None):
         """Updates the post this object represents based on the values of 
         self.id, self.title, and self.body. If self.id isn't specified, a
@@ -104,16 +224,16 @@ class Post(PosterousData):
     new_comment.pagination=True
 
 class Comment(PosterousData):
-    pass
+    __slots__ = ('id', 'body', 'date', 'author', 'authorpic')
 
 class Media(PosterousData):
-    pass
+    __slots__ = ('type', 'url', 'filesize', 'height', 'width', 'thumb', 'medium', 'flv', 'mp4')
 
 class Image(PosterousData):
-    pass
+    __slots__ = ('url', 'filesize', 'height', 'width')
 
 class User(PosterousData):
-    pass
+    __slots__ = ('id', 'name', 'url')
 
 # Posterous element -> class mapping
 element_map = {
@@ -131,10 +251,38 @@ element_map = {
 # Attributes specified in the key are cleaned by the function specified in 
 # the value
 attribute_map = {
-    ('id'):lambda x: try_parse_int(x),
+    ('id',):lambda x: try_parse_int(x),
     ('views', 'filesize', 'height', 'width', 'commentscount', 'num_posts', 'size', ):int,
     ('private', 'commentsenabled', 'primary'):lambda x: x.upper() == 'TRUE',
     ('body',):lambda x: x.strip(), # Hopefully whitespace will not be significant. 
-    ('timestamp',):lambda x: parse_date(x, '%a %b %d %H:%M:%S %Y'),
-    ('date',):lambda x: parse_date(x),} 
-    
\ No newline at end of file
+    ('timestamp',):parse_timestamp,
+    ('date',):parse_post_date,}
+
+# Flattened converter tables by model class (None for values that don't
+# belong to a model). Built on first use.
+CONVERTER_INDEX = {}
+
+def converter_index(model=None):
+    """Returns a dictionary of element name -> converter for the attributes
+    of model, combining attribute_map with the converters declared by model
+    and its base classes."""
+    index = CONVERTER_INDEX.get(model)
+    if index is None:
+        index = {}
+        for names, converter in attribute_map.items():
+            if isinstance(names, basestring):
+                names = (names,)
+            for name in names:
+                index[name] = converter
+        
+        if model is not None:
+            for cls in reversed(model.__mro__):
+                index.update(cls.__dict__.get('converters', {}))
+        
+        CONVERTER_INDEX[model] = index
+    return index
+
+def reset_converters():
+    """Discards the converter tables, so changes to attribute_map or to a 
+    model's converters take effect."""
+    CONVERTER_INDEX.clear()
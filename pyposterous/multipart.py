@@ -0,0 +1,119 @@
+import os
+
+# How much of a file is read into memory at a time while it is sent.
+CHUNK_SIZE = 64 * 1024
+
+def is_file(value):
+    return hasattr(value, 'read')
+
+class MultipartEncoder(object):
+    """Encodes (name, value) pairs as a multipart/form-data request body.
+
+    Files are read from disk chunk_size bytes at a time as the body is sent,
+    so memory use doesn't depend on how big they are. The total length is
+    computed up front from the file sizes, so the body can be sent with a
+    Content-Length header. Instances are file-like (read()) and iterable.
+
+    Keyword arguments:
+
+    * fields -- A list of (name, value) pairs. Values are strings or file objects.
+    * chunk_size -- (Optional) How many bytes of a file to read at a time.
+    * callback -- (Optional) Called with (bytes_sent, total_bytes) after every chunk.
+
+    """
+    def __init__(self, fields, chunk_size=CHUNK_SIZE, callback=None):
+        import uuid
+
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.callback = callback
+
+        # (part header, file, offset, size) or (part, None, 0, len(part))
+        self.parts = []
+        for name, value in fields:
+            if is_file(value):
+                offset = value.tell()
+                size = os.fstat(value.fileno()).st_size - offset
+                self.parts.append((self.__file_header(name, value), value, offset, size))
+            else:
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                part = '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (self.boundary, name, value)
+                self.parts.append((part, None, 0, len(part)))
+        self.closing = '--%s--\r\n' % self.boundary
+
+        self.length = len(self.closing)
+        for header, value, offset, size in self.parts:
+            if value is not None:
+                self.length += len(header) + size + 2
+            else:
+                self.length += size
+
+        self.reset()
+
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        """Yields the body in chunks."""
+        for header, value, offset, size in self.parts:
+            if value is None:
+                yield header
+                continue
+
+            yield header
+            value.seek(offset)
+            remaining = size
+            while remaining > 0:
+                chunk = value.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError("%s changed size while it was being uploaded" % getattr(value, 'name', 'A file'))
+                remaining -= len(chunk)
+                yield chunk
+            yield '\r\n'
+        yield self.closing
+
+    def reset(self):
+        """Starts over from the beginning of the body, so a request can be
+        sent again."""
+        self.chunks = iter(self)
+        self.chunk = ''
+        self.position = 0
+        self.sent = 0
+
+    def read(self, size=-1):
+        """Returns up to size bytes of the body. Only reads everything if
+        size is negative."""
+        pieces = []
+        wanted = size
+        while size < 0 or wanted > 0:
+            if self.position >= len(self.chunk):
+                try:
+                    self.chunk = self.chunks.next()
+                except StopIteration:
+                    break
+                self.position = 0
+
+            if size < 0:
+                piece = self.chunk[self.position:]
+            else:
+                piece = self.chunk[self.position:self.position + wanted]
+                wanted -= len(piece)
+            self.position += len(piece)
+            pieces.append(piece)
+
+        data = ''.join(pieces)
+        self.sent += len(data)
+        if data and self.callback:
+            self.callback(self.sent, self.length)
+        return data
+
+    def __file_header(self, name, value):
+        import mimetypes
+
+        filename = os.path.basename(getattr(value, 'name', name))
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' % (self.boundary, name, filename, content_type)
@@ -1,29 +1,62 @@
+import socket
+import time
 import xml.etree.ElementTree as ET
 
-from pyposterous.error import PyposterousError
-from pyposterous.models import element_map, attribute_map
+# datetime.strptime imports _strptime lazily, which isn't thread safe in
+# Python 2. Import it up front so parsers running on worker threads don't 
+# race each other.
+import _strptime
+
+from pyposterous.error import PyposterousError, PyposterousTimeout
+from pyposterous.models import element_map, converter_index
 
 class Parser(object):
     """This object is responsible for parsing the Pyposterous API data and 
-    returning nice Python objects."""
+    returning nice Python objects.
+    
+    fields is an optional dictionary of model -> attribute names. Only 
+    those attributes are built for objects of that model at the top level
+    of the response.
+    
+    """
     
-    def __init__(self, api, resource, return_conf):
+    def __init__(self, api, resource, return_conf, stream=False, fields=None):
         self.api = api
         self.resource = resource
         self.return_conf = return_conf
+        self.fields = fields
         self.output = []
+        self.xml = None
+        self.complete = False
+        
+        # Streaming parsers read the resource incrementally in iterparse.
+        if stream:
+            return
         
-        # If the following is failing, either Posterous is giving us garbage
-        # or there are connection issues occuring. Most likely connection issues.
         try:
             self.xml = ET.parse(self.resource)
+        except socket.timeout:
+            self.timeout_error()
         except:
-            if self.resource.getcode() == 200:
-                raise PyposterousError("malformed XML returned by Posterous")
-            raise PyposterousError("%s connection error" % self.resource.getcode())
-        
+            self.read_error()
+    
+    def read_error(self):
+        """Raises a PyposterousError explaining why the resource could not be
+        parsed."""
+        # If we get here, either Posterous is giving us garbage or there are
+        # connection issues occuring. Most likely connection issues.
+        if self.resource.getcode() == 200:
+            raise PyposterousError("malformed XML returned by Posterous")
+        code = self.resource.getcode()
+        raise PyposterousError("%s connection error" % code, http_status=code)
         
+    def timeout_error(self):
+        raise PyposterousTimeout("Timed out reading the response from Posterous")
+    
     def parse(self):
+        if self.xml is None:
+            return self.shape(list(self.iterparse()))
+        
         # This is to handle the twitter api calls specifically.
         if 'force_primative' in self.return_conf:
             self.output = {}
@@ -48,48 +81,110 @@ class Parser(object):
             for element in root.getchildren():
                 obj = self.build_object(element)
                 if obj:
-                    # Okay. This is a little weird. When the Posterous API returns
-                    # results, it sometimes returns children elements as children
-                    # of their parent (e.g. comments as children of their post),
-                    # and sometimes they don't do that, and they just give 
-                    # everything as a big hairy list (e.g. both the post AND
-                    # its comments at the top level). TODO: Ask dev group about this
-                
-                    # To fix this problem, I'm going to append subsequent elements
-                    # to the previous element returned if the types don't match.
-                    # 3 posts will return a list of 3 posts, 1 post and 2 comments
-                    # will return 1 post with a list of 2 comments as an attrib.
-                
-                    try:
-                        if type(obj) == type(self.output[-1]):
-                            self.output.append(obj)
-                        else:
-                            attrib = obj.__class__.__name__.lower()
-                        
-                            existing = getattr(self.output[-1], attrib, None)                        
-                            if existing and type(existing) == list:
-                                existing.append(obj)
-                            elif not existing:
-                                setattr(self.output[-1], attrib, [obj,])
-                            else:
-                                # If this happens, then my little XML inconsistency
-                                # hack is overwritting a legitimate value.
-                                raise PyposterousError("Posterous API response could not be parsed.")
-                    except IndexError:
-                        # There was no previous element!
-                        self.output.append(obj)
-        
-        self.output = self.clean_up(self.output)
-        output = self.output
-        
-        if len(self.output) == 1 and 'force_list' not in self.return_conf:
-            output = self.output[0]
-        
-        if len(self.output) == 0 and 'force_list' not in self.return_conf:
-            output = None
+                    self.add_output(obj)
         
-        return output
+        return self.shape(self.clean_up(self.output))
+    
+    def iterparse(self):
+        """Parses the resource incrementally, yielding objects as soon as
+        their elements have been read. Elements are discarded once they have
+        been converted, so memory use doesn't grow with the response size."""
+        depth = 0
+        root = None
+        
+        for event, element in self.__events():
+            if event == 'start':
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+            
+            depth -= 1
+            if depth == 0:
+                # Some V2 api calls return the output as the root of the 
+                # document. Those are built once the whole document is read.
+                if root.tag in element_map:
+                    self.output.append(self.build_object(root))
+                break
+            
+            if depth > 1 or root.tag in element_map:
+                continue
+            
+            obj = self.build_object(element)
+            root.clear()
+            if not obj:
+                continue
+            
+            # Another object of the same type means that the previous one
+            # (and anything add_output attached to it) is complete.
+            if self.output and type(obj) == type(self.output[-1]):
+                yield self.clean_up(self.output.pop())
+            self.add_output(obj)
         
+        # Everything has been read. Whatever is left in self.output can be
+        # handed out without touching the resource again.
+        self.complete = True
+        while self.output:
+            yield self.clean_up(self.output.pop(0))
+    
+    def __events(self):
+        """Yields iterparse events, converting parse errors into 
+        PyposterousErrors."""
+        events = ET.iterparse(self.resource, ('start', 'end'))
+        while True:
+            try:
+                event = events.next()
+            except StopIteration:
+                return
+            except socket.timeout:
+                self.timeout_error()
+            except:
+                self.read_error()
+            yield event
+    
+    def add_output(self, obj):
+        """Adds an object from the top level of a v1 response to 
+        self.output."""
+        # Okay. This is a little weird. When the Posterous API returns
+        # results, it sometimes returns children elements as children
+        # of their parent (e.g. comments as children of their post),
+        # and sometimes they don't do that, and they just give 
+        # everything as a big hairy list (e.g. both the post AND
+        # its comments at the top level). TODO: Ask dev group about this
+        
+        # To fix this problem, I'm going to append subsequent elements
+        # to the previous element returned if the types don't match.
+        # 3 posts will return a list of 3 posts, 1 post and 2 comments
+        # will return 1 post with a list of 2 comments as an attrib.
+        
+        try:
+            if type(obj) == type(self.output[-1]):
+                self.output.append(obj)
+            else:
+                attrib = obj.__class__.__name__.lower()
+                wanted = self.fields and self.fields.get(type(self.output[-1]))
+                if wanted is not None and attrib not in wanted:
+                    return
+                
+                existing = getattr(self.output[-1], attrib, None)                        
+                if existing and type(existing) == list:
+                    existing.append(obj)
+                elif not existing:
+                    setattr(self.output[-1], attrib, [obj,])
+                else:
+                    # If this happens, then my little XML inconsistency
+                    # hack is overwritting a legitimate value.
+                    raise PyposterousError("Posterous API response could not be parsed.")
+        except IndexError:
+            # There was no previous element!
+            self.output.append(obj)
+    
+    def shape(self, output):
+        """Unwraps output based on self.return_conf. self.output keeps the
+        list."""
+        self.output = output
+        return shape(output, self.return_conf)
+
 
     def build_object(self, element):
         """Accepts an element tree element and builds an object based on the
@@ -121,9 +216,13 @@ class Parser(object):
             return obj
             
         obj = obj(self.api)
+        converters = converter_index(type(obj))
+        wanted = self.fields and self.fields.get(type(obj))
         # Add properties for all of element's children        
         for prop in element.getchildren():
             prop_tag = prop.tag.lower()
+            if wanted is not None and prop_tag not in wanted:
+                continue
             
             # If the element doesn't have any chidlren, using the element map obj
             # will hide the returned data. We don't want that. Most notably, this 
@@ -146,7 +245,11 @@ class Parser(object):
                     getattr(obj, prop_tag).append(self.build_object(prop))
             else:
                 # Base case - set a property called prop.tag in obj
-                setattr(obj, prop_tag, self.clean_value(prop_tag, prop.text))
+                value = prop.text
+                converter = converters.get(prop_tag)
+                if converter is not None:
+                    value = converter(value)
+                setattr(obj, prop_tag, value)
         
         return obj
     
@@ -201,8 +304,165 @@ class Parser(object):
                 
         raise PyposterousError("%s" % message, "%s" % code)
     
-    def clean_value(self, name, value):
-        for names in attribute_map:
-            if name in names:
-                return attribute_map.get(names)(value)
-        return value
+    def clean_value(self, name, value, model=None):
+        """Converts value with the converter for name, if there is one. See
+        pyposterous.models.converter_index."""
+        converter = converter_index(model).get(name)
+        if converter is None:
+            return value
+        return converter(value)
+
+class LazyParser(Parser):
+    """A Parser that builds objects without decoding their attributes. 
+    Values are kept as the text Posterous returned and converted on first 
+    access, and nested objects (media, comments, images...) are only built
+    when they are looked up. Callers that only read a few attributes of each
+    object skip the rest of the work.
+    
+    Nested elements are kept until they're decoded, so lazy objects hold on
+    to more memory than fully built ones.
+    
+    """
+    
+    def build_object(self, element):
+        if element.tag == 'err' or element.tag == 'error':
+            self.build_error(element)
+        
+        model = element_map.get(element.tag)
+        if model is None:
+            return Parser.build_object(self, element)
+        return build_lazy(self.api, model, element, self.fields and self.fields.get(model))
+    
+    def clean_up(self, obj):
+        # Nested objects are renamed and turned into lists as they're 
+        # decoded. Only comments add_output attached are left to clean up.
+        for item in (type(obj) == list and obj or [obj]):
+            try:
+                comment = object.__getattribute__(item, 'comment')
+            except AttributeError:
+                continue
+            del item.comment
+            if comment:
+                if type(comment) != list:
+                    comment = [comment,]
+                item.comments = comment
+        return obj
+
+def build_lazy(api, model, element, wanted=None):
+    """Returns an instance of model for element with its attributes left 
+    undecoded. See LazyParser. If wanted is given, only the elements named
+    in it are kept."""
+    obj = model(api)
+    converters = converter_index(model)
+    pending = {}
+    children = None
+    
+    for prop in element:
+        tag = prop.tag.lower()
+        if wanted is not None and tag not in wanted:
+            continue
+        
+        # See Parser.build_object for why childless elements are values.
+        if len(prop) and tag in element_map:
+            if tag == 'comment':
+                tag = 'comments'
+            if children is None:
+                children = {}
+            children.setdefault(tag, []).append(prop)
+            continue
+        
+        converter = converters.get(tag)
+        if converter is None:
+            setattr(obj, tag, prop.text)
+        else:
+            pending[tag] = (converter, (prop.text,))
+    
+    if children:
+        for tag, elements in children.items():
+            pending[tag] = (build_children, (api, tag, elements))
+    obj.defer(pending)
+    return obj
+
+def build_children(api, tag, elements):
+    """Builds the nested objects for elements. As with Parser.build_object 
+    and Parser.clean_up, several elements become a list and comments and 
+    media are always lists."""
+    objects = [build_lazy(api, element_map[element.tag.lower()], element) for element in elements]
+    if len(objects) == 1 and tag not in ('comments', 'media'):
+        return objects[0]
+    return objects
+
+class TimedParser(Parser):
+    """A Parser that records the objects it builds, and how long building
+    them takes, in a pyposterous.stats.CallTiming."""
+    
+    def __init__(self, api, resource, return_conf, stream=False, timing=None, fields=None):
+        self.timing = timing
+        self.nested = 0
+        Parser.__init__(self, api, resource, return_conf, stream, fields)
+    
+    def build_object(self, element):
+        obj = self.__timed(super(TimedParser, self).build_object, element)
+        if obj is not None:
+            self.timing.objects += 1
+        return obj
+    
+    def clean_up(self, obj):
+        return self.__timed(super(TimedParser, self).clean_up, obj)
+    
+    def __timed(self, function, value):
+        # build_object calls itself for nested objects. Only the outermost
+        # call is timed.
+        if self.nested:
+            return function(value)
+        
+        self.nested += 1
+        started = time.time()
+        try:
+            return function(value)
+        finally:
+            self.timing.construct += time.time() - started
+            self.nested -= 1
+
+class TimedLazyParser(TimedParser, LazyParser):
+    """A LazyParser that records its work like a TimedParser. Objects 
+    decoded after the call returns aren't counted."""
+
+class ReadResponse(object):
+    """A response whose body has already been read into a string."""
+    def __init__(self, status, body):
+        from cStringIO import StringIO
+        self.status = status
+        self.read = StringIO(body).read
+    
+    def getcode(self):
+        return self.status
+
+def shape(output, return_conf):
+    """Unwraps output, the list of objects parsed from a response, the way
+    return_conf says the method returns them: unless 'force_list' is given,
+    a single object is returned by itself and no objects as None."""
+    if type(output) is not list or 'force_list' in return_conf:
+        return output
+    
+    if len(output) == 1:
+        return output[0]
+    
+    if len(output) == 0:
+        return None
+    
+    return output
+
+def parse_response(status, body, return_conf, stream=True, fields=None):
+    """Parses a response body read by another process and returns the 
+    objects encoded by pyposterous.codec. ProcessAPI calls this in its pool
+    of processes and decodes the result with codec.loads, which gives the 
+    objects their API instance as it builds them. Unpickling alone is 
+    quicker, but once every unpickled object has been given its API 
+    instance it's usually a little slower than codec.loads (see the + api
+    column of benchmarks/codec.py), and the encoding is about 15% smaller.
+    The objects are returned as a list, before shape() unwraps them."""
+    from pyposterous import codec
+    parser = Parser(None, ReadResponse(status, body), return_conf, stream, fields)
+    parser.parse()
+    return codec.dumps(parser.output)
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from pyposterous.error import PyposterousError, PyposterousTimeout
+
+# HTTP status codes that mean the request may succeed if it is sent again
+# later.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket(object):
+    """Allows rate requests per second on average and bursts of up to burst
+    requests."""
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Takes a token, sleeping until one is available. Returns the number
+        of seconds spent waiting."""
+        self.lock.acquire()
+        try:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Tokens can go negative. Callers queue up behind each other
+            # and each one sleeps until its own token has been earned.
+            self.tokens -= 1
+            wait = 0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+        finally:
+            self.lock.release()
+
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class Scheduler(object):
+    """Retries failed requests with exponential backoff and limits the rate
+    requests are sent at. Pass one to the API class to use it.
+
+    Connection errors, timeouts, and responses with one of the
+    RETRY_STATUSES are retried, but never past the call's deadline. Methods
+    the IDL declares idempotent are always retried; other methods are only
+    retried if they are declared retry_safe.
+
+    Keyword arguments:
+
+    * retries -- (Optional) The maximum number of times a request is retried.
+    * backoff -- (Optional) Seconds to wait before the first retry. The wait doubles with every retry.
+    * max_backoff -- (Optional) The longest wait between retries.
+    * jitter -- (Optional) The fraction of every wait that is random (0 to 1), so clients don't retry in lockstep.
+    * rate -- (Optional) The average number of requests per second allowed per host and user. Unlimited if None.
+    * burst -- (Optional) The number of requests that may be sent at once before rate applies.
+
+    """
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, jitter=0.5, rate=None, burst=1):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+        # Counters
+        self.retried = 0
+        self.retry_time = 0.0
+        self.throttled = 0
+        self.throttle_time = 0.0
+
+    def run(self, call, function):
+        """Calls function, which sends the request for the MethodCall call,
+        until it succeeds or may not be retried again."""
+        import httplib
+        
+        attempt = 0
+        while True:
+            self.throttle(call)
+            try:
+                return function()
+            except (PyposterousError, EnvironmentError, httplib.HTTPException), e:
+                # httplib raises HTTPExceptions such as BadStatusLine when
+                # a connection is dropped.
+                if attempt >= self.retries or not self.retryable(call, e):
+                    raise
+
+                # Don't back off past the call's deadline.
+                delay = self.delay(attempt)
+                if call.deadline is not None and time.time() + delay >= call.deadline:
+                    raise
+
+            attempt += 1
+            self.count(retried=1, retry_time=delay)
+            time.sleep(delay)
+
+    def retryable(self, call, error):
+        """Returns True if call may be sent again after failing with error."""
+        signature = call.signature
+        if not (signature.idempotent or signature.retry_safe):
+            return False
+        if isinstance(error, PyposterousTimeout):
+            return True
+        if isinstance(error, PyposterousError):
+            return error.http_status in RETRY_STATUSES
+        return True
+
+    def delay(self, attempt):
+        """Returns the number of seconds to wait before retry number attempt
+        (counting from 0)."""
+        import random
+
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay - delay * self.jitter * random.random()
+
+    def throttle(self, call):
+        """Waits until call may be sent under the rate limit."""
+        if self.rate is None:
+            return
+
+        key = (call.api.host, getattr(call.api.auth, 'username', None))
+        self.lock.acquire()
+        try:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        finally:
+            self.lock.release()
+
+        waited = bucket.take()
+        if waited:
+            self.count(throttled=1, throttle_time=waited)
+
+    def count(self, **counters):
+        self.lock.acquire()
+        try:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+        finally:
+            self.lock.release()
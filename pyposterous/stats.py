@@ -0,0 +1,144 @@
+import threading
+import time
+
+class CallTiming(object):
+    """Where the time went during one API call. All times are in seconds.
+
+    * method -- The name of the API method
+    * build -- Validating the arguments and building the request
+    * wait -- Sending the request and waiting for the response headers
+    * read -- Receiving the response body
+    * bytes -- The size of the response body
+    * parse -- Parsing the XML, excluding the time spent reading it and building objects
+    * construct -- Building objects from the parsed elements
+    * objects -- The number of objects built, nested ones included
+    * cached -- True if the result came from API.cache or a 304 response
+    * error -- The exception the call raised, if any
+
+    """
+    def __init__(self, method):
+        self.method = method
+        self.build = 0.0
+        self.wait = 0.0
+        self.read = 0.0
+        self.bytes = 0
+        self.parse = 0.0
+        self.construct = 0.0
+        self.objects = 0
+        self.cached = False
+        self.error = None
+        self.last = time.time()
+
+    def network(self):
+        return self.wait + self.read
+
+    def lap(self):
+        """Returns the number of seconds since the last lap and starts a new
+        one."""
+        now = time.time()
+        elapsed, self.last = now - self.last, now
+        return elapsed
+
+    def parsed(self, elapsed):
+        """Records elapsed seconds spent in the parser. Reading the response
+        and building objects happen inside the parser too; their time has
+        already been recorded, so it isn't counted again."""
+        self.parse = max(0.0, elapsed - self.read - self.construct)
+
+class MethodStats(object):
+    """The totals of the CallTimings for one API method."""
+    def __init__(self, method):
+        self.method = method
+        self.calls = 0
+        self.errors = 0
+        self.cached = 0
+        self.build = 0.0
+        self.network = 0.0
+        self.bytes = 0
+        self.parse = 0.0
+        self.construct = 0.0
+        self.objects = 0
+
+    def add(self, timing):
+        self.calls += 1
+        if timing.error is not None:
+            self.errors += 1
+        if timing.cached:
+            self.cached += 1
+        self.build += timing.build
+        self.network += timing.network()
+        self.bytes += timing.bytes
+        self.parse += timing.parse
+        self.construct += timing.construct
+        self.objects += timing.objects
+
+class Stats(object):
+    """Collects timings for the calls made by the API objects it is passed
+    to. API objects without one skip the bookkeeping entirely.
+
+    Keyword arguments:
+
+    * hooks -- (Optional) A list of functions called with the CallTiming of every finished call.
+
+    """
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.methods = {}
+        self.lock = threading.Lock()
+
+    def add(self, timing):
+        """Records a finished call."""
+        self.lock.acquire()
+        try:
+            stats = self.methods.get(timing.method)
+            if stats is None:
+                stats = self.methods[timing.method] = MethodStats(timing.method)
+            stats.add(timing)
+        finally:
+            self.lock.release()
+
+        for hook in self.hooks:
+            hook(timing)
+
+    def get(self, method):
+        """Returns the MethodStats for method. Its counters are all 0 if it
+        hasn't been called."""
+        return self.methods.get(method) or MethodStats(method)
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.methods = {}
+        finally:
+            self.lock.release()
+
+    def report(self):
+        """Returns the totals for every method as a table."""
+        lines = ["%-14s %6s %6s %6s %9s %9s %10s %9s %9s %8s" % ('method', 'calls', 'errors', 'cached', 'build', 'network', 'bytes', 'parse', 'construct', 'objects')]
+        for method in sorted(self.methods):
+            stats = self.methods[method]
+            lines.append("%-14s %6d %6d %6d %8.1fms %8.1fms %10d %8.1fms %8.1fms %8d" % (method, stats.calls, stats.errors, stats.cached,
+                stats.build * 1000, stats.network * 1000, stats.bytes, stats.parse * 1000, stats.construct * 1000, stats.objects))
+        return "\n".join(lines)
+
+class TimedResponse(object):
+    """Wraps a response so that reading it is recorded in a CallTiming."""
+    def __init__(self, response, timing):
+        self.response = response
+        self.timing = timing
+
+    def read(self, *args):
+        started = time.time()
+        data = self.response.read(*args)
+        self.timing.read += time.time() - started
+        self.timing.bytes += len(data)
+        return data
+
+    def getcode(self):
+        return self.response.getcode()
+
+    def info(self):
+        return self.response.info()
+
+    def close(self):
+        self.response.close()
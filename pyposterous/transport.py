@@ -0,0 +1,226 @@
+import threading
+import time
+
+from pyposterous.error import PyposterousTimeout
+
+class Transport(object):
+    """Sends the requests generated by an Auth instance to Posterous.
+
+    open() is given a urllib2.Request with all of its headers set and the
+    request body, if there is one: a string or a file-like object with a
+    known length (pyposterous.multipart.MultipartEncoder). It must return a
+    file-like response object that supports read(), getcode(), info(), and
+    close().
+
+    timeout is None or a (connect, read) tuple of seconds, either of which
+    may be None. Transports raise a pyposterous.error.PyposterousTimeout
+    when connecting times out; reading the response raises socket.timeout.
+
+    """
+    def open(self, request, data=None, timeout=None):
+        raise NotImplementedError
+
+    def close(self):
+        """Releases any resources held by the transport."""
+        pass
+
+class UrllibTransport(Transport):
+    """Opens a new connection for every request with urllib2. This is the
+    default transport. urllib2 only has one timeout per connection, so the
+    larger of the connect and read timeouts is used."""
+    def open(self, request, data=None, timeout=None):
+        import socket
+        import urllib2
+
+        args = ()
+        if timeout:
+            limits = [limit for limit in timeout if limit is not None]
+            if limits:
+                args = (max(limits),)
+
+        try:
+            return urllib2.urlopen(request, data, *args)
+        except (urllib2.HTTPError,), e:
+            # HTTPError instances double as response objects. The parser
+            # uses the status code to build a meaningful error.
+            return e
+        except (urllib2.URLError,), e:
+            if isinstance(e.reason, socket.timeout):
+                raise PyposterousTimeout("Timed out connecting to %s" % request.get_host())
+            raise
+        except (socket.timeout,), e:
+            raise PyposterousTimeout("Timed out waiting for %s to respond" % request.get_host())
+
+class PooledTransport(Transport):
+    """Reuses keep-alive connections to each host.
+
+    Keyword arguments:
+
+    * max_connections -- (Optional) The maximum number of open connections per host. Callers block when all of them are busy.
+    * idle_timeout -- (Optional) Idle connections older than this many seconds are discarded instead of reused.
+    * retries -- (Optional) How many times a request is retried on a fresh connection when a reused connection turns out to be stale.
+
+    A request is only sent again if sending it failed, or if it is a GET 
+    request and the response couldn't be read. Once a POST request has been
+    sent the server may have acted on it, so failures reading its response
+    are raised; the Scheduler decides whether the method may be retried.
+
+    """
+    def __init__(self, max_connections=4, idle_timeout=30, retries=1):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+
+        self.__lock = threading.Condition()
+        self.__idle = {}
+        self.__busy = {}
+
+    def open(self, request, data=None, timeout=None):
+        import socket
+
+        key = (request.get_type(), request.get_host())
+        headers = dict(request.header_items())
+        method = 'GET'
+        if data is not None:
+            method = 'POST'
+
+        attempt = 0
+        while True:
+            conn, reused = self.__acquire(key)
+            sent = False
+            try:
+                self.__set_timeout(conn, timeout)
+                conn.request(method, request.get_selector(), data, headers)
+                sent = True
+                response = conn.getresponse()
+            except socket.timeout, e:
+                self.__discard(key, conn)
+                raise PyposterousTimeout("Timed out waiting for %s to respond" % request.get_host())
+            except Exception, e:
+                self.__discard(key, conn)
+                # Servers silently drop idle keep-alive connections, so a
+                # reused connection failing is expected now and then. 
+                # Writes the server may have received aren't sent twice.
+                if reused and attempt < self.retries and (not sent or method == 'GET'):
+                    attempt += 1
+                    # Streamed bodies have to be sent from the start again.
+                    if hasattr(data, 'reset'):
+                        data.reset()
+                    continue
+                raise
+            return PooledResponse(self, key, conn, response)
+
+    def close(self):
+        self.__lock.acquire()
+        try:
+            for connections in self.__idle.values():
+                for conn, last_used in connections:
+                    conn.close()
+            self.__idle = {}
+        finally:
+            self.__lock.release()
+
+    def release(self, key, conn, reusable):
+        """Returns conn to the pool. Called by PooledResponse.close()."""
+        self.__lock.acquire()
+        try:
+            self.__busy[key] -= 1
+            if reusable:
+                self.__idle.setdefault(key, []).append((conn, time.time()))
+            else:
+                conn.close()
+            self.__lock.notify()
+        finally:
+            self.__lock.release()
+
+    def __set_timeout(self, conn, timeout):
+        """Connects conn if necessary and applies timeout to it."""
+        import socket
+
+        if timeout is None:
+            if conn.sock is not None:
+                conn.sock.settimeout(socket.getdefaulttimeout())
+            return
+
+        connect, read = timeout
+        if conn.sock is None:
+            conn.timeout = connect
+            if connect is None:
+                conn.timeout = socket.getdefaulttimeout()
+            try:
+                conn.connect()
+            except socket.timeout:
+                raise PyposterousTimeout("Timed out connecting to %s" % conn.host)
+        conn.sock.settimeout(read)
+
+    def __discard(self, key, conn):
+        conn.close()
+        self.release(key, conn, False)
+
+    def __acquire(self, key):
+        """Returns a (connection, reused) tuple for key, blocking until a
+        connection is available."""
+        self.__lock.acquire()
+        try:
+            idle = self.__idle.setdefault(key, [])
+            while True:
+                now = time.time()
+                # Most recently used connections are the least likely to be
+                # stale, so use them first and throw away the expired ones.
+                while idle:
+                    conn, last_used = idle.pop()
+                    if now - last_used < self.idle_timeout:
+                        self.__busy[key] = self.__busy.get(key, 0) + 1
+                        return conn, True
+                    conn.close()
+
+                if self.__busy.get(key, 0) < self.max_connections:
+                    self.__busy[key] = self.__busy.get(key, 0) + 1
+                    return self.__connect(key), False
+
+                self.__lock.wait()
+        finally:
+            self.__lock.release()
+
+    def __connect(self, key):
+        import httplib
+
+        scheme, host = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host)
+        return httplib.HTTPConnection(host)
+
+class PooledResponse(object):
+    """Wraps an httplib response so that its connection is returned to the
+    pool once the response is closed."""
+    def __init__(self, transport, key, conn, response):
+        self.transport = transport
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.released = False
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def getcode(self):
+        return self.response.status
+
+    def info(self):
+        return self.response.msg
+
+    def close(self):
+        if self.released:
+            return
+        self.released = True
+
+        # Bodiless responses (304 Not Modified, for instance) are only
+        # marked as finished once they are read.
+        if not self.response.isclosed() and self.response.length == 0:
+            self.response.read()
+
+        # The connection can only be reused if the whole response body was
+        # consumed and the server didn't ask us to hang up.
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        self.transport.release(self.key, self.conn, reusable)
@@ -1,4 +1,5 @@
 import sys
+from datetime import datetime, timedelta
 
 def docstring_trim(docstring):
     """A docstring normalization function taken straight from PEP 257 at
@@ -42,7 +43,6 @@ def parse_date(time_string, time_format="%a, %d %b %Y %H:%M:%S"):
     time_format -- a string representing the format of time_string. See strptime documentation for an example. Leave out %z.    
     """
     from re import findall
-    from datetime import datetime
     
     utc_offset_str = findall(r'\+[0-9]{4}|-[0-9]{4}', time_string)[0]
     time_string = time_string.replace(utc_offset_str, "", 1)
@@ -52,9 +52,71 @@ def parse_date(time_string, time_format="%a, %d %b %Y %H:%M:%S"):
         
     return convert_to_utc(datetime.strptime(time_string, time_format), utc_offset_str)
     
-def convert_to_utc(date, offset):
-    from datetime import timedelta
+MONTHS = {'Jan':1, 'Feb':2, 'Mar':3, 'Apr':4, 'May':5, 'Jun':6, 'Jul':7, 'Aug':8, 'Sep':9, 'Oct':10, 'Nov':11, 'Dec':12}
+
+# Parsed dates by string. Posts on a page and their comments often share
+# timestamps, and the same posts come back again and again.
+DATE_CACHE = {}
+DATE_CACHE_SIZE = 4096
+
+# utcoffset string -> the timedelta that converts a date with that offset
+# to UTC
+UTC_OFFSETS = {}
+
+def parse_post_date(time_string):
+    """Converts a date in the format Posterous uses for posts and comments
+    (e.g. 'Sun, 03 Jan 2010 12:00:00 -0800') to a UTC datetime object. 
+    Anything else is handed to parse_date.
+    
+    """
+    date = DATE_CACHE.get(time_string)
+    if date is None:
+        try:
+            # ['Sun,', '03', 'Jan', '2010', '12:00:00', '-0800']
+            weekday, day, month, year, clock, offset = time_string.split()
+            date = build_date(year, month, day, clock, offset)
+        except (ValueError, KeyError):
+            date = parse_date(time_string)
+        remember_date(time_string, date)
+    return date
+
+def parse_timestamp(time_string):
+    """Converts a date in the format of v2 API timestamps (e.g.
+    'Wed Jan 06 20:49:51 +0000 2010') to a UTC datetime object. Anything else
+    is handed to parse_date.
     
+    """
+    date = DATE_CACHE.get(time_string)
+    if date is None:
+        try:
+            # ['Wed', 'Jan', '06', '20:49:51', '+0000', '2010']
+            weekday, month, day, clock, offset, year = time_string.split()
+            date = build_date(year, month, day, clock, offset)
+        except (ValueError, KeyError):
+            date = parse_date(time_string, '%a %b %d %H:%M:%S %Y')
+        remember_date(time_string, date)
+    return date
+
+def build_date(year, month, day, clock, offset):
+    """Builds a UTC datetime object from the pieces of a date string. Raises
+    a ValueError or KeyError if they aren't valid."""
+    hour, minute, second = clock.split(':')
+    date = datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second))
+    
+    # There are only a few dozen utcoffsets, so their timedeltas are kept.
+    delta = UTC_OFFSETS.get(offset)
+    if delta is None:
+        if len(offset) != 5 or offset[0] not in '+-':
+            raise ValueError("%s is not a utcoffset" % offset)
+        delta = UTC_OFFSETS[offset] = convert_to_utc(datetime(2000, 1, 1), offset) - datetime(2000, 1, 1)
+    return date + delta
+
+def remember_date(time_string, date):
+    if len(DATE_CACHE) >= DATE_CACHE_SIZE:
+        DATE_CACHE.clear()
+    DATE_CACHE[time_string] = date
+
+def convert_to_utc(date, offset):
     sign = offset[0]
     hour = int(offset[1:3])
     minute = int(offset[3:5])
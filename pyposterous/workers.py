@@ -0,0 +1,157 @@
+import sys
+import threading
+
+from pyposterous.error import PyposterousTimeout
+
+class Future(object):
+    """The eventual result of a call submitted to a WorkerPool."""
+    def __init__(self):
+        self.__event = threading.Event()
+        self.__lock = threading.Lock()
+        self.__result = None
+        self.__exc_info = None
+        self.__callbacks = []
+
+    def done(self):
+        return self.__event.isSet()
+
+    def result(self, timeout=None):
+        """Blocks until the call finishes and returns its result. If the call
+        raised an exception, it is raised again here."""
+        self.__wait(timeout)
+        if self.__exc_info:
+            raise self.__exc_info[0], self.__exc_info[1], self.__exc_info[2]
+        return self.__result
+
+    def exception(self, timeout=None):
+        """Blocks until the call finishes and returns the exception it raised
+        or None."""
+        self.__wait(timeout)
+        if self.__exc_info:
+            return self.__exc_info[1]
+        return None
+
+    def add_done_callback(self, callback):
+        """Calls callback with this future once it is done. If it is already
+        done, callback is called immediately."""
+        self.__lock.acquire()
+        try:
+            if not self.done():
+                self.__callbacks.append(callback)
+                return
+        finally:
+            self.__lock.release()
+        callback(self)
+
+    def set_result(self, result):
+        self.__result = result
+        self.__finish()
+
+    def set_exc_info(self, exc_info):
+        self.__exc_info = exc_info
+        self.__finish()
+
+    def __finish(self):
+        self.__lock.acquire()
+        try:
+            self.__event.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        finally:
+            self.__lock.release()
+
+        for callback in callbacks:
+            callback(self)
+
+    def __wait(self, timeout):
+        self.__event.wait(timeout)
+        if not self.done():
+            raise PyposterousTimeout("Timed out waiting for the result.")
+
+class WorkerPool(object):
+    """A fixed number of daemon threads that run submitted calls.
+
+    Keyword arguments:
+
+    * workers -- (Optional) The number of threads. They are started on first use.
+
+    """
+    def __init__(self, workers=8):
+        import Queue
+
+        self.workers = workers
+        self.__queue = Queue.Queue()
+        self.__threads = []
+        self.__lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """Schedules function(*args, **kwargs) and returns a Future."""
+        future = Future()
+        self.__start()
+        self.__queue.put((future, function, args, kwargs))
+        return future
+
+    def map(self, function, iterable):
+        """Returns a list of Futures, one for each item in iterable."""
+        return [self.submit(function, item) for item in iterable]
+
+    def shutdown(self, wait=True):
+        """Stops the worker threads once the queued calls have run."""
+        self.__lock.acquire()
+        try:
+            threads, self.__threads = self.__threads, []
+        finally:
+            self.__lock.release()
+
+        for thread in threads:
+            self.__queue.put(None)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def __start(self):
+        self.__lock.acquire()
+        try:
+            while len(self.__threads) < self.workers:
+                thread = threading.Thread(target=self.__work)
+                thread.setDaemon(True)
+                thread.start()
+                self.__threads.append(thread)
+        finally:
+            self.__lock.release()
+
+    def __work(self):
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                return
+
+            future, function, args, kwargs = job
+            try:
+                result = function(*args, **kwargs)
+            except:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+
+# BoundedSemaphores limiting the number of concurrent requests per host, by
+# (host, limit)
+HOST_LIMITS = {}
+HOST_LIMITS_LOCK = threading.Lock()
+
+def host_limit(host, limit):
+    """Returns a semaphore shared by everything that wants to send at most
+    limit concurrent requests to host."""
+    HOST_LIMITS_LOCK.acquire()
+    try:
+        semaphore = HOST_LIMITS.get((host, limit))
+        if semaphore is None:
+            semaphore = HOST_LIMITS[(host, limit)] = threading.BoundedSemaphore(limit)
+        return semaphore
+    finally:
+        HOST_LIMITS_LOCK.release()
+
+def wait_all(futures, timeout=None):
+    """Returns the results of futures in order. The first exception raised by
+    any of them is raised again."""
+    return [future.result(timeout) for future in futures]
@@ -1,10 +1,24 @@
+import os
 import types
 import time
+import threading
 import unittest
 
-from pyposterous import API, Cursor
-from pyposterous.error import PyposterousError
+from pyposterous import API, AsyncAPI, ProcessAPI, Cursor
+from pyposterous.error import PyposterousError, PyposterousTimeout
 from pyposterous.idl import METHODS
+from pyposterous.parser import Parser, LazyParser
+from pyposterous.transport import PooledTransport, UrllibTransport
+from pyposterous.multipart import MultipartEncoder
+from pyposterous.cache import ResponseCache, ValidatorCache
+from pyposterous.fanout import fetch_sites
+from pyposterous.scheduler import Scheduler
+from pyposterous.stats import Stats
+from pyposterous.methods import Signature, MethodCall
+from pyposterous.models import Site, Post
+from pyposterous.mirror import Mirror
+from pyposterous import codec
+from pyposterous.crawl import SiteCrawl, crawl_site
 
 try:
     # Create a file called test_settings.py in the same dir as this file to 
@@ -24,14 +38,160 @@ except:
     user_key = "test"
     user_secret = "test"
 
+POSTS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<rsp stat="ok">
+  <post>
+    <url>http://post.ly/abc1</url>
+    <link>http://pyposttest.posterous.com/hello</link>
+    <title>Hello</title>
+    <id>1</id>
+    <body>
+      First post.
+    </body>
+    <date>Sun, 03 Jan 2010 12:00:00 -0800</date>
+    <views>5</views>
+    <private>false</private>
+    <author>pyposttest</author>
+    <commentsenabled>true</commentsenabled>
+    <commentscount>1</commentscount>
+    <comment>
+      <id>10</id>
+      <body>Nice.</body>
+      <date>Mon, 04 Jan 2010 08:30:00 +0000</date>
+      <author>Jane Doe</author>
+    </comment>
+  </post>
+  <post>
+    <url>http://post.ly/abc2</url>
+    <link>http://pyposttest.posterous.com/world</link>
+    <title>World</title>
+    <id>2</id>
+    <body>Second post.</body>
+    <date>Sat, 02 Jan 2010 09:15:00 +0000</date>
+    <views>3</views>
+    <private>false</private>
+    <author>pyposttest</author>
+    <commentsenabled>false</commentsenabled>
+    <commentscount>0</commentscount>
+  </post>
+</rsp>
+"""
+
+class FakeResponse(object):
+    """A canned response for feeding Parser directly."""
+    def __init__(self, xml, code=200):
+        from StringIO import StringIO
+        self.data = StringIO(xml)
+        self.code = code
+    
+    def read(self, amt=None):
+        return self.data.read(amt)
+    
+    def getcode(self):
+        return self.code
+    
+    def close(self):
+        pass
+
+class StubServer(object):
+    """A local HTTP server that answers every request with canned XML, so
+    the request path can be tested without hitting Posterous."""
+    def __init__(self, responses=None):
+        import threading
+        import BaseHTTPServer
+        import SocketServer
+        
+        stub = self
+        self.responses = responses or {}
+        self.requests = []
+        self.connections = 0
+        self.etag = None
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def setup(self):
+                stub.connections += 1
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+            
+            def do_GET(self):
+                self.respond('')
+            
+            def do_POST(self):
+                self.respond(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            
+            def respond(self, body):
+                import time
+                
+                stub.lock.acquire()
+                stub.active += 1
+                stub.max_active = max(stub.max_active, stub.active)
+                stub.lock.release()
+                
+                time.sleep(stub.delay)
+                
+                stub.lock.acquire()
+                stub.active -= 1
+                stub.lock.release()
+                
+                path = self.path.split('?')[0]
+                stub.requests.append((self.command, self.path, dict(self.headers), body))
+                response = stub.responses.get(path, (200, POSTS_XML))
+                if callable(response):
+                    response = response(self.path, body)
+                status, xml = response
+                if stub.etag and self.headers.get('If-None-Match') == stub.etag:
+                    status, xml = 304, ''
+                self.send_response(status)
+                if stub.etag:
+                    self.send_header('ETag', stub.etag)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(xml)))
+                self.end_headers()
+                self.wfile.write(xml)
+            
+            def log_message(self, *args):
+                pass
+        
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            
+            def handle_error(self, request, client_address):
+                # Clients that time out hang up on purpose.
+                pass
+        
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.host = '127.0.0.1:%s' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestAPI(API):
+    """Includes the methods in the test section of the IDL."""
+    method_subsections = API.method_subsections + ('test',)
+
 class PyposterousAPITests(unittest.TestCase):    
     def setUp(self):
-        self.api = API(username=p_username, password=p_password)
+        self.api = TestAPI(username=p_username, password=p_password)
     
     def test_method_creation(self):                
         for app_type in METHODS:
             for method in METHODS.get(app_type):
                 self.assertTrue(hasattr(getattr(self.api, method), '__call__'))
+        
+        # Production objects don't have the test methods.
+        for method in METHODS['test']:
+            self.assertFalse(hasattr(API(), method))
+        self.assertEqual(API.read_posts.__doc__, self.api.read_posts.__doc__)
+        self.assertFalse(API.read_posts is AsyncAPI.read_posts)
                 
     def test_method_required_params(self):
         # Has a required param
@@ -99,11 +259,11 @@ class PyposterousAPITests(unittest.TestCase):
             fail("Expected a TypeError")
             
     def test_method_auth_check(self):
-        api = API()
+        api = TestAPI()
         self.assertRaises(PyposterousError, api.test_auth_required)
     
     def test_method_twitter_auth_check(self):
-        api = API()
+        api = TestAPI()
         self.assertRaises(PyposterousError, api.test_twitter_auth_required)
     
     def test_method_valid_calls(self):
@@ -267,6 +427,1194 @@ class PyposterousAPITests(unittest.TestCase):
         # You can't pass page or num_posts as parameters
         self.assertRaises(PyposterousError, Cursor, {'method':self.api.read_posts, 'parameters':{'hostname':name_of_first_blog,'page':4},})
         self.assertRaises(PyposterousError, Cursor, {'method':self.api.read_posts, 'parameters':{'hostname':name_of_first_blog,'num_posts':4},})
+
+class ParserTests(unittest.TestCase):
+    def test_iterparse_yields_posts(self):
+        parser = Parser(None, FakeResponse(POSTS_XML), ['force_list'], stream=True)
+        posts = parser.iterparse()
+        
+        post = posts.next()
+        self.assertEqual(post.title, 'Hello')
+        self.assertEqual(post.body, 'First post.')
+        self.assertEqual(post.comments[0].body, 'Nice.')
+        self.assertEqual(post.date.hour, 20)
+        self.assertEqual(posts.next().id, 2)
+        self.assertRaises(StopIteration, posts.next)
+    
+    def test_iterparse_attaches_top_level_children(self):
+        # get_post returns a post's comments next to it, not inside it.
+        xml = POSTS_XML.replace('<comment>', '</post><comment>').replace('</comment>\n  </post>', '</comment>')
+        for stream in (True, False):
+            post = Parser(None, FakeResponse(xml), [], stream=stream).parse()[0]
+            self.assertEqual(post.comments[0].author, 'Jane Doe')
+    
+    def test_iterparse_matches_parse(self):
+        streamed = Parser(None, FakeResponse(POSTS_XML), ['force_list'], stream=True).parse()
+        parsed = Parser(None, FakeResponse(POSTS_XML), ['force_list']).parse()
+        self.assertEqual([post.as_dict().keys() for post in streamed], [post.as_dict().keys() for post in parsed])
+    
+    def test_iterparse_errors(self):
+        parser = Parser(None, FakeResponse('<rsp stat="fail"><err code="3001" msg="Invalid Post.ly shortcode" /></rsp>'), [], stream=True)
+        self.assertRaises(PyposterousError, parser.parse)
+        
+        parser = Parser(None, FakeResponse(POSTS_XML[:400]), [], stream=True)
+        self.assertRaises(PyposterousError, parser.parse)
+    
+    def test_benchmark_fixtures(self):
+        def parse(name, returns=['force_list']):
+            xml = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures', name)).read()
+            return Parser(None, FakeResponse(xml), returns, stream=True).parse()
+        
+        self.assertEqual(len(parse('readposts_50.xml')), 50)
+        self.assertEqual(len(parse('getsites.xml')), 5)
+        self.assertEqual(parse('gettags.xml')[0].tag_string, 'album')
+        
+        post = parse('getpost.xml', [])
+        self.assertEqual((len(post.comments), len(post.media)), (3, 2))
+        
+        image = parse('upload.xml', [])
+        self.assertEqual(image.user.id, 14920174)
+        self.assertEqual(image.timestamp.year, 2010)
+
+class LazyParserTests(unittest.TestCase):
+    def test_lazy_matches_parse(self):
+        xml = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures', 'readposts_20.xml')).read()
+        for stream in (True, False):
+            lazy = LazyParser(None, FakeResponse(xml), ['force_list'], stream).parse()
+            eager = Parser(None, FakeResponse(xml), ['force_list'], stream).parse()
+            self.assertEqual([expand(post) for post in lazy], [expand(post) for post in eager])
+    
+    def test_values_are_decoded_on_access(self):
+        post = LazyParser(None, FakeResponse(POSTS_XML), ['force_list'], True).parse()[0]
+        self.assertEqual(object.__getattribute__(post, 'title'), 'Hello')
+        self.assertRaises(AttributeError, object.__getattribute__, post, 'date')
+        self.assertRaises(AttributeError, object.__getattribute__, post, 'comments')
+        
+        self.assertEqual(post.date.hour, 20)
+        self.assertEqual(object.__getattribute__(post, 'date').hour, 20)
+        self.assertEqual(post.comments[0].body, 'Nice.')
+        self.assertRaises(AttributeError, getattr, post, 'comment')
+        
+        # Values set or deleted before they're decoded win.
+        post.views = 7
+        del post.private
+        self.assertEqual((post.views, post.as_dict()['views']), (7, 7))
+        self.assertRaises(AttributeError, getattr, post, 'private')
+    
+    def test_top_level_children(self):
+        xml = POSTS_XML.replace('<comment>', '</post><comment>').replace('</comment>\n  </post>', '</comment>')
+        post = LazyParser(None, FakeResponse(xml), [], True).parse()[0]
+        self.assertEqual(post.comments[0].author, 'Jane Doe')
+        self.assertRaises(AttributeError, getattr, post, 'comment')
+    
+    def test_lazy_api(self):
+        server = StubServer()
+        try:
+            api = API(host=server.host, lazy=True, stats=Stats())
+            post = api.read_posts(hostname='pyposttest')[0]
+            self.assertEqual(post.comments[0].body, 'Nice.')
+            self.assertEqual(api.stats.get('read_posts').objects, 2)
+        finally:
+            server.stop()
+
+class FieldsTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.api = API(host=self.server.host)
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def test_read_posts_fields(self):
+        for lazy in (False, True):
+            self.api.lazy = lazy
+            post = self.api.read_posts(hostname='pyposttest', fields=['id', 'title', 'date'])[0]
+            self.assertEqual(sorted(post.as_dict().keys()), ['date', 'id', 'title'])
+            self.assertEqual(post.date.hour, 20)
+            self.assertRaises(AttributeError, getattr, post, 'comments')
+            
+            # Nested objects are built in full.
+            post = self.api.read_posts(hostname='pyposttest', fields=('id', 'comments'))[0]
+            self.assertEqual(sorted(post.as_dict().keys()), ['comments', 'id'])
+            self.assertEqual(post.comments[0].author, 'Jane Doe')
+        
+        # fields isn't sent to Posterous.
+        self.assertFalse([request for request in self.server.requests if 'fields' in request[1] + request[3]])
+    
+    def test_invalid_fields(self):
+        self.assertRaises(TypeError, self.api.read_posts, hostname='pyposttest', fields=['id', 'sparkle'])
+        self.assertRaises(TypeError, self.api.read_posts, hostname='pyposttest', fields='title')
+        self.assertRaises(TypeError, API('username', 'password', host=self.server.host).new_comment, 1, 'Nice.', fields=['id'])
+        self.assertEqual(self.server.requests, [])
+    
+    def test_top_level_children(self):
+        xml = POSTS_XML.replace('<comment>', '</post><comment>').replace('</comment>\n  </post>', '</comment>')
+        posts = Parser(None, FakeResponse(xml), [], True, {Post:frozenset(['id'])}).parse()
+        self.assertEqual(posts[0].as_dict().keys(), ['id'])
+    
+    def test_cursor_and_cache(self):
+        self.api.cache = ResponseCache()
+        posts = list(Cursor(method=self.api.read_posts, num_posts=2, limit=2, parameters={'hostname':'pyposttest', 'fields':['title']}))
+        self.assertEqual([post.as_dict() for post in posts], [{'title':'Hello'}, {'title':'World'}])
+        
+        # Projections are cached separately.
+        self.assertEqual(self.api.read_posts(hostname='pyposttest', page=1, num_posts=2, fields=['title'])[0].as_dict(), {'title':'Hello'})
+        self.assertEqual(self.api.read_posts(hostname='pyposttest', page=1, num_posts=2)[0].id, 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+class MirrorTests(unittest.TestCase):
+    def setUp(self):
+        import cgi
+        
+        # Newest first, like Posterous
+        self.ids = range(7, 0, -1)
+        
+        def read_posts(path, body):
+            query = cgi.parse_qs(body)
+            page, num_posts = int(query['page'][0]), int(query['num_posts'][0])
+            ids = self.ids[(page - 1) * num_posts:page * num_posts]
+            post = POSTS_XML.split('<post>')[1].split('</post>')[0]
+            posts = ['<post>%s</post>' % post.replace('<id>1</id>', '<id>%s</id>' % id).replace('03 Jan', '%02d Jan' % id) for id in ids]
+            return 200, '<rsp stat="ok">%s</rsp>' % ''.join(posts)
+        
+        tags = '<rsp stat="ok"><tag><id>1</id><tag_string>python</tag_string><count>2</count></tag></rsp>'
+        self.server = StubServer({'/api/readposts':read_posts, '/api/gettags':(200, tags)})
+        self.api = API(host=self.server.host)
+        self.mirror = Mirror(self.api, num_posts=2)
+    
+    def tearDown(self):
+        self.mirror.close()
+        self.server.stop()
+    
+    def test_incremental_sync(self):
+        self.assertEqual(self.mirror.synced('pyposttest'), None)
+        self.assertEqual([post.id for post in self.mirror.sync('pyposttest')], range(7, 0, -1))
+        # 4 pages of posts and the tags
+        self.assertEqual(self.mirror.requests, 5)
+        self.assertNotEqual(self.mirror.synced('pyposttest'), None)
+        
+        posts = self.mirror.posts('pyposttest')
+        self.assertEqual([post.id for post in posts], range(7, 0, -1))
+        self.assertEqual((posts[0].date.day, posts[0].private, posts[0].comments[0].author), (7, False, 'Jane Doe'))
+        self.assertEqual(posts[0].api(), self.api)
+        self.assertEqual(self.mirror.post('pyposttest', 3).title, 'Hello')
+        self.assertEqual([str(tag) for tag in self.mirror.tags('pyposttest')], ['python'])
+        
+        # Only the pages up to the first known post are read.
+        self.ids = [9, 8] + self.ids
+        self.assertEqual([post.id for post in self.mirror.sync('pyposttest')], [9, 8])
+        self.assertEqual(self.mirror.requests, 3)
+        self.assertEqual(len(self.mirror.posts('pyposttest')), 9)
+        
+        self.mirror.sync('pyposttest', full=True)
+        self.assertEqual(self.mirror.requests, 6)
+        
+        # Other sites are synced separately.
+        self.assertEqual(self.mirror.posts('thomasw'), [])
+    
+    def test_unfinished_sync(self):
+        self.mirror.sync('pyposttest')
+        self.ids = [8] + self.ids
+        self.mirror.db.execute('UPDATE sites SET complete = 0')
+        self.assertEqual([post.id for post in self.mirror.sync('pyposttest')], range(8, 0, -1))
+    
+    def test_file(self):
+        import shutil
+        import tempfile
+        
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'mirror.db')
+            Mirror(self.api, path, num_posts=2).sync('pyposttest')
+            mirror = Mirror(self.api, path, num_posts=2)
+            self.assertEqual(len(mirror.posts('pyposttest')), 7)
+            mirror.sync('pyposttest')
+            self.assertEqual(mirror.requests, 2)
+            mirror.close()
+        finally:
+            shutil.rmtree(directory)
+    
+    def test_round_trip(self):
+        xml = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures', 'readposts_50.xml')).read()
+        posts = Parser(None, FakeResponse(xml), ['force_list']).parse()
+        for post in posts:
+            self.mirror.store_post('hostname:pyposttest', post)
+        
+        stored = self.mirror.posts('pyposttest')
+        self.assertEqual(sorted(expand(stored)), sorted(expand(posts)))
+    
+    def test_query(self):
+        from datetime import datetime
+        
+        xml = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures', 'readposts_50.xml')).read()
+        posts = Parser(None, FakeResponse(xml), ['force_list']).parse()
+        for post in posts:
+            tags = [tag for tag, divisor in (('even', 2), ('three', 3)) if post.id % divisor == 0]
+            if tags:
+                # Like the parser: one tag is a string, several a list.
+                post.tag = len(tags) == 1 and tags[0] or tags
+            self.mirror.store_post('hostname:pyposttest', post)
+        self.mirror.store_post('hostname:thomasw', posts[0])
+        
+        query = self.mirror.query().site('pyposttest')
+        self.assertEqual(query.count(), 50)
+        self.assertEqual(self.mirror.query().count(), 51)
+        
+        by_views = sorted(posts, key=lambda post: (post.views, post.id), reverse=True)
+        self.assertEqual([post.id for post in query.top(5, 'views')], [post.id for post in by_views[:5]])
+        self.assertEqual(query.order_by('views', False).limit(3).ids(), [post.id for post in by_views[-3:]][::-1])
+        
+        start, end = datetime(2010, 3, 1), datetime(2010, 7, 1)
+        newest_first = sorted(posts, key=lambda post: (post.date, post.id), reverse=True)
+        self.assertEqual(query.range('date', start, end).ids(), [post.id for post in newest_first if start <= post.date < end])
+        self.assertEqual(query.range('commentscount', 2).count(), len([post for post in posts if post.commentscount >= 2]))
+        
+        self.assertEqual(sorted(query.tagged('even').tagged('three').ids()), [post.id for post in posts if post.id % 6 == 0])
+        self.assertEqual(query.tagged('even').tagged('three').all()[0].tag, ['even', 'three'])
+        self.assertEqual(query.tagged('three').where('posts.id % 2 = 1').all()[0].tag, 'three')
+        self.assertEqual(query.author('nobody').all(), [])
+        self.assertEqual(self.mirror.query().tagged('three').count(), len([post for post in posts if post.id % 3 == 0]) + (posts[0].id % 3 == 0))
+        
+        # Posts are built a batch at a time.
+        query.batch = 7
+        self.assertEqual(sorted(expand(list(query))), sorted(expand(posts)))
+        
+        self.assertTrue('INDEX' in query.range('views', 100).explain())
+        self.assertTrue('post_tags_tag' in self.mirror.query().tagged('even').explain())
+        self.assertRaises(PyposterousError, query.range, 'title; DROP TABLE posts', 1)
+    
+    def test_unknown_schema(self):
+        import shutil
+        import tempfile
+        
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'mirror.db')
+            Mirror(self.api, path, num_posts=2).sync('pyposttest')
+            self.assertTrue(Mirror(self.api, path).synced('pyposttest'))
+            
+            db = Mirror(self.api, path).db
+            db.execute('PRAGMA user_version = 99')
+            db.commit()
+            db.close()
+            self.assertRaises(PyposterousError, Mirror, self.api, path)
+        finally:
+            shutil.rmtree(directory)
+
+class CrawlTests(unittest.TestCase):
+    def setUp(self):
+        import cgi
+        
+        # Newest first, like Posterous
+        self.ids = range(7, 0, -1)
+        self.published = None
+        
+        def read_posts(path, body):
+            query = cgi.parse_qs(body)
+            page, num_posts = int(query['page'][0]), int(query['num_posts'][0])
+            ids = self.ids[(page - 1) * num_posts:page * num_posts]
+            if self.published:
+                # A post is published while the crawl is running.
+                self.ids.insert(0, self.published)
+                self.published = None
+            post = POSTS_XML.split('<post>')[1].split('</post>')[0]
+            posts = ['<post>%s</post>' % post.replace('<id>1</id>', '<id>%s</id>' % id) for id in ids]
+            return 200, '<rsp stat="ok">%s</rsp>' % ''.join(posts)
+        
+        self.server = StubServer({'/api/readposts':read_posts})
+        self.api = API(host=self.server.host)
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def pages_requested(self):
+        import cgi
+        return sorted([int(cgi.parse_qs(body)['page'][0]) for command, path, headers, body in self.server.requests])
+    
+    def test_crawl(self):
+        crawl = SiteCrawl(self.api, 'pyposttest', num_posts=2, workers=3)
+        self.assertEqual([post.id for post in crawl], range(7, 0, -1))
+        self.assertEqual((crawl.requests, crawl.duplicates), (4, 0))
+        # Pages past the short one are only requested within the window.
+        self.assertEqual(self.pages_requested()[:4], [1, 2, 3, 4])
+        self.assertTrue(max(self.pages_requested()) <= 6)
+    
+    def test_known_page_count(self):
+        site = Site(self.api)
+        site.hostname = 'pyposttest'
+        site.num_posts = 5
+        
+        # 3 pages are expected, but the site has 4 by now.
+        self.assertEqual([post.id for post in crawl_site(self.api, site, num_posts=2, workers=8)], range(7, 0, -1))
+        self.assertTrue(max(self.pages_requested()) <= 3 + 8)
+        
+        del self.server.requests[:]
+        self.assertEqual(len(crawl_site(self.api, 'pyposttest', num_posts=2, pages=4, workers=8)), 7)
+        self.assertEqual(self.pages_requested(), [1, 2, 3, 4])
+        
+        # A post published during the crawl fills the last page, so the one
+        # after it is read too.
+        del self.server.requests[:]
+        self.published = 8
+        self.assertEqual([post.id for post in crawl_site(self.api, 'pyposttest', num_posts=2, pages=4, workers=1)], range(7, 0, -1))
+        self.assertEqual(self.pages_requested(), [1, 2, 3, 4, 5])
+    
+    def test_posts_shifting(self):
+        self.published = 8
+        crawl = SiteCrawl(self.api, 'pyposttest', num_posts=2, workers=1)
+        self.assertEqual([post.id for post in crawl], range(7, 0, -1))
+        self.assertEqual(crawl.duplicates, 1)
+    
+    def test_errors(self):
+        self.assertRaises(PyposterousError, SiteCrawl, self.api, 'pyposttest', parameters={'page':2})
+        self.assertRaises(PyposterousError, SiteCrawl, self.api, Site(self.api))
+        
+        self.server.delay = 0.5
+        self.assertRaises(PyposterousTimeout, crawl_site, self.api, 'pyposttest', num_posts=2, timeout=0.2)
+
+class CodecTests(unittest.TestCase):
+    def fixture(self, name, returns=['force_list']):
+        xml = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures', name)).read()
+        return Parser(None, FakeResponse(xml), returns, stream=True).parse()
+    
+    def test_round_trip(self):
+        import cPickle
+        
+        for name in ('readposts_50.xml', 'getsites.xml', 'gettags.xml', 'getpost.xml', 'upload.xml'):
+            value = self.fixture(name, [])
+            data = codec.dumps(value)
+            self.assertEqual(typed(codec.loads(data)), typed(value))
+            self.assertEqual(typed(codec.loads(buffer(data))), typed(value))
+            self.assertTrue(len(data) < len(cPickle.dumps(value, 2)))
+        
+        api = API()
+        post = self.fixture('getpost.xml', [])
+        post.sparkle = u'ja \xe4'
+        post.views = -2 ** 70
+        copy = codec.loads(codec.dumps(post), api)
+        self.assertEqual((copy.api(), copy.comments[0].api()), (api, api))
+        self.assertEqual((copy.sparkle, copy.extra, copy.views), (u'ja \xe4', {'sparkle':u'ja \xe4'}, -2 ** 70))
+        self.assertFalse(hasattr(copy, 'tag'))
+        
+        from datetime import datetime
+        
+        value = [None, True, 0.5, (1, 'two'), {'three':datetime(2010, 1, 3, 20, 0, 0, 17)}]
+        self.assertEqual(codec.loads(codec.dumps(value)), value)
+        self.assertRaises(TypeError, codec.dumps, object())
+    
+    def test_lazy_objects(self):
+        xml = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures', 'getpost.xml')).read()
+        lazy = LazyParser(None, FakeResponse(xml), [], True).parse()
+        self.assertEqual(typed(codec.loads(codec.dumps(lazy))), typed(self.fixture('getpost.xml', [])))
+    
+    def test_buffers(self):
+        post = self.fixture('readposts_1.xml')[0]
+        data = codec.dumps(post)
+        copy = codec.loads(data, buffers=True)
+        self.assertEqual(type(copy.body), buffer)
+        self.assertEqual(str(copy.body), post.body)
+        self.assertEqual(type(copy.title), str)
+    
+    def test_bad_data(self):
+        data = codec.dumps(self.fixture('getpost.xml', []))
+        self.assertRaises(PyposterousError, codec.loads, data[:-1])
+        self.assertRaises(PyposterousError, codec.loads, data[:100])
+        self.assertRaises(PyposterousError, codec.loads, data + 'x')
+        self.assertRaises(PyposterousError, codec.loads, '<rsp/>')
+        
+        # Data written for other models is refused.
+        self.assertRaises(PyposterousError, codec.loads, data[:4] + '\0\0\0\0' + data[8:])
+
+def typed(obj):
+    """Like expand, but keeps the types of values and objects."""
+    if isinstance(obj, list):
+        return [typed(item) for item in obj]
+    if not hasattr(obj, 'as_dict'):
+        return (type(obj), obj)
+    return (type(obj), dict((name, typed(value)) for name, value in obj.as_dict().items()))
+
+def expand(obj):
+    """Returns the attributes of obj, with nested objects expanded."""
+    if isinstance(obj, list):
+        return [expand(item) for item in obj]
+    if not hasattr(obj, 'as_dict'):
+        return obj
+    return dict((name, expand(value)) for name, value in obj.as_dict().items())
+
+class DateTests(unittest.TestCase):
+    def test_fast_parsers_match_parse_date(self):
+        from pyposterous import utils
+        
+        for date in ('Sun, 03 Jan 2010 12:00:00 -0800', 'Mon, 4 Jan 2010 08:30:00 +0000', 'Fri, 31 Dec 2010 23:59:59 -0500', 'Sat, 01 Jan 2011 00:30:00 +0530'):
+            utils.DATE_CACHE.clear()
+            self.assertEqual(utils.parse_post_date(date), utils.parse_date(date))
+            # Cached
+            self.assertEqual(utils.parse_post_date(date), utils.parse_date(date))
+        
+        timestamp = 'Wed Jan 06 20:49:51 -0200 2010'
+        self.assertEqual(utils.parse_timestamp(timestamp), utils.parse_date(timestamp, '%a %b %d %H:%M:%S %Y'))
+        self.assertEqual(utils.parse_timestamp(timestamp).hour, 22)
+        
+        # Other layouts go through parse_date.
+        self.assertEqual(utils.parse_post_date('Sun, 03 Jan 2010 -0800 12:00:00'), utils.parse_date('Sun, 03 Jan 2010 12:00:00 -0800'))
+        self.assertRaises(ValueError, utils.parse_post_date, 'Sun, 03 Foo 2010 12:00:00 -0800')
+        self.assertEqual(utils.DATE_CACHE.get('Sun, 03 Foo 2010 12:00:00 -0800'), None)
+
+class ModelTests(unittest.TestCase):
+    def test_models_are_slotted(self):
+        post = Parser(None, FakeResponse(POSTS_XML), ['force_list']).parse()[0]
+        self.assertFalse(hasattr(post, '__dict__'))
+        self.assertFalse(hasattr(post.comments[0], '__dict__'))
+        self.assertEqual(post.extra, None)
+        self.assertRaises(AttributeError, getattr, post, 'tag')
+    
+    def test_unknown_attributes(self):
+        xml = POSTS_XML.replace('<views>5</views>', '<views>5</views><sparkle>yes</sparkle>')
+        post = Parser(None, FakeResponse(xml), ['force_list']).parse()[0]
+        self.assertEqual(post.sparkle, 'yes')
+        self.assertEqual(post.extra, {'sparkle':'yes'})
+        self.assertEqual(post.as_dict()['sparkle'], 'yes')
+        
+        del post.sparkle
+        self.assertRaises(AttributeError, getattr, post, 'sparkle')
+        self.assertRaises(AttributeError, delattr, post, 'sparkle')
+    
+    def test_pickle(self):
+        import pickle
+        
+        post = Parser(API(), FakeResponse(POSTS_XML), ['force_list']).parse()[0]
+        post.sparkle = 'yes'
+        for protocol in (0, 2):
+            copy = pickle.loads(pickle.dumps(post, protocol))
+            self.assertEqual(copy.as_dict().keys(), post.as_dict().keys())
+            self.assertEqual(copy.date, post.date)
+            self.assertEqual(copy.comments[0].body, 'Nice.')
+            self.assertEqual(copy.api(), None)
+    
+    def test_converters(self):
+        from pyposterous import models
+        
+        # Only elements named exactly like an attribute_map entry are
+        # converted.
+        xml = POSTS_XML.replace('<views>5</views>', '<views>5</views><d>007</d><i>1</i>')
+        post = Parser(None, FakeResponse(xml), ['force_list']).parse()[0]
+        self.assertEqual((post.id, post.views, post.d, post.i), (1, 5, '007', '1'))
+        self.assertEqual(models.converter_index()['num_posts'], int)
+        
+        # Models can declare their own converters.
+        models.Comment.converters = {'author':lambda x: x.upper(), 'id':str}
+        models.reset_converters()
+        try:
+            post = Parser(None, FakeResponse(POSTS_XML), ['force_list']).parse()[0]
+            self.assertEqual(post.author, 'pyposttest')
+            self.assertEqual(post.comments[0].author, 'JANE DOE')
+            self.assertEqual(post.comments[0].id, '10')
+            self.assertEqual(post.comments[0].body, 'Nice.')
+        finally:
+            del models.Comment.converters
+            models.reset_converters()
+
+class TransportTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.api = API(host=self.server.host, transport=PooledTransport())
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_pooled_transport_reuses_connections(self):
+        for i in range(3):
+            posts = self.api.read_posts(hostname='pyposttest')
+            self.assertEqual(posts[0].title, 'Hello')
+            self.assertEqual(posts[0].comments[0].author, 'Jane Doe')
+        
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests[0][1], '/api/readposts')
+        self.assertEqual(self.server.requests[0][3], 'hostname=pyposttest')
+    
+    def test_pooled_transport_replaces_stale_connections(self):
+        self.api.read_posts(hostname='pyposttest')
+        # Close the idle socket behind the pool's back.
+        for conn, last_used in self.api.transport._PooledTransport__idle.values()[0]:
+            conn.sock.close()
+        
+        self.assertEqual(self.api.read_posts(hostname='pyposttest')[1].title, 'World')
+        self.assertEqual(self.server.connections, 2)
+    
+    def test_pooled_transport_doesnt_resend_writes(self):
+        import httplib
+        
+        def new_post(path, body):
+            # The post has been read; hang up without answering.
+            raise EnvironmentError("Connection dropped")
+        self.server.responses['/api/newpost'] = new_post
+        api = API('user', 'secret', host=self.server.host, transport=self.api.transport)
+        
+        api.read_posts(hostname='pyposttest')
+        self.assertRaises(httplib.HTTPException, api.new_post, title='Hello')
+        self.assertEqual(len([path for command, path, headers, body in self.server.requests if path == '/api/newpost']), 1)
+    
+    def test_host_changes(self):
+        self.api.read_posts(hostname='pyposttest')
+        other = StubServer()
+        try:
+            self.api.host = other.host
+            self.api.read_posts(hostname='pyposttest')
+            self.assertEqual((len(self.server.requests), len(other.requests)), (1, 1))
+        finally:
+            self.api.transport.close()
+            other.stop()
+    
+    def test_pooled_transport_http_errors(self):
+        self.server.responses['/api/getpost'] = (500, 'Oops')
+        self.assertRaises(PyposterousError, self.api.get_post, 'abc1')
+        self.assertEqual(self.api.read_posts()[0].id, 1)
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer({'/api/newpost':(200, POSTS_XML.split('<post>')[0] + '<post>' + POSTS_XML.split('<post>')[2] + '</rsp>')})
+        self.cache = ResponseCache(max_entries=2)
+        self.api = API('user', 'secret', host=self.server.host, transport=PooledTransport(), cache=self.cache)
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_cached_reads(self):
+        first = self.api.read_posts(hostname='pyposttest')
+        self.assertTrue(self.api.read_posts(hostname='pyposttest') is first)
+        self.assertEqual(len(self.server.requests), 1)
+        
+        # Different arguments are a different entry.
+        self.api.read_posts(hostname='pyposttest', page=2)
+        self.assertEqual(len(self.server.requests), 2)
+        
+        # Cursors go through the cache too.
+        cursor = Cursor(method=self.api.read_posts, num_posts=2, limit=2, parameters={'hostname':'pyposttest'})
+        list(cursor)
+        list(cursor)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 3))
+    
+    def test_cached_single_objects(self):
+        # get_post returns a single Post, streamed or not.
+        self.server.responses['/api/getpost'] = (200, POSTS_XML.split('<post>')[0] + '<post>' + POSTS_XML.split('<post>')[1] + '</rsp>')
+        post = self.api.get_post('abc1')
+        self.assertTrue(isinstance(post, Post))
+        self.assertEqual([streamed.id for streamed in self.api.get_post.stream(self.api, 'abc1')], [post.id])
+        self.assertTrue(self.api.get_post('abc1') is post)
+        
+        self.assertEqual([streamed.id for streamed in self.api.get_post.stream(self.api, 'abc2')], [1])
+        self.assertTrue(isinstance(self.api.get_post('abc2'), Post))
+        self.assertEqual(len(self.server.requests), 2)
+    
+    def test_lru_eviction_and_expiry(self):
+        self.api.read_posts(site_id=1)
+        self.api.read_posts(site_id=2)
+        self.api.read_posts(site_id=1)
+        self.api.read_posts(site_id=3)
+        self.assertEqual(len(self.server.requests), 3)
+        
+        # site 2 was the least recently used entry
+        self.api.read_posts(site_id=2)
+        self.assertEqual(len(self.server.requests), 4)
+        
+        for key, entry in self.cache.entries.items():
+            self.cache.entries.set(key, (entry[0], 0, entry[2]))
+        self.api.read_posts(site_id=2)
+        self.assertEqual(len(self.server.requests), 5)
+    
+    def test_writes_invalidate(self):
+        self.cache.entries.max_entries = 10
+        self.api.read_posts(site_id=1)
+        self.api.read_posts(site_id=2)
+        self.api.read_posts(hostname='pyposttest')
+        self.api.new_post(site_id=1, title='World')
+        
+        # Only entries that are known to belong to another site survive.
+        self.assertEqual([key[3] for key in self.cache.entries.entries.keys()], [(('site_id', '2'),)])
+        
+        self.api.new_post(title='World')
+        self.assertEqual(len(self.cache.entries), 0)
+
+class ConditionalRequestTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.server.etag = '"v1"'
+        self.validators = ValidatorCache()
+        self.api = API(host=self.server.host, transport=PooledTransport(), validators=self.validators)
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_not_modified_single_objects(self):
+        self.server.responses['/api/getpost'] = (200, POSTS_XML.split('<post>')[0] + '<post>' + POSTS_XML.split('<post>')[1] + '</rsp>')
+        post = self.api.get_post('abc1')
+        self.assertEqual([streamed.id for streamed in self.api.get_post.stream(self.api, 'abc1')], [post.id])
+        self.assertTrue(self.api.get_post('abc1') is post)
+        
+        self.assertEqual([streamed.id for streamed in self.api.get_post.stream(self.api, 'abc2')], [1])
+        self.assertTrue(isinstance(self.api.get_post('abc2'), Post))
+        self.assertEqual(self.validators.not_modified, 3)
+    
+    def test_not_modified(self):
+        first = self.api.read_posts(hostname='pyposttest')
+        self.assertTrue(self.api.read_posts(hostname='pyposttest') is first)
+        
+        command, path, headers, body = self.server.requests[1]
+        self.assertEqual((command, path), ('GET', '/api/readposts?hostname=pyposttest'))
+        self.assertEqual(headers['if-none-match'], '"v1"')
+        self.assertEqual(self.validators.not_modified, 1)
+        # The 304 left the connection usable.
+        self.assertEqual(self.server.connections, 1)
+        
+        # A new version is parsed again.
+        self.server.etag = '"v2"'
+        self.assertFalse(self.api.read_posts(hostname='pyposttest') is first)
+        
+        # Cursors send conditional requests too.
+        ids = [post.id for post in Cursor(method=self.api.read_posts, num_posts=2, limit=2, parameters={'hostname':'pyposttest'})]
+        ids += [post.id for post in Cursor(method=self.api.read_posts, num_posts=2, limit=2, parameters={'hostname':'pyposttest'})]
+        self.assertEqual(ids, [1, 2, 1, 2])
+        self.assertEqual(self.validators.not_modified, 2)
+    
+    def test_writes_are_not_conditional(self):
+        self.api = API('user', 'secret', host=self.server.host, transport=self.api.transport, validators=self.validators)
+        self.api.new_comment(1, 'Hi')
+        self.api.new_comment(1, 'Hi')
+        self.assertEqual([request[0] for request in self.server.requests], ['POST', 'POST'])
+        self.assertEqual(self.validators.not_modified, 0)
+
+class UploadTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer({'/api/newpost':(200, POSTS_XML.split('<post>')[0] + '<post>' + POSTS_XML.split('<post>')[2] + '</rsp>')})
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def test_encoder_streams_files(self):
+        import os
+        
+        media = open('test_assets/1.3gp', 'rb')
+        progress = []
+        encoder = MultipartEncoder([('title', u'Video \u2713'), ('media[]', media)], chunk_size=4096, callback=lambda sent, total: progress.append((sent, total)))
+        
+        chunks = [encoder.read(1000) for i in range(len(encoder) / 1000 + 2)]
+        body = ''.join(chunks)
+        self.assertEqual(len(body), len(encoder))
+        self.assertTrue(len(encoder) - os.path.getsize('test_assets/1.3gp') < 1000)
+        self.assertTrue(open('test_assets/1.3gp', 'rb').read() in body)
+        self.assertTrue('filename="1.3gp"' in body)
+        self.assertTrue('Video \xe2\x9c\x93' in body)
+        self.assertEqual(progress[-1], (len(encoder), len(encoder)))
+        self.assertTrue(max([len(chunk) for chunk in encoder]) <= 4096)
+        
+        # It can be sent again.
+        encoder.reset()
+        self.assertEqual(encoder.read(), body)
+    
+    def test_uploads(self):
+        for transport in (PooledTransport(), UrllibTransport()):
+            api = API('user', 'secret', host=self.server.host, transport=transport)
+            progress = []
+            images = [open('test_assets/1.jpg', 'rb'), open('test_assets/2.jpg', 'rb')]
+            post = api.new_post(title='Images', media=images, progress=lambda sent, total: progress.append(sent))
+            self.assertEqual(post.title, 'World')
+            
+            command, path, headers, body = self.server.requests[-1]
+            self.assertTrue(headers['content-type'].startswith('multipart/form-data; boundary='))
+            self.assertEqual(int(headers['content-length']), len(body))
+            self.assertEqual(progress[-1], len(body))
+            self.assertTrue(open('test_assets/2.jpg', 'rb').read() in body)
+            self.assertTrue('name="media[]"; filename="1.jpg"' in body)
+            transport.close()
+        
+        # Only methods that take files accept a progress callback.
+        self.assertRaises(TypeError, api.read_posts, progress=None)
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        import cgi
+        
+        def new_post(path, body):
+            if cgi.parse_qs(body).get('title') == ['fail']:
+                return 200, '<rsp stat="fail"><err code="1001" msg="Invalid site" /></rsp>'
+            if cgi.parse_qs(body).get('title') == ['drop']:
+                # Hang up without answering.
+                raise EnvironmentError("Connection dropped")
+            return 200, POSTS_XML.split('<post>')[0] + '<post>' + POSTS_XML.split('<post>')[2] + '</rsp>'
+        
+        self.server = StubServer({'/api/newpost':new_post})
+        self.api = API('user', 'secret', host=self.server.host, transport=PooledTransport(max_connections=8))
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_new_posts(self):
+        items = [{'title':'Post %s' % i, 'body':'Body'} for i in range(10)]
+        items[3] = {'title':'fail'}
+        
+        self.server.delay = 0.05
+        results = self.api.new_posts(items, workers=6, per_host=3)
+        
+        self.assertEqual(len(results), 10)
+        self.assertTrue(isinstance(results[3], PyposterousError))
+        self.assertEqual(results[3].error_code, '1001')
+        for result in results[:3] + results[4:]:
+            self.assertEqual(result.title, 'World')
+        self.assertEqual(len(self.server.requests), 10)
+        self.assertTrue(1 < self.server.max_active <= 3)
+    
+    def test_dropped_connections(self):
+        import httplib
+        
+        items = [{'title':'Post %s' % i} for i in range(4)]
+        items[1] = {'title':'drop'}
+        for transport in (PooledTransport(max_connections=8), UrllibTransport()):
+            api = API('user', 'secret', host=self.server.host, transport=transport)
+            results = api.new_posts(items, workers=2)
+            self.assertTrue(isinstance(results[1], httplib.HTTPException))
+            self.assertEqual([result.title for result in results[:1] + results[2:]], ['World'] * 3)
+            transport.close()
+    
+    def test_items_are_validated_first(self):
+        items = [{'title':'Fine'}, {'title':1}]
+        self.assertRaises(TypeError, self.api.new_posts, items)
+        self.assertEqual(self.server.requests, [])
+        
+        self.assertRaises(AttributeError, self.api.batch, 'test', [])
+        results = self.api.batch('new_comment', [(1, 'Hi'), (2, 'There')])
+        self.assertEqual([post.title for post in results[1]], ['Hello', 'World'])
+
+class FanOutTests(unittest.TestCase):
+    def setUp(self):
+        import cgi
+        
+        def read_posts(path, body):
+            site = cgi.parse_qs(body).get('hostname', cgi.parse_qs(body).get('site_id'))[0]
+            if site == 'slow':
+                time.sleep(0.5)
+            if site == 'broken':
+                return 200, '<rsp stat="fail"><err code="3001" msg="Invalid Posterous Site" /></rsp>'
+            return 200, POSTS_XML.replace('<title>', '<title>%s ' % site)
+        
+        tags = '<rsp stat="ok"><tag><id>1</id><tag_string>python</tag_string><count>2</count></tag></rsp>'
+        self.server = StubServer({'/api/readposts':read_posts, '/api/gettags':(200, tags)})
+        self.api = API(host=self.server.host, transport=PooledTransport(max_connections=8))
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_fetch_sites(self):
+        site = Site(self.api)
+        site.id = 5
+        result = fetch_sites(self.api, [site, 'other', 'broken', Site(self.api)], parameters={'read_posts':{'num_posts':2}})
+        
+        self.assertFalse(result.ok())
+        self.assertEqual([post.title for post in result.posts()], ['5 Hello', 'other Hello', '5 World', 'other World'])
+        self.assertEqual([str(tag) for tag in result.tags()['python']], ['python'] * 3)
+        
+        errors = result.errors()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(result.sites[2].errors['read_posts'].error_code, '3001')
+        self.assertEqual(sorted(result.sites[3].errors.keys()), ['get_tags', 'read_posts'])
+        
+        self.assertEqual(result.sites[0].get('get_tags')[0].tag_string, 'python')
+        self.assertEqual(len(self.server.requests), 6)
+        for command, path, headers, body in self.server.requests:
+            self.assertEqual('num_posts=2' in body, path == '/api/readposts')
+    
+    def test_per_site_timeout(self):
+        started = time.time()
+        result = fetch_sites(self.api, ['slow', 'fast'], methods=('read_posts',), timeout=0.2)
+        self.assertTrue(time.time() - started < 0.45)
+        
+        self.assertEqual(result.sites[1].get('read_posts')[0].title, 'fast Hello')
+        self.assertEqual(result.sites[0].results, {})
+        self.assertTrue(isinstance(result.sites[0].errors['read_posts'], PyposterousTimeout))
+        # Let the slow request finish before the server is stopped.
+        time.sleep(0.4)
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.failures = 2
+        self.drops = 0
+        
+        def flaky(path, body):
+            if self.drops:
+                self.drops -= 1
+                # Hang up without answering.
+                raise EnvironmentError("Connection dropped")
+            if self.failures:
+                self.failures -= 1
+                return 503, 'Service Unavailable'
+            return 200, POSTS_XML
+        
+        self.server = StubServer({'/api/readposts':flaky, '/api/newpost':flaky})
+        self.scheduler = Scheduler(retries=3, backoff=0.01)
+        self.api = API('user', 'secret', host=self.server.host, scheduler=self.scheduler)
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def test_reads_are_retried(self):
+        posts = self.api.read_posts(hostname='pyposttest')
+        self.assertEqual([post.title for post in posts], ['Hello', 'World'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.scheduler.retried, 2)
+        self.assertTrue(0 < self.scheduler.retry_time <= 0.03)
+        
+        # Streams are retried until the response is opened.
+        self.failures = 1
+        posts = list(self.api.read_posts.stream(self.api, hostname='pyposttest'))
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(self.scheduler.retried, 3)
+    
+    def test_give_up(self):
+        self.failures = 10
+        try:
+            self.api.read_posts(hostname='pyposttest')
+        except PyposterousError, e:
+            self.assertEqual(e.http_status, 503)
+        else:
+            self.fail("read_posts didn't raise")
+        self.assertEqual(len(self.server.requests), 4)
+        
+        # Connection errors are retried too.
+        self.server.stop()
+        self.assertRaises(IOError, self.api.read_posts, hostname='pyposttest')
+        self.assertEqual(self.scheduler.retried, 6)
+    
+    def test_dropped_connections(self):
+        import httplib
+        
+        self.failures = 0
+        self.drops = 1
+        self.assertEqual(len(self.api.read_posts(hostname='pyposttest')), 2)
+        self.assertEqual((len(self.server.requests), self.scheduler.retried), (2, 1))
+        
+        self.drops = 1
+        self.assertRaises(httplib.HTTPException, self.api.new_post, title='Hi')
+        self.assertEqual((len(self.server.requests), self.scheduler.retried), (3, 1))
+    
+    def test_writes_are_only_retried_if_safe(self):
+        self.assertRaises(PyposterousError, self.api.new_post, title='Hi')
+        self.assertEqual(len(self.server.requests), 1)
+        
+        config = dict(METHODS['application']['new_post'], retry_safe=True)
+        signature = Signature('new_post', config)
+        post = MethodCall(self.api, signature, (), {'title':'Hi'}).execute()
+        self.assertEqual(post[0].title, 'Hello')
+        self.assertEqual(len(self.server.requests), 3)
+        for command, path, headers, body in self.server.requests:
+            self.assertEqual(body, 'title=Hi')
+    
+    def test_rate_limit(self):
+        self.failures = 0
+        self.scheduler.rate = 20
+        self.scheduler.burst = 2
+        
+        started = time.time()
+        for i in range(6):
+            self.api.read_posts(hostname='pyposttest')
+        # 2 requests go out at once, the other 4 are spaced 1/20s apart.
+        self.assertTrue(time.time() - started >= 0.18)
+        self.assertEqual(self.scheduler.throttled, 4)
+        self.assertTrue(0.15 <= self.scheduler.throttle_time <= 0.3)
+        
+        # Other hosts and users have their own buckets.
+        other = API('other', 'secret', host=self.server.host, scheduler=self.scheduler)
+        other.read_posts(hostname='pyposttest')
+        self.assertEqual(self.scheduler.throttled, 4)
+
+class TimeoutTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.server.delay = 0.3
+        self.api = API(host=self.server.host, transport=PooledTransport(), timeout=0.1)
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_timeouts(self):
+        started = time.time()
+        self.assertRaises(PyposterousTimeout, self.api.read_posts, hostname='pyposttest')
+        self.assertTrue(time.time() - started < 0.25)
+        
+        # Per call timeouts override the API's.
+        self.assertEqual(len(self.api.read_posts(hostname='pyposttest', timeout=(1, 2))), 2)
+        
+        api = API(host=self.server.host, timeout=0.1)
+        self.assertRaises(PyposterousTimeout, api.read_posts, hostname='pyposttest')
+        self.assertRaises(PyposterousTimeout, api.read_posts.stream(api, hostname='pyposttest').next)
+    
+    def test_deadline(self):
+        self.assertRaises(PyposterousTimeout, self.api.get_tags, deadline=time.time() - 1)
+        self.assertEqual(self.server.requests, [])
+        
+        self.assertRaises(PyposterousTimeout, self.api.get_tags, timeout=5, deadline=time.time() + 0.1)
+        self.assertEqual(len(self.server.requests), 0)
+        time.sleep(0.3)
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def test_cursor_deadline(self):
+        self.server.delay = 0.1
+        self.api.timeout = None
+        
+        # Every page is full, so the cursor never runs out of pages.
+        for prefetch in (0, 2):
+            started = time.time()
+            cursor = Cursor(method=self.api.read_posts, num_posts=2, prefetch=prefetch, timeout=0.35)
+            titles = []
+            try:
+                for post in cursor:
+                    titles.append(post.title)
+            except PyposterousTimeout:
+                pass
+            else:
+                self.fail("The cursor didn't time out")
+            self.assertTrue(time.time() - started < 0.5)
+            self.assertTrue(2 <= len(titles) <= 8)
+    
+    def test_future_timeout(self):
+        api = AsyncAPI(host=self.server.host, workers=1)
+        try:
+            future = api.read_posts()
+            self.assertRaises(PyposterousTimeout, future.result, 0.05)
+            self.assertEqual(len(future.result(5)), 2)
+        finally:
+            api.close()
+
+class StatsTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer({'/api/getpost':(200, '<rsp stat="fail"><err code="3001" msg="Invalid post" /></rsp>')})
+        self.timings = []
+        self.stats = Stats(hooks=[self.timings.append])
+        self.api = API(host=self.server.host, transport=PooledTransport(), stats=self.stats, cache=ResponseCache())
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def test_stats(self):
+        self.server.delay = 0.05
+        self.api.read_posts(hostname='pyposttest')
+        
+        timing = self.timings[0]
+        self.assertEqual(timing.method, 'read_posts')
+        self.assertTrue(timing.wait >= 0.05)
+        self.assertEqual(timing.bytes, len(POSTS_XML))
+        # 2 posts and a comment
+        self.assertEqual(timing.objects, 3)
+        self.assertTrue(timing.construct > 0)
+        self.assertTrue(timing.parse >= 0)
+        self.assertTrue(timing.build > 0)
+        self.assertEqual(timing.error, None)
+        
+        # Cached results and errors are counted too.
+        self.api.read_posts(hostname='pyposttest')
+        self.assertRaises(PyposterousError, self.api.get_post, 'abc1')
+        
+        stats = self.stats.get('read_posts')
+        self.assertEqual((stats.calls, stats.cached, stats.errors, stats.objects), (2, 1, 0, 3))
+        self.assertTrue(stats.network >= 0.05)
+        self.assertEqual(self.stats.get('get_post').errors, 1)
+        self.assertEqual(self.stats.get('get_tags').calls, 0)
+        self.assertTrue('read_posts' in self.stats.report())
+    
+    def test_streams(self):
+        stream = self.api.read_posts.stream(self.api, hostname='other')
+        self.assertEqual(stream.next().title, 'Hello')
+        self.assertEqual(self.timings, [])
+        stream.close()
+        
+        self.assertEqual(len(self.timings), 1)
+        self.assertTrue(0 < self.timings[0].objects <= 3)
+        self.assertEqual(self.timings[0].bytes, len(POSTS_XML))
+        
+        for post in self.api.read_posts.stream(self.api, hostname='another'):
+            pass
+        self.assertEqual(self.stats.get('read_posts').calls, 2)
+        self.assertEqual(self.timings[1].objects, 3)
+    
+    def test_disabled(self):
+        api = API(host=self.server.host)
+        api.read_posts()
+        self.assertEqual(self.timings, [])
+        self.assertEqual(api.read_posts.stream(api).next().title, 'Hello')
+
+class AsyncAPITests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.api = AsyncAPI(host=self.server.host, workers=4)
+    
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+    
+    def test_async_methods_return_futures(self):
+        futures = [self.api.read_posts(hostname='pyposttest', page=page) for page in range(1, 21)]
+        for future in futures:
+            posts = future.result(10)
+            self.assertEqual([post.title for post in posts], ['Hello', 'World'])
+        
+        self.assertEqual(len(self.server.requests), 20)
+        self.assertTrue(self.server.connections <= 4)
+    
+    def test_async_argument_validation(self):
+        # Arguments are checked before anything is queued.
+        self.assertRaises(TypeError, self.api.get_post)
+        self.assertRaises(TypeError, self.api.read_posts, site_id='1')
+        self.assertRaises(PyposterousError, self.api.get_sites)
+    
+    def test_async_errors(self):
+        self.server.responses['/api/getpost'] = (200, '<rsp stat="fail"><err code="3001" msg="Invalid Post.ly shortcode" /></rsp>')
+        future = self.api.get_post('nope')
+        self.assertRaises(PyposterousError, future.result, 10)
+        self.assertEqual(future.exception().error_code, '3001')
+
+class ProcessAPITests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.api = ProcessAPI(host=self.server.host, workers=4, processes=2)
+    
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+    
+    def test_parse_in_processes(self):
+        futures = [self.api.read_posts(hostname='pyposttest', page=page) for page in range(1, 6)]
+        expected = API(host=self.server.host).read_posts(hostname='pyposttest')
+        for future in futures:
+            posts = future.result(10)
+            self.assertEqual(codec.dumps(posts), codec.dumps(expected))
+            self.assertTrue(posts[0].api() is self.api)
+        
+        # Projections are applied in the parsing process.
+        posts = self.api.read_posts(hostname='pyposttest', fields=['id', 'title']).result(10)
+        self.assertEqual([post.as_dict() for post in posts], [{'id':1, 'title':'Hello'}, {'id':2, 'title':'World'}])
+    
+    def test_errors(self):
+        self.server.responses['/api/getpost'] = (200, '<rsp stat="fail"><err code="3001" msg="Invalid Post.ly shortcode" /></rsp>')
+        future = self.api.get_post('nope')
+        self.assertRaises(PyposterousError, future.result, 10)
+        self.assertEqual(future.exception().error_code, '3001')
+        
+        self.server.responses['/api/getpost'] = (502, 'Bad Gateway')
+        self.assertEqual(self.api.get_post('nope').exception(10).http_status, 502)
+
+class CursorTests(unittest.TestCase):
+    def setUp(self):
+        import cgi
+        
+        # Pages 1 through 3 are full, page 4 only has one post. Pages in
+        # self.failures fail that many times first.
+        self.failures = {}
+        def read_posts(path, body):
+            page = int(cgi.parse_qs(body).get('page', ['1'])[0])
+            if self.failures.get(page):
+                self.failures[page] -= 1
+                return 503, 'Service Unavailable'
+            if page < 4:
+                return 200, POSTS_XML
+            return 200, POSTS_XML.split('<post>')[0] + '<post>' + POSTS_XML.split('<post>')[1] + '</rsp>'
+        
+        self.server = StubServer({'/api/readposts':read_posts})
+        self.api = API(host=self.server.host, transport=PooledTransport())
+    
+    def tearDown(self):
+        self.api.transport.close()
+        self.server.stop()
+    
+    def pages_requested(self):
+        import cgi
+        return sorted([int(cgi.parse_qs(body)['page'][0]) for command, path, headers, body in self.server.requests])
+    
+    def test_prefetch_stops_at_short_page(self):
+        cursor = Cursor(method=self.api.read_posts, num_posts=2, prefetch=2, parameters={'hostname':'pyposttest'})
+        self.assertEqual(len(list(cursor)), 7)
+        
+        # Pages past the short page may be requested, but only within the
+        # prefetch window.
+        self.assertEqual(self.pages_requested()[:4], [1, 2, 3, 4])
+        self.assertTrue(len(self.server.requests) <= 6)
+        
+        # The cursor can be iterated again.
+        self.assertEqual(len(list(cursor)), 7)
+    
+    def test_prefetch_respects_limit(self):
+        cursor = Cursor(method=self.api.read_posts, num_posts=2, start_page=2, limit=3, prefetch=4, parameters={'hostname':'pyposttest'})
+        self.assertEqual(len(list(cursor)), 3)
+        self.assertEqual(self.pages_requested(), [2, 3])
+    
+    def test_streaming_cursor(self):
+        ids = [post.id for post in Cursor(method=self.api.read_posts, num_posts=2, limit=5, parameters={'hostname':'pyposttest'})]
+        self.assertEqual(ids, [1, 2, 1, 2, 1])
+        self.assertEqual(self.pages_requested(), [1, 2, 3])
+    
+    def drain(self, cursor):
+        """Returns the ids of the posts cursor returns and the number of
+        errors it raised, calling next() again after each error."""
+        ids, errors = [], 0
+        while True:
+            try:
+                ids.append(cursor.next().id)
+            except StopIteration:
+                return ids, errors
+            except PyposterousError:
+                errors += 1
+    
+    def test_failed_page_is_retried(self):
+        self.failures[2] = 1
+        cursor = Cursor(method=self.api.read_posts, num_posts=2, parameters={'hostname':'pyposttest'})
+        self.assertEqual(self.drain(cursor), ([1, 2, 1, 2, 1, 2, 1], 1))
+        self.assertEqual(self.pages_requested(), [1, 2, 2, 3, 4])
+    
+    def wait_for_threads(self, count):
+        """Returns True once no more than count threads are running."""
+        for i in range(100):
+            # The server has a thread for every open connection.
+            self.api.transport.close()
+            if threading.activeCount() <= count:
+                return True
+            time.sleep(0.02)
+        return False
+    
+    def test_failed_prefetched_page_is_retried(self):
+        threads = threading.activeCount()
+        self.failures[2] = 1
+        cursor = Cursor(method=self.api.read_posts, num_posts=2, prefetch=2, parameters={'hostname':'pyposttest'})
+        self.assertEqual(self.drain(cursor), ([1, 2, 1, 2, 1, 2, 1], 1))
+        # The threads of the pool that was shut down after the failure 
+        # don't linger.
+        self.assertTrue(self.wait_for_threads(threads))
+    
+    def test_prefetch_threads_stop(self):
+        threads = threading.activeCount()
+        for i in range(5):
+            cursor = Cursor(method=self.api.read_posts, num_posts=2, prefetch=3, parameters={'hostname':'pyposttest'})
+            for post in cursor:
+                break
+            cursor.close()
+        self.assertTrue(self.wait_for_threads(threads))
+        
+        with Cursor(method=self.api.read_posts, num_posts=2, prefetch=3, parameters={'hostname':'pyposttest'}) as cursor:
+            self.assertEqual(cursor.next().id, 1)
+        self.assertTrue(self.wait_for_threads(threads))
+        
+        # Closed cursors start over.
+        self.assertEqual(len(list(cursor)), 7)
+        self.assertTrue(self.wait_for_threads(threads))
+    
+    def test_prefetch_matches_serial_order(self):
+        serial = [post.id for post in Cursor(method=self.api.read_posts, num_posts=2, limit=5, parameters={'hostname':'pyposttest'})]
+        prefetched = [post.id for post in Cursor(method=self.api.read_posts, num_posts=2, limit=5, prefetch=3, parameters={'hostname':'pyposttest'})]
+        self.assertEqual(serial, prefetched)
             
 if __name__ == '__main__':
     unittest.main()